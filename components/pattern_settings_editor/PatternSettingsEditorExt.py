@@ -71,7 +71,7 @@ class PatternSettingsEditor(ExtensionBase):
 			'name': groupinfo.groupname,
 			'generated': True,
 			'info': groupinfo.ToJsonDict(),
-			'shapes': groupinfo.allShapeIndices,
+			'shapes': set(groupinfo.allShapeIndices),
 			'stepshapes': [
 				list(step.shapeindices)
 				for step in groupinfo.sequencesteps
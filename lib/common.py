@@ -1,6 +1,8 @@
 from collections import defaultdict
+import copy
 import datetime
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, fields, is_dataclass
+from enum import Enum
 import json
 import math
 from typing import Any, Dict, Iterable, List, Optional, Union
@@ -308,7 +310,16 @@ class BaseDataObject:
 		} if nodes else {}
 
 	def Clone(self):
-		return self.FromJsonDict(self.ToJsonDict())
+		"""
+		Copies the attributes directly, without going through the JSON dict. Immutable values
+		like tuples are shared, while nested model objects, lists and dicts are copied.
+		"""
+		clone = self.__class__.__new__(self.__class__)
+		clone.__dict__.update({
+			key: _cloneValue(val)
+			for key, val in self.__dict__.items()
+		})
+		return clone
 
 	@classmethod
 	def CloneList(cls, items: 'List[BaseDataObject]'):
@@ -363,6 +374,28 @@ class BaseDataObject:
 					val = ' '.join(val)
 				cell.val = val
 
+_immutableTypes = (str, int, float, bool, tuple, frozenset, bytes, Enum)
+_exactImmutableTypes = {type(None), str, int, float, bool, tuple, frozenset, bytes}
+
+def _cloneValue(val):
+	valtype = type(val)
+	if valtype in _exactImmutableTypes:
+		return val
+	if valtype is list:
+		return [_cloneValue(v) for v in val]
+	if valtype is dict:
+		return {key: _cloneValue(v) for key, v in val.items()}
+	if isinstance(val, BaseDataObject):
+		return val.Clone()
+	if isinstance(val, _immutableTypes):
+		return val
+	if is_dataclass(val) and hasattr(val, '__dict__'):
+		clone = copy.copy(val)
+		for field in fields(val):
+			setattr(clone, field.name, _cloneValue(getattr(val, field.name)))
+		return clone
+	return copy.deepcopy(val)
+
 def addDictRow(dat, obj: Dict[str, Any]):
 	r = dat.numRows
 	dat.appendRow([])
@@ -603,6 +636,61 @@ def formatValueList(vals, nonevalue=NULL_PLACEHOLDER):
 		return None
 	return ' '.join([formatValue(i, nonevalue=nonevalue) for i in vals])
 
+def _parseIndexRange(val: str):
+	start, sep, end = val.partition('-')
+	if not sep or not start.isdigit() or not end.isdigit():
+		return None
+	return range(int(start), int(end) + 1)
+
+def parseIndexList(val) -> List[int]:
+	"""
+	Parses a list of indices written by formatIndexList(), where runs of consecutive
+	indices are written as ranges like "0-499 612 700-799".
+	"""
+	if isinstance(val, str) and val:
+		results = []
+		try:
+			for part in val.split(' '):
+				start, sep, end = part.partition('-')
+				if sep:
+					results.extend(range(int(start), int(end) + 1))
+				else:
+					results.append(int(part))
+			return results
+		except ValueError:
+			pass
+		# lists with other values, which formatIndexList() writes without ranges
+		results = []
+		for part in val.split(' '):
+			indexrange = _parseIndexRange(part)
+			if indexrange is not None:
+				results.extend(indexrange)
+			else:
+				results.append(parseValue(part))
+		return results
+	return parseValueList(val)
+
+def formatIndexList(vals: List[int]):
+	"""
+	Formats a list of indices as a string, with runs of 3 or more consecutive increasing
+	indices written as ranges like "0-499 612 700-799".
+	"""
+	if not vals or set(map(type, vals)) != {int} or min(vals) < 0:
+		return formatValueList(vals)
+	parts = []
+	n = len(vals)
+	i = 0
+	while i < n:
+		j = i
+		while j + 1 < n and vals[j + 1] == vals[j] + 1:
+			j += 1
+		if j - i >= 2:
+			parts.append('{}-{}'.format(vals[i], vals[j]))
+		else:
+			parts.extend(map(str, vals[i:j + 1]))
+		i = j + 1
+	return ' '.join(parts)
+
 class ValueRange:
 	def __init__(self, valrange):
 		self.low, self.high = valrange or (None, None)
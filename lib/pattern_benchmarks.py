@@ -0,0 +1,231 @@
+import json
+from pathlib import Path
+import time
+from typing import Callable, Iterable, List
+
+from .common import LoggableBase, Log
+from .records import ObjectSchema, AttrSchema, ListTypeHandler
+
+from pattern_model import GroupInfo, ShapeInfo, ShapeTable, PatternSettings, DepthLayeringSpec, PatternData, PointData
+from pattern_model import PathInfo
+from pattern_model import ShapeState, TransformSpec, TextureLayer
+from pattern_model import SequenceBySpec
+from pattern_model import groupInfoSchema, shapeInfoSchema
+from pattern_groups import _AttributeShapeSequencer, _PathShapeSequencer
+from pattern_loader import PatternBuilder
+
+print('pattern_benchmarks.py loading...')
+
+# noinspection PyUnreachableCode
+if False:
+	# noinspection PyUnresolvedReferences
+	from _stubs import *
+
+# Benchmarks for pattern building code, meant to be run from the textport, for example:
+#   mod.pattern_benchmarks.benchmarkPostProcessing()
+
+class _BenchmarkHost(LoggableBase):
+	def __init__(self, patterndata: PatternData, patternsettings: PatternSettings):
+		self.patterndata = patterndata
+		self.patternsettings = patternsettings
+
+	def _LogEvent(self, event, indentafter=False, unindentbefore=False):
+		pass
+
+def createSyntheticPattern(shapecount: int, groupsize=10) -> PatternData:
+	"""
+	Creates a pattern with a grid of square shapes, and groups of `groupsize` shapes that
+	have depth layers and rotate axes.
+	"""
+	table = ShapeTable()
+	columns = max(1, int(shapecount ** 0.5))
+	shapes = []
+	for i in range(shapecount):
+		x, y = i % columns, i // columns
+		shape = ShapeInfo(
+			shapeindex=i,
+			shapename='shape{}'.format(i),
+			shapepath='svg/path[{}]'.format(i),
+			color=[i % 256, (i * 7) % 256, (i * 13) % 256, 255],
+			shapelength=4.0,
+			points=[
+				PointData(pos=[x, y, 0.0], absdist=0.0, reldist=0.0),
+				PointData(pos=[x + 1, y, 0.0], absdist=1.0, reldist=0.25),
+				PointData(pos=[x + 1, y + 1, 0.0], absdist=2.0, reldist=0.5),
+				PointData(pos=[x, y + 1, 0.0], absdist=3.0, reldist=0.75),
+			],
+			table=table)
+		shapes.append(shape)
+	table.calculateCenters()
+	table.calculateRadiuses()
+	groups = []
+	for groupnum, start in enumerate(range(0, shapecount, groupsize)):
+		groups.append(GroupInfo(
+			groupname='group{}'.format(groupnum),
+			depthlayer=groupnum % 4,
+			depth=(groupnum % 4) * 0.1,
+			rotateaxis=float(groupnum % 3),
+			shapeindices=list(range(start, min(start + groupsize, shapecount))),
+		))
+	return PatternData(shapes=shapes, groups=groups)
+
+def _timeCall(func: Callable, repeat: int):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def _logResults(title: str, sizes: List[int], results: List[List[float]], labels: List[str]):
+	Log(title)
+	Log('  {:>8} '.format('shapes') + ' '.join('{:>24}'.format(label) for label in labels))
+	for size, times in zip(sizes, results):
+		Log('  {:>8} '.format(size) + ' '.join(
+			'{:>11.2f}ms {:>7.2f}us/sh'.format(t * 1000, t * 1000000 / size)
+			for t in times))
+
+def benchmarkPostProcessing(sizes: Iterable[int] = (1000, 2000, 4000, 8000, 16000), repeat=3):
+	"""
+	Times the post-processing passes that look up shapes by index. With indexed lookups the
+	time per shape should stay roughly flat as the number of shapes grows.
+	"""
+	sizes = list(sizes)
+	labels = ['depth layering', 'rotate axes', 'attribute sequencing', 'shapes by indices']
+	results = []
+	for size in sizes:
+		patterndata = createSyntheticPattern(size)
+		settings = PatternSettings(depthlayering=DepthLayeringSpec(defaultlayer=0))
+		host = _BenchmarkHost(patterndata, settings)
+		sequencer = _AttributeShapeSequencer(None, SequenceBySpec(seqtype='x'))
+		allindices = list(range(size))
+		results.append([
+			_timeCall(lambda: PatternBuilder._ApplyDepthLayeringToShapes(host), repeat),
+			_timeCall(lambda: PatternBuilder._ApplyRotateAxesToShapes(host), repeat),
+			_timeCall(lambda: sequencer.sequenceShapes(allindices, patterndata), repeat),
+			_timeCall(lambda: [
+				patterndata.getShapesByIndices(group.shapeindices)
+				for group in patterndata.groups
+			], repeat),
+		])
+	_logResults('Post-processing passes', sizes, results, labels)
+	return results
+
+def benchmarkPathSequencing(sizes: Iterable[int] = (1000, 4000, 16000), repeat=3):
+	"""
+	Times sequencing all shapes of a synthetic pattern along a diagonal path with one point
+	per shape.
+	"""
+	sizes = list(sizes)
+	results = []
+	for size in sizes:
+		patterndata = createSyntheticPattern(size)
+		columns = max(1, int(size ** 0.5))
+		patterndata.addPaths([
+			PathInfo(
+				shapename='seqpath',
+				shapepath='svg/path[seqpath]',
+				points=[
+					PointData(pos=[i % columns + 0.5, i // columns + 0.5, 0.0])
+					for i in range(size)
+				])
+		])
+		sequencer = _PathShapeSequencer(None, SequenceBySpec(seqtype='path', path='svg/path\\[seqpath\\]'))
+		allindices = list(range(size))
+		results.append([
+			_timeCall(lambda: sequencer.sequenceShapes(allindices, patterndata), repeat),
+		])
+	_logResults('Path sequencing', sizes, results, ['path sequencing'])
+	return results
+
+def _uncompiledSchema(schema: ObjectSchema) -> ObjectSchema:
+	attrs = []
+	for attr in schema.attrs:
+		handler = attr.typehandler
+		if isinstance(handler, ListTypeHandler) and isinstance(handler.elementHandler, ObjectSchema):
+			handler = ListTypeHandler(_uncompiledSchema(handler.elementHandler))
+		attrs.append(AttrSchema(
+			attr.name, handler, jsonname=attr.jsonname, default=attr.default, omitfalsy=attr.omitfalsy))
+	return ObjectSchema(schema.type, *attrs)
+
+def benchmarkJsonCodecs(folder='data', repeat=3):
+	"""
+	Times decoding and encoding the shapes and groups of the pattern JSON files in a folder,
+	with the generic (interpreted) schema codecs and the compiled ones.
+	"""
+	schemas = [
+		('shapes', shapeInfoSchema, _uncompiledSchema(shapeInfoSchema)),
+		('groups', groupInfoSchema, _uncompiledSchema(groupInfoSchema)),
+	]
+	totals = {}
+	for filepath in sorted(Path(folder).glob('*.json')):
+		obj = json.loads(filepath.read_text())
+		for key, compiled, generic in schemas:
+			items = obj.get(key) or []
+			if not items:
+				continue
+			decoded = [compiled.fromJsonValue(item) for item in items]
+			times = [
+				_timeCall(lambda: [generic.fromJsonValue(item) for item in items], repeat),
+				_timeCall(lambda: [compiled.fromJsonValue(item) for item in items], repeat),
+				_timeCall(lambda: [generic.toJsonValue(item) for item in decoded], repeat),
+				_timeCall(lambda: [compiled.toJsonValue(item) for item in decoded], repeat),
+			]
+			count, total = totals.get(key, (0, [0.0] * len(times)))
+			totals[key] = count + len(items), [a + b for a, b in zip(total, times)]
+	Log('JSON codecs ({})'.format(folder))
+	labels = ['generic decode', 'compiled decode', 'generic encode', 'compiled encode']
+	Log('  {:>8} {:>8} '.format('', 'count') + ' '.join('{:>24}'.format(label) for label in labels))
+	for key, (count, times) in totals.items():
+		Log('  {:>8} {:>8} '.format(key, count) + ' '.join(
+			'{:>11.2f}ms {:>7.2f}us/ea'.format(t * 1000, t * 1000000 / count)
+			for t in times))
+	return totals
+
+def benchmarkLeanPoints(folder='data', precision=0.0001, repeat=3):
+	"""
+	Compares the size and load time of the pattern JSON files in a folder when they are
+	written with full points and with lean points quantized to `precision`.
+	"""
+	sizes = [0, 0]
+	times = [0.0, 0.0]
+	for filepath in sorted(Path(folder).glob('*.json')):
+		obj = json.loads(filepath.read_text())
+		obj.pop('settings', None)
+		patterndata = PatternData.FromJsonDict(obj)
+		for i, pointprecision in enumerate([None, precision]):
+			text = json.dumps(patterndata.ToJsonDict(pointprecision=pointprecision), sort_keys=True)
+			sizes[i] += len(text)
+			times[i] += _timeCall(lambda: PatternData.FromJsonDict(json.loads(text)), repeat)
+	Log('Lean points ({}, precision {})'.format(folder, precision))
+	Log('  {:>8} {:>10} {:>10}'.format('', 'size', 'load'))
+	for label, size, t in zip(['full', 'lean'], sizes, times):
+		Log('  {:>8} {:>8.2f}MB {:>8.2f}ms'.format(label, size / 1000000, t * 1000))
+	return sizes, times
+
+def benchmarkClones(count=10000, repeat=3):
+	"""
+	Times cloning model objects attribute by attribute, compared to round-tripping them
+	through their JSON dicts.
+	"""
+	objs = [
+		('ShapeState', ShapeState.DefaultState()),
+		('TransformSpec', TransformSpec.DefaultTransformSpec()),
+		('TextureLayer', TextureLayer.DefaultTextureLayer()),
+	]
+	labels = ['json round trip', 'clone']
+	Log('Clones ({} each)'.format(count))
+	Log('  {:>14} '.format('') + ' '.join('{:>24}'.format(label) for label in labels))
+	results = []
+	for name, obj in objs:
+		times = [
+			_timeCall(lambda: [obj.FromJsonDict(obj.ToJsonDict()) for _ in range(count)], repeat),
+			_timeCall(lambda: [obj.Clone() for _ in range(count)], repeat),
+		]
+		Log('  {:>14} '.format(name) + ' '.join(
+			'{:>11.2f}ms {:>7.2f}us/ea'.format(t * 1000, t * 1000000 / count)
+			for t in times))
+		results.append(times)
+	return results
@@ -0,0 +1,426 @@
+"""
+Binary container format for PatternData.
+
+This is written next to the JSON output of the pattern builder, and can be loaded much
+faster since the bulk of the data is stored as typed arrays instead of JSON.
+
+Layout (all values little-endian):
+	- magic (4 bytes: 'PATB'), format version (uint32), header length (uint32)
+	- JSON header (UTF-8), padded to a multiple of 8 bytes
+	- typed arrays, each starting at a multiple of 8 bytes
+
+The header has the pattern metadata (title, size, paths), the groups and sequence steps
+(with their shape indices replaced by ranges within the `groupindices` array), the string
+attributes of the shapes, and the type, offset and length of each array.
+The pattern settings are not included.
+
+Files can also be loaded lazily, with the point arrays (the bulk of the data) left in the
+file until something first uses them.
+"""
+
+from array import array
+import dataclasses
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from .common import excludekeys
+
+from pattern_model import GroupInfo, PatternData, SequenceStep, ShapeTable
+
+print('pattern_binary.py loading...')
+
+# noinspection PyUnreachableCode
+if False:
+	# noinspection PyUnresolvedReferences
+	from _stubs import *
+
+_Magic = b'PATB'
+_FormatVersion = 1
+_Prefix = struct.Struct('<4sII')
+_Alignment = 8
+
+# name and typecode of each array, in the order they're stored
+_ArrayTypes = [
+	('coords', 'd'),
+	('absdists', 'd'),
+	('reldists', 'd'),
+	('pointcounts', 'i'),
+	('shapeindices', 'i'),
+	('shapelengths', 'd'),
+	('centers', 'd'),
+	('radiuses', 'd'),
+	('dupcounts', 'i'),
+	# r, g, b, a for each shape, with -1 for missing components
+	('colors', 'h'),
+	('groupindices', 'i'),
+	# whether each shape's last point repeats its first, so that the shape attributes can be
+	# built without reading the points (absent in files written before this was added)
+	('openloops', 'b'),
+]
+
+def GetPatternBinaryFileName(jsonfilename: str):
+	if not jsonfilename or not jsonfilename.endswith('.json'):
+		return None
+	return jsonfilename[:-len('.json')] + '.patb'
+
+class PatternFormatError(Exception):
+	pass
+
+def _padding(length: int):
+	return -length % _Alignment
+
+def _toLittleEndian(arr: array):
+	if sys.byteorder != 'little':
+		arr = array(arr.typecode, arr)
+		arr.byteswap()
+	return arr
+
+def _colorComponent(val) -> int:
+	# negative values are reserved for missing components, and the values are stored as int16
+	return min(max(int(val), 0), 32767)
+
+def _shapeColumns(table: ShapeTable, rows: List[int]) -> Dict[str, array]:
+	coords = array('d')
+	absdists = array('d')
+	reldists = array('d')
+	colors = array('h')
+	for row in rows:
+		start = table.pointstarts[row]
+		end = start + table.pointcounts[row]
+		coords.extend(table.coords[start * 3:end * 3])
+		absdists.extend(table.absdists[start:end])
+		reldists.extend(table.reldists[start:end])
+		color = table.colors[row] or ()
+		colors.extend([_colorComponent(val) for val in color[:4]] + [-1] * (4 - min(len(color), 4)))
+	return {
+		'coords': coords,
+		'absdists': absdists,
+		'reldists': reldists,
+		'pointcounts': array('i', [table.pointcounts[row] for row in rows]),
+		'shapeindices': array('i', [table.shapeindices[row] for row in rows]),
+		'shapelengths': array('d', [table.shapelengths[row] for row in rows]),
+		'centers': array('d', [
+			table.centers[row * 3 + axis]
+			for row in rows
+			for axis in range(3)
+		]),
+		'radiuses': array('d', [table.radiuses[row] for row in rows]),
+		'dupcounts': array('i', [table.dupcounts[row] for row in rows]),
+		'colors': colors,
+		'openloops': array('b', [table.isOpenLoop(row) for row in rows]),
+	}
+
+def _groupToHeaderDict(group: GroupInfo, groupindices: array):
+	def addIndices(shapeindices: List[int]):
+		start = len(groupindices)
+		groupindices.extend(shapeindices)
+		return [start, len(shapeindices)]
+
+	obj = dataclasses.replace(group, shapeindices=None, sequencesteps=None).ToJsonDict()
+	obj['shapeindices'] = addIndices(group.shapeindices)
+	steps = []
+	for step in group.sequencesteps:
+		stepobj = dataclasses.replace(step, shapeindices=None).ToJsonDict()
+		stepobj['shapeindices'] = addIndices(step.shapeindices)
+		steps.append(stepobj)
+	obj['sequencesteps'] = steps
+	return obj
+
+def patternToBytes(patterndata: PatternData) -> bytes:
+	table = patterndata.shapetable
+	# shapes and groups are stored in the same order as in the JSON output
+	rows = sorted(range(len(table)), key=table.shapeindices.__getitem__)
+	arrays = _shapeColumns(table, rows)
+	groupindices = array('i')
+	groups = [
+		_groupToHeaderDict(group, groupindices)
+		for group in sorted(patterndata.groups, key=lambda g: g.groupname)
+	]
+	arrays['groupindices'] = groupindices
+	header = PatternData(
+		paths=patterndata.paths,
+		title=patterndata.title,
+		svgwidth=patterndata.svgwidth,
+		svgheight=patterndata.svgheight,
+		scale=patterndata.scale,
+		**patterndata.attrs).ToJsonDict()
+	header['groups'] = groups
+	header['shapes'] = {
+		'count': len(rows),
+		'shapenames': [table.shapenames[row] for row in rows],
+		'shapepaths': [table.shapepaths[row] for row in rows],
+		'parentpaths': [table.parentpaths[row] for row in rows],
+		'depthlayers': [table.depthlayers[row] for row in rows],
+		'rotateaxes': [table.rotateaxes[row] for row in rows],
+	}
+
+	# array offsets depend on the header length, which depends on the offsets, so space is
+	# reserved for the header until it fits, and the rest is padded with whitespace
+	arrayinfos = {name: [typecode, 0, len(arrays[name])] for name, typecode in _ArrayTypes}
+	header['arrays'] = arrayinfos
+	reserved = -1
+	while True:
+		headerbytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+		if len(headerbytes) <= reserved:
+			break
+		reserved = len(headerbytes) + 64
+		offset = _Prefix.size + reserved
+		offset += _padding(offset)
+		for name, _ in _ArrayTypes:
+			arrayinfos[name][1] = offset
+			offset += len(arrays[name]) * arrays[name].itemsize
+			offset += _padding(offset)
+	headerbytes += b' ' * (arrayinfos[_ArrayTypes[0][0]][1] - _Prefix.size - len(headerbytes))
+
+	output = bytearray(_Prefix.pack(_Magic, _FormatVersion, len(headerbytes)))
+	output += headerbytes
+	for name, _ in _ArrayTypes:
+		output += b'\0' * (arrayinfos[name][1] - len(output))
+		output += _toLittleEndian(arrays[name]).tobytes()
+	return bytes(output)
+
+def writePatternFile(filepath: str, patterndata: PatternData):
+	data = patternToBytes(patterndata)
+	tempfilepath = filepath + '.tmp'
+	with open(tempfilepath, mode='wb') as outfile:
+		outfile.write(data)
+	os.replace(tempfilepath, filepath)
+
+def _readHeader(data) -> Tuple[dict, int]:
+	if len(data) < _Prefix.size:
+		raise PatternFormatError('Pattern data is too short')
+	magic, version, headerlength = _Prefix.unpack_from(data, 0)
+	if magic != _Magic:
+		raise PatternFormatError('Not a binary pattern file')
+	if version != _FormatVersion:
+		raise PatternFormatError('Unsupported binary pattern version: {}'.format(version))
+	headerend = _Prefix.size + headerlength
+	header = json.loads(bytes(data[_Prefix.size:headerend]).decode('utf-8'))
+	return header, headerend
+
+def _readArray(data, arrayinfo: List) -> array:
+	typecode, offset, length = arrayinfo
+	arr = array(typecode)
+	arr.frombytes(data[offset:offset + length * arr.itemsize])
+	if sys.byteorder != 'little':
+		arr.byteswap()
+	return arr
+
+class _LazyPointColumn:
+	def __init__(self, name: str):
+		self.name = name
+
+	def __get__(self, table: '_LazyPointsShapeTable', owner):
+		if table is None:
+			return self
+		return table._getPointColumn(self.name)
+
+	def __set__(self, table: '_LazyPointsShapeTable', column: array):
+		table._pointcolumns[self.name] = column
+
+class _BufferPointSource:
+	def __init__(self, data):
+		self.data = data
+
+	def readArrays(self, arrayinfos: List[List]) -> List[array]:
+		return [_readArray(self.data, arrayinfo) for arrayinfo in arrayinfos]
+
+class _FilePointSource:
+	"""
+	Reads arrays from a binary pattern file when they're needed, without keeping the file
+	open (or mapped) in between, so that it can still be replaced.
+	"""
+	def __init__(self, filepath: str, stat: os.stat_result):
+		self.filepath = filepath
+		self.signature = stat.st_size, stat.st_mtime_ns
+
+	def readArrays(self, arrayinfos: List[List]) -> List[array]:
+		with open(self.filepath, mode='rb') as infile:
+			stat = os.fstat(infile.fileno())
+			if (stat.st_size, stat.st_mtime_ns) != self.signature:
+				raise PatternFormatError('Binary pattern file has changed since it was loaded: {!r}'.format(
+					self.filepath))
+			arrays = []
+			for typecode, offset, length in arrayinfos:
+				arr = array(typecode)
+				infile.seek(offset)
+				arr.fromfile(infile, length)
+				if sys.byteorder != 'little':
+					arr.byteswap()
+				arrays.append(arr)
+			return arrays
+
+class _LazyPointsShapeTable(ShapeTable):
+	"""
+	ShapeTable whose point columns are read from a binary pattern the first time that any
+	of them is used.
+	"""
+	_pointcolumnnames = 'coords', 'absdists', 'reldists'
+
+	def __init__(self, source, arrayinfos: Dict[str, List]):
+		self._pointcolumns = {}  # type: Dict[str, array]
+		super().__init__()
+		self._pointcolumns = {}
+		self._source = source
+		self._arrayinfos = arrayinfos
+		self._openloops = None  # type: Optional[array]
+
+	coords = _LazyPointColumn('coords')
+	absdists = _LazyPointColumn('absdists')
+	reldists = _LazyPointColumn('reldists')
+
+	@property
+	def pointsloaded(self):
+		return self._source is None
+
+	@property
+	def pointcount(self):
+		if self.pointsloaded:
+			return len(self._pointcolumns['absdists'])
+		return self._arrayinfos['absdists'][2]
+
+	def isOpenLoop(self, row: int):
+		# the stored flags only apply until the points are loaded, since they could change after that
+		if self._openloops is not None and not self.pointsloaded:
+			return bool(self._openloops[row])
+		return super().isOpenLoop(row)
+
+	def _getPointColumn(self, name: str):
+		if not self.pointsloaded:
+			# all of the columns are read at once, so that the source can be let go of
+			names = [n for n in self._pointcolumnnames if n not in self._pointcolumns]
+			columns = self._source.readArrays([self._arrayinfos[n] for n in names])
+			self._pointcolumns.update(zip(names, columns))
+			self._source = None
+		return self._pointcolumns[name]
+
+def _readShapeTable(data, header: dict, pointsource=None) -> ShapeTable:
+	arrayinfos = header['arrays']
+	shapesobj = header['shapes']
+	count = shapesobj['count']
+	if pointsource is not None:
+		table = _LazyPointsShapeTable(pointsource, arrayinfos)
+		if 'openloops' in arrayinfos:
+			table._openloops = _readArray(data, arrayinfos['openloops'])
+	else:
+		table = ShapeTable()
+		table.coords = _readArray(data, arrayinfos['coords'])
+		table.absdists = _readArray(data, arrayinfos['absdists'])
+		table.reldists = _readArray(data, arrayinfos['reldists'])
+	table.pointcounts = array('l', _readArray(data, arrayinfos['pointcounts']))
+	pointstarts = array('l', bytes(count * array('l').itemsize))
+	pointstart = 0
+	for row, pointcount in enumerate(table.pointcounts):
+		pointstarts[row] = pointstart
+		pointstart += pointcount
+	table.pointstarts = pointstarts
+	table.shapeindices = array('l', _readArray(data, arrayinfos['shapeindices']))
+	table.shapenames = shapesobj['shapenames']
+	table.shapepaths = shapesobj['shapepaths']
+	table.parentpaths = shapesobj['parentpaths']
+	table.shapelengths = _readArray(data, arrayinfos['shapelengths'])
+	colorvals = _readArray(data, arrayinfos['colors'])
+	table.colors = [
+		[val for val in colorvals[row * 4:row * 4 + 4] if val >= 0] or None
+		for row in range(count)
+	]
+	table.centers = _readArray(data, arrayinfos['centers'])
+	table.depthlayers = shapesobj['depthlayers']
+	table.dupcounts = array('l', _readArray(data, arrayinfos['dupcounts']))
+	table.radiuses = _readArray(data, arrayinfos['radiuses'])
+	table.rotateaxes = shapesobj['rotateaxes']
+	table.shapepathparts = [None] * count
+	table.createViews()
+	return table
+
+def _readGroup(obj: dict, groupindices: array) -> GroupInfo:
+	def getIndices(indexrange):
+		start, count = indexrange
+		return list(groupindices[start:start + count])
+
+	group = GroupInfo.FromJsonDict(excludekeys(obj, ['shapeindices', 'sequencesteps']))
+	# the indices were stored in sorted order
+	group.shapeindices = getIndices(obj['shapeindices'])
+	for stepobj in obj.get('sequencesteps') or []:
+		step = SequenceStep.FromJsonDict(excludekeys(stepobj, ['shapeindices']))
+		step.shapeindices = getIndices(stepobj['shapeindices'])
+		group.sequencesteps.append(step)
+	return group
+
+def patternFromBytes(data, lazypoints=False, pointsource=None) -> PatternData:
+	"""
+	Loads PatternData from the contents of a binary pattern file (bytes or any other
+	buffer, such as a memory-mapped file).
+	With `lazypoints`, the point arrays are only read from `data` when they're first used,
+	so it needs to stay valid until then. Alternatively, `pointsource` can read them from
+	somewhere else later, and then `data` is only used during this call.
+	"""
+	if lazypoints and pointsource is None:
+		pointsource = _BufferPointSource(data)
+	elif pointsource is None:
+		data = memoryview(data)
+	header, _ = _readHeader(data)
+	table = _readShapeTable(data, header, pointsource=pointsource)
+	groupindices = _readArray(data, header['arrays']['groupindices'])
+	patterndata = PatternData.FromJsonDict(excludekeys(header, ['shapes', 'groups', 'arrays']))
+	patterndata.addShapes(table.views)
+	patterndata.addGroups([_readGroup(obj, groupindices) for obj in header.get('groups') or []])
+	return patterndata
+
+def readPatternFile(filepath: str, lazypoints=False) -> PatternData:
+	"""
+	Loads PatternData from a binary pattern file.
+	With `lazypoints`, only the metadata, groups and shape attributes are read right away
+	(through a memory map that is closed before this returns). The point arrays are read
+	from the file the first time that something (such as building geometry) uses them.
+	The file isn't kept open in between, so it can be replaced, but then the points can't
+	be loaded anymore.
+	"""
+	with open(filepath, mode='rb') as infile:
+		if not lazypoints:
+			return patternFromBytes(infile.read())
+		pointsource = _FilePointSource(filepath, os.fstat(infile.fileno()))
+		with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			return patternFromBytes(data, pointsource=pointsource)
+
+def _comparableJsonDict(patterndata: PatternData):
+	obj = patterndata.ToJsonDict()
+	if 'settings' in obj:
+		del obj['settings']
+	return obj
+
+def convertJsonFile(jsonfilepath: str, binfilepath: str = None, verify=True) -> str:
+	"""
+	Writes a binary version of a PatternData JSON file, and optionally checks that loading
+	it produces the same pattern as loading the JSON file.
+	"""
+	binfilepath = binfilepath or GetPatternBinaryFileName(jsonfilepath)
+	if not binfilepath:
+		raise ValueError('Unable to determine binary file name for {!r}'.format(jsonfilepath))
+	with open(jsonfilepath, mode='r') as infile:
+		obj = json.load(infile)
+	# the settings aren't stored in the binary format
+	if 'settings' in obj:
+		del obj['settings']
+	patterndata = PatternData.FromJsonDict(obj)
+	writePatternFile(binfilepath, patterndata)
+	if verify:
+		if _comparableJsonDict(readPatternFile(binfilepath)) != _comparableJsonDict(patterndata):
+			raise PatternFormatError('Binary pattern does not match JSON: {!r}'.format(binfilepath))
+	return binfilepath
+
+def convertJsonFiles(dirpath: str, verify=True) -> List[str]:
+	"""
+	Writes binary versions of all the PatternData JSON files in a directory, and returns
+	the paths of the files that were written, for example:
+		mod.pattern_binary.convertJsonFiles('data')
+	"""
+	binfilepaths = []
+	for filename in sorted(os.listdir(dirpath)):
+		if filename.endswith('.json'):
+			binfilepaths.append(convertJsonFile(os.path.join(dirpath, filename), verify=verify))
+	return binfilepaths
@@ -1,11 +1,16 @@
+from array import array
+import copy
+import hashlib
+import json
+import math
 import re
 from collections import defaultdict, OrderedDict
 
 from pattern_model import *
-from .common import LoggableSubComponent, cartesiantopolar, loggedmethod, longestcommonprefix
+from .common import BaseDataObject, BaseDataObject2, LoggableBase, LoggableSubComponent, cartesiantopolar, loggedmethod, longestcommonprefix
 from .common import ValueSequence, ValueRangeSequence
 
-from typing import DefaultDict, List, Iterable
+from typing import DefaultDict, Dict, List, Iterable, Optional, Set, Tuple, Union
 
 # noinspection PyUnreachableCode
 if False:
@@ -21,6 +26,16 @@ class _ShapePredicate:
 	def filter(self, shapes: List[ShapeInfo], index: int):
 		return [s for s in shapes if self.test(s, index)]
 
+	def testAll(self, shapes: List[ShapeInfo]) -> List[List[bool]]:
+		"""
+		Tests all the shapes at every index of the predicate, producing a mask of the shapes
+		for each index.
+		"""
+		return [
+			[self.test(shape, index) for shape in shapes]
+			for index in range(len(self))
+		]
+
 	def describeAtIndex(self, index) -> str:
 		raise NotImplementedError()
 
@@ -74,6 +89,75 @@ class _PositionalPredicate(_ShapePredicate, ABC):
 	def _testPosition(self, pos: tdu.Position, index: int):
 		raise NotImplementedError()
 
+	def testAll(self, shapes: List[ShapeInfo]):
+		if self.boundmode not in [BoundMode.full, BoundMode.partial, BoundMode.center]:
+			return [[False] * len(shapes) for _ in range(len(self))]
+		batch = _PositionBatch(shapes, usecenters=self.boundmode == BoundMode.center)
+		masks = []
+		for index in range(len(self)):
+			posmask = self._testPositions(batch, index)
+			if self.boundmode == BoundMode.center:
+				masks.append(posmask)
+			elif self.boundmode == BoundMode.full:
+				masks.append([all(posmask[start:end]) for start, end in batch.ranges])
+			else:
+				masks.append([any(posmask[start:end]) for start, end in batch.ranges])
+		return masks
+
+	def _testPositions(self, batch: '_PositionBatch', index: int) -> List[bool]:
+		raise NotImplementedError()
+
+class _PositionBatch:
+	"""
+	The points (or centers) of a list of shapes, which are transformed once for each distinct
+	prerotate value and then shared by all the predicate indices that use it.
+	"""
+	def __init__(self, shapes: List[ShapeInfo], usecenters: bool):
+		self.positions = []  # type: List[List[float]]
+		# the range in `positions` for each shape
+		self.ranges = []  # type: List[Tuple[int, int]]
+		for shape in shapes:
+			start = len(self.positions)
+			if usecenters:
+				self.positions.append(shape.center)
+			else:
+				self.positions += [point.pos for point in shape.points]
+			self.ranges.append((start, len(self.positions)))
+		self.xysbyrotate = {}  # type: Dict[Optional[float], Tuple[List[float], List[float]]]
+		self.polarbyrotate = {}  # type: Dict[Optional[float], Tuple[List[float], List[float]]]
+
+	def getXYs(self, prerotate: Optional[float]):
+		if prerotate not in self.xysbyrotate:
+			if prerotate is None:
+				xs = [pos[0] for pos in self.positions]
+				ys = [pos[1] for pos in self.positions]
+			else:
+				xform = tdu.Matrix()
+				xform.rotate(0, 0, prerotate, pivot=(0, 0, 0))
+				transformed = [tdu.Position(pos) * xform for pos in self.positions]
+				xs = [pos.x for pos in transformed]
+				ys = [pos.y for pos in transformed]
+			self.xysbyrotate[prerotate] = xs, ys
+		return self.xysbyrotate[prerotate]
+
+	def getPolar(self, prerotate: Optional[float]):
+		if prerotate not in self.polarbyrotate:
+			xs, ys = self.getXYs(prerotate)
+			polar = [cartesiantopolar(x, y) for x, y in zip(xs, ys)]
+			self.polarbyrotate[prerotate] = [p[0] for p in polar], [p[1] for p in polar]
+		return self.polarbyrotate[prerotate]
+
+def _rangeMask(vals: List[float], ranges: ValueRangeSequence, index: int):
+	low = ranges.lows[index]
+	high = ranges.highs[index]
+	if low is None and high is None:
+		return [True] * len(vals)
+	if low is None:
+		return [not (val > high) for val in vals]
+	if high is None:
+		return [not (val < low) for val in vals]
+	return [not (val < low or val > high) for val in vals]
+
 class _CartesianPredicate(_PositionalPredicate):
 	def __init__(self, groupspec: BoxBoundGroupGenSpec):
 		super().__init__(groupspec)
@@ -103,6 +187,12 @@ class _CartesianPredicate(_PositionalPredicate):
 	def _testPosition(self, pos: tdu.Position, index: int):
 		return self.xranges.contains(pos.x, index) and self.yranges.contains(pos.y, index)
 
+	def _testPositions(self, batch: _PositionBatch, index: int):
+		xs, ys = batch.getXYs(self.prerotates[index])
+		xmask = _rangeMask(xs, self.xranges, index)
+		ymask = _rangeMask(ys, self.yranges, index)
+		return [x and y for x, y in zip(xmask, ymask)]
+
 class _PolarPredicate(_PositionalPredicate):
 	def __init__(self, groupspec: PolarBoundGroupGenSpec):
 		super().__init__(groupspec)
@@ -135,19 +225,33 @@ class _PolarPredicate(_PositionalPredicate):
 		dist, angle = cartesiantopolar(pos.x, pos.y)
 		return self.distanceranges.contains(dist, index) and self.angleranges.contains(angle, index)
 
+	def _testPositions(self, batch: _PositionBatch, index: int):
+		dists, angles = batch.getPolar(self.prerotates[index])
+		distmask = _rangeMask(dists, self.distanceranges, index)
+		anglemask = _rangeMask(angles, self.angleranges, index)
+		return [d and a for d, a in zip(distmask, anglemask)]
+
 class GroupGenerators(LoggableSubComponent):
 	def __init__(
 			self, hostobj,
 			context: PatternData,
-			patternsettings: PatternSettings):
+			patternsettings: PatternSettings,
+			outputcache: 'GroupGenOutputCache'=None):
 		super().__init__(hostobj=hostobj, logprefix='GroupGens')
 		self.context = context
 		self.patternsettings = patternsettings
+		self.outputcache = outputcache
 
 	@loggedmethod
 	def extractInferredGroups(self, roundingdigits=2):
-		extractor = _InferredGroupExtractor(roundingdigits=roundingdigits)
-		inferredgroups = extractor.load(self.context.shapes)
+		cache = self.outputcache
+		cachekey = '{}:inferred:{}'.format(cache.inputkey, roundingdigits) if cache is not None else None
+		inferredgroups = cache.get(cachekey) if cache is not None else None
+		if inferredgroups is None:
+			extractor = _InferredGroupExtractor(roundingdigits=roundingdigits)
+			inferredgroups = extractor.load(self.context.shapes)
+			if cache is not None:
+				cache.put(cachekey, inferredgroups)
 		self._LogEvent('Found {} inferred groups'.format(len(inferredgroups)))
 		self.context.addGroups(inferredgroups)
 
@@ -156,14 +260,37 @@ class GroupGenerators(LoggableSubComponent):
 		generators = _GroupGenerator.FromSpecs(hostobj=self, groupspecs=self.patternsettings.groups)
 		self._LogEvent('Starting with {} groups'.format(len(self.context.groups)))
 		self._LogEvent('Loaded {} group generators'.format(len(generators)))
-		for generator in generators:
-			self._LogEvent('   {!r}'.format(generator))
-			generator.generateGroups(self.context)
+		if self.outputcache is not None:
+			self._runGeneratorsWithCache(generators)
+		else:
+			for generator in generators:
+				self._LogEvent('   {!r}'.format(generator))
+				generator.generateGroups(self.context)
 		for group in self.context.groups:
 			if not group.temporary:
 				group.groupname = tdu.legalName(group.groupname)
 		self._LogEvent('Ended with {} groups'.format(len(self.context.groups)))
 
+	def _runGeneratorsWithCache(self, generators: List['_GroupGenerator']):
+		# Each generator runs detached so that its output can be stored. Generators with
+		# unchanged inputs reuse their output from the previous build instead of running.
+		cache = self.outputcache
+		keys = cache.makeKeys(self.patternsettings.groups, generators)
+		reused = 0
+		for i, generator in enumerate(generators):
+			self._LogEvent('   {!r}'.format(generator))
+			groups = cache.get(keys[i])
+			if groups is not None:
+				reused += 1
+			else:
+				collector, logbuffer = _runDetachedGenerator(generator, self.context)
+				logbuffer.replayInto(self)
+				groups = collector.groups
+				cache.put(keys[i], groups)
+			self.context.addGroups(groups)
+		cache.prune()
+		self._LogEvent('Reused output from {} of {} generators'.format(reused, len(generators)))
+
 	@loggedmethod
 	def applyDepthLayering(self):
 		layeringspec = self.patternsettings.depthlayering or DepthLayeringSpec()
@@ -226,6 +353,109 @@ class GroupGenerators(LoggableSubComponent):
 	def cleanTemporaryGroups(self):
 		self.context.removeTemporaryGroups()
 
+class GroupGenOutputCache:
+	"""
+	Output of group generators from previous builds, keyed by a hash of each generator's spec
+	and its inputs. The inputs are the shapes (identified by `inputkey`), and for generators
+	that read groups, the keys of all the generators before them, so a changed generator
+	causes everything downstream of it to run again.
+	"""
+	def __init__(self):
+		self.inputkey = ''
+		self.entries = {}  # type: Dict[str, List[GroupInfo]]
+		self.usedkeys = set()  # type: Set[str]
+
+	def makeKeys(self, groupspecs: List[GroupGenSpec], generators: List['_GroupGenerator']) -> List[str]:
+		keys = []
+		upstream = hashlib.sha1(self.inputkey.encode('utf-8'))
+		for groupspec, generator in zip(groupspecs, generators):
+			hasher = hashlib.sha1(self.inputkey.encode('utf-8'))
+			hasher.update(type(groupspec).__name__.encode('utf-8'))
+			hasher.update(json.dumps(
+				groupspec, sort_keys=True, separators=(',', ':'), default=_specHashValue).encode('utf-8'))
+			if generator.readsgroups:
+				hasher.update(upstream.digest())
+			key = hasher.hexdigest()
+			upstream.update(key.encode('utf-8'))
+			keys.append(key)
+		return keys
+
+	def __contains__(self, key: str):
+		return key in self.entries
+
+	def get(self, key: str) -> Optional[List[GroupInfo]]:
+		# groups are modified after generation, so the cache only hands out copies
+		groups = self.entries.get(key)
+		if groups is None:
+			return None
+		self.usedkeys.add(key)
+		return copy.deepcopy(groups)
+
+	def put(self, key: str, groups: List[GroupInfo]):
+		self.usedkeys.add(key)
+		self.entries[key] = copy.deepcopy(groups)
+
+	def prune(self):
+		# only the entries used by the latest build are kept
+		self.entries = {key: groups for key, groups in self.entries.items() if key in self.usedkeys}
+		self.usedkeys = set()
+
+	def clear(self):
+		self.entries = {}
+		self.usedkeys = set()
+
+def _specHashValue(obj):
+	# the ToJsonDict() of spec subclasses doesn't include every field, so all of the
+	# attributes are used instead
+	if isinstance(obj, (BaseDataObject, BaseDataObject2)):
+		return vars(obj)
+	return repr(obj)
+
+class _DetachedContext:
+	"""
+	Stands in for the pattern for a generator, collecting the groups that it adds instead of
+	adding them to the pattern.
+	"""
+	def __init__(self, context: PatternData):
+		self.context = context
+		self.groups = []  # type: List[GroupInfo]
+
+	def addGroup(self, group: GroupInfo):
+		self.groups.append(group)
+
+	def addGroups(self, groups: Iterable[GroupInfo]):
+		self.groups += groups
+
+	def __getattr__(self, name):
+		return getattr(self.context, name)
+
+	def __repr__(self):
+		return 'PatternData({} shapes, detached)'.format(len(self.context.shapes))
+
+class _LogBuffer(LoggableBase):
+	def __init__(self):
+		self.events = []  # type: List[Tuple[str, bool, bool]]
+
+	def _LogEvent(self, event, indentafter=False, unindentbefore=False):
+		self.events.append((event, indentafter, unindentbefore))
+
+	def replayInto(self, hostobj: LoggableBase):
+		for event, indentafter, unindentbefore in self.events:
+			hostobj._LogEvent(event, indentafter=indentafter, unindentbefore=unindentbefore)
+
+def _runDetachedGenerator(generator: '_GroupGenerator', context: PatternData):
+	# runs the generator without changing the pattern, so that its output can be cached
+	collector = _DetachedContext(context)
+	# the buffer receives the same events the host would, and replays them into it later
+	logbuffer = _LogBuffer()
+	hostobj = generator.hostobj
+	generator.hostobj = logbuffer
+	try:
+		generator.generateGroups(collector)
+	finally:
+		generator.hostobj = hostobj
+	return collector, logbuffer
+
 def _integerprefix(val: str, defval: int=None):
 	if not val:
 		return defval
@@ -314,6 +544,10 @@ class _GroupGenerator(LoggableSubComponent, ABC):
 	def FromSpecs(cls, hostobj, groupspecs: List[GroupGenSpec]):
 		return [cls.FromSpec(hostobj, groupspec) for groupspec in groupspecs]
 
+	# whether the generator uses groups produced by earlier generators, rather than only shapes,
+	# in which case its cached output depends on the generators before it
+	readsgroups = False
+
 	_specToGeneratorType = {}
 
 	@classmethod
@@ -335,14 +569,12 @@ class _PathGroupGenerator(_GroupGenerator):
 		groups = []
 		n = len(self.pathpatterns)
 		self._LogEvent('Paths (len: {})'.format(n))
+		allshapes = context.shapes
+		trie = context.shapePathTrie
 		for i in range(n):
 			pathpattern = self.pathpatterns[i]
 			self._LogEvent(' [{}] pattern: {!r}'.format(i, pathpattern))
-			shapes = [
-				shape
-				for shape in context.shapes
-				if re.match(pathpattern, shape.shapepath)
-			]
+			shapes = [allshapes[pos] for pos in trie.findMatches(pathpattern)]
 			self._LogEvent('  found {} shapes'.format(len(shapes)))
 			if not shapes:
 				continue
@@ -362,7 +594,7 @@ class _PathGroupGenerator(_GroupGenerator):
 					context=context)
 			self._LogEvent('  produced {} groups:'.format(len(groupsforpattern)))
 			for group in groupsforpattern:
-				group.grouppath = '/'.join(longestcommonprefix([shape.shapepath.split('/') for shape in shapes]))
+				group.grouppath = '/'.join(longestcommonprefix([shape.shapepathparts for shape in shapes]))
 				self._LogEvent('  {}'.format(group))
 			groups += groupsforpattern
 		if len(groups) == 1 and self.suffixes is None:
@@ -392,10 +624,7 @@ class _PathGroupGenerator(_GroupGenerator):
 			]
 		shapesbyprefix = OrderedDict()  # type: Dict[str, List[ShapeInfo]]
 		for shape in shapes:
-			if not shape.shapepath:
-				pathparts = []
-			else:
-				pathparts = shape.shapepath.split('/')
+			pathparts = shape.shapepathparts
 			if self.groupatdepth > 0:
 				prefix = '/'.join(pathparts[:self.groupatdepth])
 			else:
@@ -470,12 +699,11 @@ class _PredicateGroupGenerator(_GroupGenerator):
 		groups = []
 		n = len(self.predicate)
 		self._LogEvent('Predicate: {} (len: {})'.format(self.predicate, n))
+		shapes = context.shapes
+		masks = self.predicate.testAll(shapes)
 		for i in range(n):
 			self._LogEvent(' [{}] predicate: {}'.format(i, self.predicate.describeAtIndex(i)))
-			groupshapes = []
-			for shape in context.shapes:
-				if self.predicate.test(shape, i):
-					groupshapes.append(shape)
+			groupshapes = [shape for shape, matched in zip(shapes, masks[i]) if matched]
 			self._LogEvent('  found {} shapes'.format(len(groupshapes)))
 			if not groupshapes:
 				continue
@@ -519,6 +747,8 @@ class _PolarBoundGroupGenerator(_PredicateGroupGenerator):
 _PolarBoundGroupGenerator._registerSpecType(PolarBoundGroupGenSpec)
 
 class _CombinationGroupGenerator(_GroupGenerator):
+	readsgroups = True
+
 	def __init__(self, hostobj, groupspec: BooleanGroupGenSpec):
 		super().__init__(
 			hostobj=hostobj,
@@ -531,6 +761,7 @@ class _CombinationGroupGenerator(_GroupGenerator):
 			self.groups2 = ValueSequence.FromSpec(groupspec.withgroups, cyclic=True)
 		self.boolop = BoolOpNames.aliases.get(groupspec.boolop) or BoolOpNames.AND
 		self.permute = groupspec.permute
+		self.indexsetcache = None  # type: _IndexSetCache
 
 	def __repr__(self):
 		return '{}(basename: {!r}, suffixes: {!r}, groups1: {!r}, groups2: {!r}, boolop: {!r}, permute: {!r})'.format(
@@ -541,6 +772,8 @@ class _CombinationGroupGenerator(_GroupGenerator):
 	def generateGroups(self, context: PatternData):
 		self.groups1 = ValueSequence(context.getGroupNamesByPatterns(self.groups1), cyclic=True)
 		self.groups2 = ValueSequence(context.getGroupNamesByPatterns(self.groups2), cyclic=True)
+		# the source groups aren't modified while combining, so their index sets can be shared
+		self.indexsetcache = _IndexSetCache()
 		if self.permute:
 			groups = self._generatePermutations(context)
 		else:
@@ -590,7 +823,7 @@ class _CombinationGroupGenerator(_GroupGenerator):
 		if group2 is None:
 			self._LogEvent('Unable to find group: {!r}'.format(groupname2))
 			return None
-		combiner = _GroupCombiner(hostobj=self)
+		combiner = _GroupCombiner(hostobj=self, indexsetcache=self.indexsetcache)
 		combiner.addGroup(group1)
 		combiner.addGroup(group2)
 		if self.suffixes:
@@ -606,6 +839,8 @@ class _CombinationGroupGenerator(_GroupGenerator):
 _CombinationGroupGenerator._registerSpecType(BooleanGroupGenSpec)
 
 class _MergeGroupGenerator(_GroupGenerator):
+	readsgroups = True
+
 	def __init__(self, hostobj, groupspec: MergeGroupGenSpec):
 		super().__init__(hostobj, groupspec=groupspec, logprefix='MergeGroupGen')
 		self.groups = ValueSequence.FromSpec(groupspec.groups, cyclic=False)
@@ -626,10 +861,11 @@ class _MergeGroupGenerator(_GroupGenerator):
 _MergeGroupGenerator._registerSpecType(MergeGroupGenSpec)
 
 class _GroupCombiner(LoggableSubComponent):
-	def __init__(self, hostobj):
+	def __init__(self, hostobj, indexsetcache: '_IndexSetCache'=None):
 		super().__init__(hostobj, logprefix='GroupCombiner')
 		self.sequencegroup = None  # type: GroupInfo
 		self.othergroups = []  # type: List[GroupInfo]
+		self.indexsetcache = indexsetcache if indexsetcache is not None else _IndexSetCache()
 
 	def addGroup(self, group: GroupInfo):
 		if group.issequenced:
@@ -649,8 +885,8 @@ class _GroupCombiner(LoggableSubComponent):
 		if not self.sequencegroup and not self.othergroups:
 			return False
 		boolop = boolop or BoolOpNames.OR
-		allshapeindices = self._combineIndexSets(
-			[group.shapeindices for group in self.othergroups],
+		allshapeindices = ShapeIndexSet.Combine(
+			[self.indexsetcache.get(group) for group in self.othergroups],
 			boolop=boolop
 		)
 		if not self.sequencegroup:
@@ -658,37 +894,41 @@ class _GroupCombiner(LoggableSubComponent):
 				SequenceStep(
 					sequenceindex=0,
 					isdefault=True,
-					shapeindices=list(sorted(allshapeindices)))
+					shapeindices=allshapeindices.toList())
 			]
-			resultgroup.shapeindices = list(sorted(allshapeindices))
+			resultgroup.shapeindices = allshapeindices.toList()
 		else:
 			resultsteps = []  # type: List[SequenceStep]
-			finalallstepindices = []
+			finalallstepindices = ShapeIndexSet()
 			for basestep in self.sequencegroup.sequencesteps:
-				stepindices = self._combineIndexSets(
-					[basestep.shapeindices, allshapeindices],
+				stepindices = ShapeIndexSet.Combine(
+					[self.indexsetcache.get(basestep), allshapeindices],
 					boolop=boolop
 				)
-				finalallstepindices += list(stepindices)
+				finalallstepindices |= stepindices
 				resultsteps.append(SequenceStep(
 					sequenceindex=basestep.sequenceindex,
-					shapeindices=list(sorted(stepindices))))
+					shapeindices=stepindices.toList()))
 			resultgroup.sequencesteps = resultsteps
-			resultgroup.shapeindices = list(sorted(set(finalallstepindices)))
+			resultgroup.shapeindices = finalallstepindices.toList()
 		return True
 
-	@staticmethod
-	def _combineIndexSets(indexsets: List[Iterable[int]], boolop: str):
-		if not indexsets:
-			return set()
-		combinedindices = set(indexsets[0])
-		if boolop == BoolOpNames.AND:
-			combinedindices = combinedindices.intersection(*indexsets[1:])
-		elif boolop == BoolOpNames.OR:
-			combinedindices = combinedindices.union(*indexsets[1:])
-		else:
-			return set()
-		return combinedindices
+class _IndexSetCache:
+	"""
+	Caches the shape index sets of groups and sequence steps, so that generators which combine
+	the same groups many times only convert their index lists once. A cache should only be
+	used while the groups it has seen aren't being modified.
+	"""
+	def __init__(self):
+		self.indexsets = {}  # type: Dict[int, Tuple[Union[GroupInfo, SequenceStep], ShapeIndexSet]]
+
+	def get(self, item: Union[GroupInfo, SequenceStep]) -> ShapeIndexSet:
+		# keyed by id since the dataclasses aren't hashable, with the item kept alive so that
+		# its id isn't reused
+		entry = self.indexsets.get(id(item))
+		if entry is None:
+			entry = self.indexsets[id(item)] = item, item.shapeIndexSet
+		return entry[1]
 
 class _ShapeSequencer(ABC):
 	def sequenceShapes(
@@ -726,67 +966,56 @@ class _AttributeShapeSequencer(LoggableSubComponent, _ShapeSequencer):
 		part = SequenceByTypes.aliases.get(seqbyspec.seqtype)
 		LoggableSubComponent.__init__(
 			self, hostobj=hostobj, logprefix='AttrShapeSeq[{}]'.format(part))
-		if part in SequenceByTypes.rgb:
-			index = SequenceByTypes.rgb.index(part)
-			self.accessor = lambda s: s.color[index] if s.color else None
-		elif part in SequenceByTypes.hsv:
-			index = SequenceByTypes.hsv.index(part)
-			self.accessor = lambda s: s.hsvcolor[index] if s.color else None
-		elif part == SequenceByTypes.distance:
-			self.accessor = lambda s: cartesiantopolar(s.center[0], s.center[1])[0]
-		elif part in SequenceByTypes.xy:
-			index = SequenceByTypes.xy.index(part)
-			self.accessor = lambda s: s.center[index]
-		else:
+		if part not in SequenceByTypes.rgb + SequenceByTypes.hsv + SequenceByTypes.xy + (SequenceByTypes.distance,):
 			raise Exception('Unsupported attribute: {!r}'.format(seqbyspec.seqtype))
+		self.part = part
 		self.rounddigits = seqbyspec.rounddigits
 		self.reverse = seqbyspec.reverse
-		self.shapesbykey = defaultdict(list)  # type: DefaultDict[Any, List[ShapeInfo]]
-		self.unkeyedshapes = []  # type: List[ShapeInfo]
-
-	def _getKey(self, shape: ShapeInfo):
-		val = self.accessor(shape)
-		if val is None:
-			return None
-		if self.rounddigits is not None:
-			return round(val, self.rounddigits)
-		return val
-
-	def _registerShape(self, shape: ShapeInfo):
-		key = self._getKey(shape)
-		if key is None:
-			self.unkeyedshapes.append(shape)
-		else:
-			self.shapesbykey[key].append(shape)
 
 	def sequenceShapes(
 			self,
 			shapeindices: List[int],
 			context: PatternData):
-		self.shapesbykey.clear()
-		self.unkeyedshapes.clear()
 		if not shapeindices:
 			return []
+		# the attribute values are computed once for the whole pattern
+		allkeys = context.getShapeAttributeKeys(self.part, self.rounddigits)
+		keys = []
+		keyedindices = []
+		unkeyedcount = 0
 		for shapeindex in shapeindices:
 			shape = context.getShapeByIndex(shapeindex)
-			if shape:
-				self._registerShape(shape)
-		if self.unkeyedshapes:
+			if not shape:
+				continue
+			key = allkeys[shape._row]
+			if key is None:
+				unkeyedcount += 1
+			else:
+				keys.append(key)
+				keyedindices.append(shape.shapeindex)
+		if unkeyedcount:
 			self._LogEvent('Group has {} shapes without the required key, putting all shapes in a single default step'.format(
-				len(self.unkeyedshapes)))
+				unkeyedcount))
 			return [self._createDefaultStep(shapeindices)]
-		steps = []
-		stepkeys = list(sorted(self.shapesbykey.keys()))
+		# a stable sort by key puts each step's shapes together, in their original order
+		order = sorted(range(len(keys)), key=keys.__getitem__)
+		runs = []  # type: List[Tuple[Any, List[int]]]
+		for i in order:
+			if runs and runs[-1][0] == keys[i]:
+				runs[-1][1].append(keyedindices[i])
+			else:
+				runs.append((keys[i], [keyedindices[i]]))
 		if self.reverse:
-			stepkeys.reverse()
-		for stepindex, stepkey in enumerate(stepkeys):
-			steps.append(SequenceStep(
+			runs.reverse()
+		return [
+			SequenceStep(
 				sequenceindex=stepindex,
-				shapeindices=[s.shapeindex for s in self.shapesbykey[stepkey]],
+				shapeindices=stepshapeindices,
 				inferredfromvalue=stepkey,
-				isdefault=len(stepkeys) == 1,
-			))
-		return steps
+				isdefault=len(runs) == 1,
+			)
+			for stepindex, (stepkey, stepshapeindices) in enumerate(runs)
+		]
 
 class _PathShapeSequencer(LoggableSubComponent, _ShapeSequencer):
 	def __init__(
@@ -806,29 +1035,29 @@ class _PathShapeSequencer(LoggableSubComponent, _ShapeSequencer):
 		if not path:
 			self._LogEvent('Unable to find sequence path by pattern: {!r}'.format(self.pathpattern))
 			return []
+		# the sequencer can be reused for several groups, so it starts fresh each time
+		self.allshapes = []
 		for shapeindex in shapeindices:
 			shape = context.getShapeByIndex(shapeindex)
 			if shape:
 				self.allshapes.append(shape)
 		if not self.allshapes:
 			return []
+		hits = context.shapetable.findContainingRows(
+			[pathpoint.pos for pathpoint in path.points],
+			rows=[shape._row for shape in self.allshapes])
 		steps = []
 		for stepindex, pathpoint in enumerate(path.points):
-			pointshapes = self._findShapesByPoint(pathpoint)
 			steps.append(SequenceStep(
 				sequenceindex=stepindex,
-				shapeindices=[s.shapeindex for s in pointshapes],
+				shapeindices=[
+					context.shapetable.shapeindices[row]
+					for row in hits.get(stepindex, [])
+				],
 				inferredfromvalue='point ({})'.format(pathpoint.pos),
 			))
 		return steps
 
-	def _findShapesByPoint(self, point: PointData) -> List[ShapeInfo]:
-		return [
-			shape
-			for shape in self.allshapes
-			if shape.containsPoint(point)
-		]
-
 	def _getPath(self, context: PatternData) -> Optional[PathInfo]:
 		if not self.pathpattern:
 			return None
@@ -844,32 +1073,46 @@ class _InferredGroupExtractor:
 	Within each group, value (as in HSV value) defines the sequence ordering.
 	"""
 	def __init__(self, roundingdigits=None):
-		# list of shapes keyed by (hue, saturation)
-		self.shapesbyhuesat = defaultdict(list)  # type: DefaultDict[Tuple, List[ShapeInfo]]
 		self.groups = []  # type: List[GroupInfo]
 		self.roundingdigits = roundingdigits  # type: int
 
 	def load(self, shapes: List[ShapeInfo]):
-		for shape in shapes:
-			self._loadShape(shape)
-		for huesat, shapes in self.shapesbyhuesat.items():
-			self._addGroup(huesat, shapes)
+		shapes = list(shapes)
+		hsvs = self._getHsvColors(shapes)
+		# positions in the shape list keyed by (hue, saturation)
+		positionsbyhuesat = defaultdict(list)  # type: DefaultDict[Tuple, List[int]]
+		keys = {}  # type: Dict[Tuple[float, float], Tuple]
+		for i in range(len(shapes)):
+			huesat = hsvs[i * 3], hsvs[i * 3 + 1]
+			if huesat[0] != huesat[0]:
+				continue
+			key = keys.get(huesat)
+			if key is None:
+				key = keys[huesat] = self._prepareKey(*huesat)
+			positionsbyhuesat[key].append(i)
+		for huesat, positions in positionsbyhuesat.items():
+			self._addGroup(
+				huesat,
+				[shapes[i] for i in positions],
+				[hsvs[i * 3 + 2] for i in positions])
 		return self.groups
 
-	def _loadShape(self, shape: ShapeInfo):
-		hsvcolor = shape.hsvcolor
-		if not hsvcolor:
-			return
-		key = self._prepareKey(hsvcolor[0], hsvcolor[1])
-		self.shapesbyhuesat[key].append(shape)
+	@staticmethod
+	def _getHsvColors(shapes: List[ShapeInfo]):
+		table = shapes[0].table if shapes else None
+		if table is not None and all(shape.table is table for shape in shapes):
+			return table.hsvColors([shape._row for shape in shapes])
+		hsvs = array('d')
+		for shape in shapes:
+			hsvs.extend(shape.hsvcolor or (math.nan, math.nan, math.nan))
+		return hsvs
 
 	def _prepareKey(self, *vals):
 		if self.roundingdigits is None:
 			return tuple(vals)
 		return tuple(round(v, self.roundingdigits) for v in vals)
 
-	def _addGroup(self, huesat, shapes: List[ShapeInfo]):
-		shapesbyvalue = defaultdict(list)  # type: DefaultDict[float, List[ShapeInfo]]
+	def _addGroup(self, huesat, shapes: List[ShapeInfo], values: List[float]):
 		shapeindices = [shape.shapeindex for shape in shapes]
 		pathparts = longestcommonprefix([shape.parentpath.split('/') for shape in shapes])
 		name = None
@@ -893,21 +1136,25 @@ class _InferredGroupExtractor:
 			inferredfromvalue=huesat,
 			shapeindices=list(shapeindices),
 		)
-		for shape in shapes:
-			shapesbyvalue[shape.hsvcolor[2]].append(shape)
-		if len(shapesbyvalue) == 1:
+		# a stable sort by value puts each step's shapes together, in their original order
+		order = sorted(range(len(values)), key=values.__getitem__)
+		if values[order[0]] == values[order[-1]]:
 			group.sequencesteps.append(SequenceStep(
 				sequenceindex=0,
-				inferredfromvalue=list(shapesbyvalue.keys())[0],
+				inferredfromvalue=values[0],
 				shapeindices=list(shapeindices),
 			))
 		else:
-			for i, key in enumerate(sorted(shapesbyvalue.keys())):
+			stepstart = 0
+			for end in range(1, len(order) + 1):
+				if end < len(order) and values[order[end]] == values[order[stepstart]]:
+					continue
 				group.sequencesteps.append(
 					SequenceStep(
-						sequenceindex=i,
-						inferredfromvalue=key,
-						shapeindices=[shape.shapeindex for shape in shapesbyvalue[key]]
+						sequenceindex=len(group.sequencesteps),
+						inferredfromvalue=values[order[stepstart]],
+						shapeindices=[shapeindices[i] for i in order[stepstart:end]]
 					)
 				)
+				stepstart = end
 		self.groups.append(group)
@@ -1,15 +1,26 @@
+from collections import defaultdict
+import copy
+import hashlib
+import inspect
+import io
 import json
+import marshal
+import math
+import os
+import sys
 import xml.etree.ElementTree as ET
 
 import pathlib
-from typing import Dict, List, Union, Optional
+from typing import Dict, List, Union, Optional, Tuple
 
 from .common import ExtensionBase, LoggableSubComponent
 from .common import simpleloggedmethod, hextorgb, loggedmethod, cartesiantopolar
 from .common import formatValue, averagePoints, ValueSequence
+from .records import ObjectSchema
 
-from pattern_model import GroupInfo, ShapeInfo, PatternSettings, DepthLayeringSpec, PatternData, PointData, PathInfo
-from pattern_groups import GroupGenerators
+from pattern_binary import GetPatternBinaryFileName, readPatternFile, writePatternFile
+from pattern_model import GroupInfo, ShapeInfo, ShapeTable, PatternSettings, DepthLayeringSpec, PatternData, PointData, PathInfo
+from pattern_groups import GroupGenerators, GroupGenOutputCache
 from pattern_state import ShapeStatesBuilder
 
 try:
@@ -21,7 +32,7 @@ except ImportError:
 import td_python_package_init
 td_python_package_init.init()
 
-import svg.path as svgpath
+import pattern_svg_paths
 
 print('pattern_loader.py loading...')
 
@@ -54,6 +65,8 @@ class PatternBuilder(ExtensionBase):
 		super().__init__(ownerComp)
 		self.patternsettings = None  # type: PatternSettings
 		self.patterndata = None  # type: PatternData
+		self.buildcache = None  # type: _PatternBuildCache
+		self.incrementalstate = None  # type: _IncrementalBuildState
 
 	@property
 	def PatternJsonFileName(self):
@@ -65,13 +78,45 @@ class PatternBuilder(ExtensionBase):
 		svgxmlop = self.op('svg_xml')
 		svgxmlop.par.loadonstartpulse.pulse()
 		svgxml = svgxmlop.text
-		self._LoadPatternSettings()
-		self.patterndata.title = pathlib.PurePath(self.ownerComp.par.Svgfile.eval()).stem or ''
-		self._LoadPatternFromSvg(svgxml)
-		self._BuildGroups()
-		self._PostProcessPattern()
+		settingsobj = self._LoadPatternSettings()
+		title = pathlib.PurePath(self.ownerComp.par.Svgfile.eval()).stem or ''
+		self.patterndata.title = title
+		cache = self._GetBuildCache()
+		cachekey = cache.makeKey(svgxml, settingsobj) if cache else None
+		cacheddata = cache.load(cachekey) if cache else None
+		if cacheddata is not None:
+			self._LogEvent('Using cached build {}'.format(cachekey))
+			self.patterndata = cacheddata
+			self.patterndata.title = title
+			self.patterndata.settings = self.patternsettings
+		else:
+			self._LoadPatternFromSvg(svgxml)
+			self._BuildGroups()
+			self._PostProcessPattern()
+			if cache:
+				cache.store(cachekey, self.patterndata)
 		self._CompleteBuild()
 
+	def _GetBuildCache(self):
+		cachedir = self.par.Buildcachedir.eval() if hasattr(self.par, 'Buildcachedir') else None
+		if not cachedir:
+			self.buildcache = None
+			return None
+		maxsize = self.par.Buildcachesize.eval() if hasattr(self.par, 'Buildcachesize') else None
+		maxbytes = int(maxsize * 1024 * 1024) if maxsize else _DefaultBuildCacheMaxBytes
+		# this is checked for every build, since modules can be reloaded in between
+		codeversion = _getBuilderCodeVersion()
+		if codeversion is None:
+			self._LogEvent('Build cache disabled, unable to identify the version of the builder code')
+			self.buildcache = None
+			return None
+		if self.buildcache is None or self.buildcache.cachedir != cachedir:
+			self.buildcache = _PatternBuildCache(self, cachedir, maxbytes=maxbytes, codeversion=codeversion)
+		else:
+			self.buildcache.maxbytes = maxbytes
+			self.buildcache.codeversion = codeversion
+		return self.buildcache
+
 	@loggedmethod
 	def _PostProcessPattern(self):
 		self._MergeDuplicateShapes()
@@ -81,34 +126,98 @@ class PatternBuilder(ExtensionBase):
 	@loggedmethod
 	def _CompleteBuild(self):
 		self.FillInfoTable(self.ownerComp.op('build_info'))
-		self.BuildOutput()
 		if self.ownerComp.par.Autosave:
 			self.SaveOutput()
+		else:
+			self.BuildOutput()
 
 	@loggedmethod
 	def BuildOutput(self):
 		output = self.ownerComp.op('output_json')
 		output.text = self._GetPatternJson(minify=self.ownerComp.par.Minifyjson)
 
+	@property
+	def _SkipOutputDat(self):
+		if not hasattr(self.par, 'Skipoutputdat'):
+			return False
+		return bool(self.par.Skipoutputdat.eval())
+
 	@loggedmethod
 	def SaveOutput(self):
-		self.BuildOutput()
+		# when only the file is needed, the JSON is streamed straight to it, without keeping
+		# a copy of the whole text in the DAT
+		skipdat = self._SkipOutputDat
 		output = self.ownerComp.op('output_json')
+		if skipdat:
+			output.text = ''
+		else:
+			self.BuildOutput()
 		if not self.patterndata or not self.patterndata.title:
 			return
-		output.par.file = str(pathlib.PurePath(self.ownerComp.par.Outputdir.eval() or '.').joinpath(
+		jsonfile = str(pathlib.PurePath(self.ownerComp.par.Outputdir.eval() or '.').joinpath(
 			self.patterndata.title + '.json')).replace('\\', '/')
-		output.par.writepulse.pulse()
+		if skipdat:
+			self._WritePatternJsonFile(jsonfile)
+		else:
+			output.par.file = jsonfile
+			output.par.writepulse.pulse()
+		binfile = GetPatternBinaryFileName(jsonfile)
+		try:
+			writePatternFile(binfile, self.patterndata)
+		except OSError as e:
+			self._LogEvent('Unable to write binary pattern {}: {}'.format(binfile, e))
+
+	def _WritePatternJsonFile(self, filepath: str):
+		tempfilepath = filepath + '.tmp'
+		with open(tempfilepath, mode='w', encoding='utf-8', newline='\n') as outfile:
+			self._WritePatternJson(outfile, minify=self.ownerComp.par.Minifyjson)
+		os.replace(tempfilepath, filepath)
+
+	@property
+	def _ParseWorkers(self):
+		if not hasattr(self.par, 'Parseworkers'):
+			return _DefaultParseWorkers
+		return self.par.Parseworkers.eval()
+
+	@property
+	def _ParseWorkerPython(self):
+		# the Python interpreter for parse workers, for when one can't be found next to the
+		# running application (see pattern_svg_paths.findWorkerPython())
+		if not hasattr(self.par, 'Parseworkerpython'):
+			return None
+		return self.par.Parseworkerpython.eval() or None
+
+	@property
+	def _IncrementalBuild(self):
+		if not hasattr(self.par, 'Incrementalbuild'):
+			return False
+		return bool(self.par.Incrementalbuild.eval())
+
+	def _GetIncrementalState(self):
+		if not self._IncrementalBuild:
+			self.incrementalstate = None
+			return None
+		if self.incrementalstate is None:
+			self.incrementalstate = _IncrementalBuildState(self)
+		return self.incrementalstate
 
 	@simpleloggedmethod
 	def _LoadPatternFromSvg(self, svgxml):
-		parser = _SvgParser(self, self.patternsettings)
-		parser.parse(svgxml)
-		self.patterndata.addShapes(parser.shapes)
-		self.patterndata.addPaths(parser.paths)
-		self.patterndata.svgwidth = parser.svgwidth
-		self.patterndata.svgheight = parser.svgheight
-		self.patterndata.scale = parser.scale
+		incremental = self._GetIncrementalState()
+		parsed = incremental.loadParsedSvg(svgxml, self.patternsettings) if incremental else None
+		if parsed is None:
+			parser = _SvgParser(
+				self, self.patternsettings,
+				workers=self._ParseWorkers, workerpython=self._ParseWorkerPython)
+			parser.parse(svgxml)
+			parsed = _ParsedSvg.FromParser(parser)
+			if incremental:
+				incremental.storeParsedSvg(parsed)
+		self.patterndata.addShapes(parsed.shapetable.views)
+		self.patterndata.addPaths(parsed.paths)
+		self.patterndata.svgwidth = parsed.svgwidth
+		self.patterndata.svgheight = parsed.svgheight
+		self.patterndata.scale = parsed.scale
 
 	@loggedmethod
 	def _LoadPatternSettings(self):
@@ -118,13 +227,15 @@ class PatternBuilder(ExtensionBase):
 		obj = json.loads(jsondat.text) if jsondat.text else {}
 		self.patternsettings = PatternSettings.FromJsonDict(obj)
 		self.patterndata.settings = self.patternsettings
+		return obj
 
 	@loggedmethod
 	def _BuildGroups(self):
 		generators = GroupGenerators(
 			hostobj=self,
 			context=self.patterndata,
-			patternsettings=self.patternsettings)
+			patternsettings=self.patternsettings,
+			outputcache=self.incrementalstate.groupoutputs if self.incrementalstate else None)
 		if self.patternsettings.autogroup in (None, True):
 			generators.extractInferredGroups()
 		generators.runGenerators()
@@ -151,7 +262,7 @@ class PatternBuilder(ExtensionBase):
 						shapeindex, shape.depthlayer, group.depthlayer))
 					continue
 				shape.depthlayer = group.depthlayer
-				shape.center[2] = group.depth
+				shape.center = _withZ(shape.center, group.depth)
 
 		defaultlayer = layeringspec.defaultlayer
 		layerdist = layeringspec.layerdistance or 0.1
@@ -159,10 +270,8 @@ class PatternBuilder(ExtensionBase):
 			if shape.depthlayer is None:
 				shape.depthlayer = defaultlayer
 				if defaultlayer is not None:
-					shape.center[2] = defaultlayer * layerdist
-			z = shape.center[2]
-			for point in shape.points:
-				point.pos[2] = z
+					shape.center = _withZ(shape.center, defaultlayer * layerdist)
+			shape.setPointDepths(shape.center[2])
 
 	@loggedmethod
 	def _ApplyRotateAxesToShapes(self):
@@ -180,8 +289,26 @@ class PatternBuilder(ExtensionBase):
 				shape.rotateaxis = group.rotateaxis
 
 	def _GetPatternJson(self, minify=True):
-		obj = self.patterndata and self.patterndata.ToJsonDict() or {}
-		return json.dumps(obj, indent=None if minify else '  ', sort_keys=True)
+		output = io.StringIO()
+		self._WritePatternJson(output, minify=minify)
+		return output.getvalue()
+
+	def _WritePatternJson(self, outfile, minify=True):
+		if not self.patterndata:
+			outfile.write('{}')
+			return
+		self.patterndata.writeJson(
+			outfile,
+			indent=None if minify else '  ',
+			pointprecision=self._LeanPointPrecision or None)
+
+	@property
+	def _LeanPointPrecision(self):
+		# when set, points are written in the lean form, quantized to this precision, and the
+		# distances along shapes are recalculated when the pattern is loaded
+		if not hasattr(self.par, 'Leanpointprecision'):
+			return 0
+		return self.par.Leanpointprecision.eval()
 
 	def FillInfoTable(self, dat):
 		dat.clear()
@@ -197,6 +324,19 @@ class PatternBuilder(ExtensionBase):
 				['shapes', len(self.patterndata.shapes)],
 				['groups', len(self.patterndata.groups)],
 			])
+		if self.buildcache:
+			dat.appendRows([
+				['cacheresult', self.buildcache.lastresult or ''],
+				['cachehits', self.buildcache.hits],
+				['cachemisses', self.buildcache.misses],
+				['cacheevictions', self.buildcache.evictions],
+			])
+
+def _isFileUpToDate(filepath: str, sourcefilepath: str):
+	try:
+		return os.path.getmtime(filepath) >= os.path.getmtime(sourcefilepath)
+	except OSError:
+		return False
 
 class PatternLoader(ExtensionBase):
 	"""
@@ -223,31 +363,76 @@ class PatternLoader(ExtensionBase):
 	def __init__(self, ownerComp):
 		super().__init__(ownerComp)
 		self.patterndata = None  # type: PatternData
+		self.geometrybuilt = False
 
 	@loggedmethod
 	def LoadPattern(self):
-		patternjson = self.op('pattern_json').text
-		patternobj = json.loads(patternjson) if patternjson else {}
-		if not patternobj:
-			self.patterndata = PatternData()
-		else:
-			# there's a parser issue for the group gen specs, but probably don't even need the settings for this
-			if 'settings' in patternobj:
-				del patternobj['settings']
-			self.patterndata = PatternData.FromJsonDict(patternobj)
+		self.patterndata = self._LoadPatternData()
+		self.geometrybuilt = False
 		self._BuildMetadata(self.op('set_metadata'))
-		sop = self.op('build_geometry')
-		self._BuildGeometry(sop)
-		self._AssignGeometryGroups(sop)
+		# with lazy points, the geometry (the only thing that reads the points) is cleared here,
+		# and built when it's first used, by the shape_panels cook or an export
+		if self._LazyLoadPoints:
+			self._ClearGeometry(self.op('build_geometry'))
+		else:
+			self.BuildGeometry()
 		self._BuildGroupTable(self.op('set_group_table'))
 		self._BuildSequenceStepTable(self.op('set_sequence_step_table'))
 		self._BuildShapeAttrTable(self.op('set_shape_attr_table'))
 		self._BuildShapeGroupSequenceIndices(self.op('set_shape_group_sequence_indices'))
 		self._BuildShapeDefaultStateTable(self.op('set_shape_default_state_table'))
-		self.op('shape_panels').cook(force=True)
 		if self.par.Autoexport:
 			self.ExportTox()
 
+	@loggedmethod
+	def BuildGeometry(self):
+		self.geometrybuilt = False
+		self.EnsureGeometry()
+		self.op('shape_panels').cook(force=True)
+
+	def EnsureGeometry(self):
+		"""
+		Builds the geometry for the loaded pattern if it hasn't been built yet, and returns
+		whether it was.
+		"""
+		if self.geometrybuilt or self.patterndata is None:
+			return False
+		# set first, since building can cook things that come back through here
+		self.geometrybuilt = True
+		sop = self.op('build_geometry')
+		self._BuildGeometry(sop)
+		self._AssignGeometryGroups(sop)
+		return True
+
+	@staticmethod
+	def _ClearGeometry(sop):
+		sop.clear()
+		for group in list(sop.primGroups.values()):
+			group.destroy()
+
+	@property
+	def _LazyLoadPoints(self):
+		if not hasattr(self.par, 'Lazyloadpoints'):
+			return False
+		return bool(self.par.Lazyloadpoints.eval())
+
+	def _LoadPatternData(self):
+		jsondat = self.op('pattern_json')
+		jsonfile = jsondat.par.file.eval() if hasattr(jsondat.par, 'file') else None
+		binfile = GetPatternBinaryFileName(jsonfile)
+		if binfile and _isFileUpToDate(binfile, jsonfile):
+			lazypoints = self._LazyLoadPoints
+			self._LogEvent('Loading binary pattern {}{}'.format(binfile, ' (lazy points)' if lazypoints else ''))
+			return readPatternFile(binfile, lazypoints=lazypoints)
+		patternjson = jsondat.text
+		patternobj = json.loads(patternjson) if patternjson else {}
+		if not patternobj:
+			return PatternData()
+		# there's a parser issue for the group gen specs, but probably don't even need the settings for this
+		if 'settings' in patternobj:
+			del patternobj['settings']
+		return PatternData.FromJsonDict(patternobj)
+
 	@loggedmethod
 	def _BuildMetadata(self, dat):
 		dat.clear()
@@ -303,6 +488,8 @@ class PatternLoader(ExtensionBase):
 
 	@loggedmethod
 	def ConvertShapePathsToPanels(self, sop, insop):
+		# insop is the build_geometry SOP, which isn't built yet after a lazy load
+		self.EnsureGeometry()
 		_copyAndClearSOP(sop, insop)
 		for srcpoly in insop.prims:
 			poly = sop.appendPoly(len(srcpoly) - 1, addPoints=True, closed=True)
@@ -460,6 +647,8 @@ class PatternLoader(ExtensionBase):
 	def ExportTox(self):
 		if not self.patterndata or not self.patterndata.title:
 			return
+		if self.EnsureGeometry():
+			self.op('shape_panels').cook(force=True)
 		name = self.patterndata.title
 		filebase = str(pathlib.PurePath(self.ownerComp.par.Outputdir.eval() or '.').joinpath(
 			self.patterndata.title)).replace('\\', '/')
@@ -497,40 +686,246 @@ class PatternLoader(ExtensionBase):
 		thumbfile = filebase + '.png'
 		self.ownerComp.op('thumbnail').save(thumbfile)
 
+_DefaultBuildCacheMaxBytes = 256 * 1024 * 1024
+
+# bump this when the cached data format changes in a way that isn't reflected in the source
+_BuildCacheFormatVersion = '1'
+
+def _getBuilderCodeVersion() -> Optional[str]:
+	"""
+	Identifies the version of the code that produces pattern data, so that cached builds
+	are invalidated when the builder changes. Returns None if the code for one of the
+	builder modules can't be found, in which case builds can't safely be cached.
+	"""
+	hasher = hashlib.sha1(_BuildCacheFormatVersion.encode('utf-8'))
+	modules = [
+		inspect.getmodule(ValueSequence),
+		# the model's JSON codecs are generated by the record schemas
+		inspect.getmodule(ObjectSchema),
+		inspect.getmodule(PatternData),
+		inspect.getmodule(GroupGenerators),
+		sys.modules.get(__name__),
+		pattern_svg_paths,
+	]
+	for module in modules:
+		if module is None:
+			return None
+		parts = _getModuleCodeParts(module)
+		if not parts:
+			return None
+		for part in parts:
+			hasher.update(part)
+	return hasher.hexdigest()
+
+def _getModuleCodeParts(module) -> List[bytes]:
+	try:
+		return [inspect.getsource(module).encode('utf-8')]
+	except (OSError, TypeError):
+		pass
+	# modules loaded from DATs in TouchDesigner have no source file, so this uses the
+	# compiled code of the functions and classes defined in the module instead
+	parts = []
+	for name, value in sorted(vars(module).items()):
+		if getattr(value, '__module__', None) != module.__name__:
+			continue
+		for code in _getCodeObjects(value):
+			parts.append(marshal.dumps(code))
+	return parts
+
+def _getCodeObjects(value, depth=0):
+	if isinstance(value, (staticmethod, classmethod)):
+		value = value.__func__
+	if isinstance(value, property):
+		for accessor in (value.fget, value.fset, value.fdel):
+			if accessor is not None:
+				yield from _getCodeObjects(accessor, depth)
+	elif hasattr(value, '__code__'):
+		yield value.__code__
+	elif isinstance(value, type) and depth < 4:
+		for name, attr in sorted(vars(value).items()):
+			yield from _getCodeObjects(attr, depth + 1)
+
+class _PatternBuildCache(LoggableSubComponent):
+	"""
+	On-disk cache of built PatternData, keyed by a hash of the SVG content, the pattern
+	settings, and the version of the builder code.
+	Entries are evicted in least-recently-used order (based on file modification times)
+	when the total size of the cache exceeds the limit.
+	"""
+	def __init__(self, hostobj, cachedir: str, maxbytes: int, codeversion: str):
+		super().__init__(hostobj, logprefix='BuildCache')
+		self.cachedir = cachedir
+		self.maxbytes = maxbytes
+		self.codeversion = codeversion
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lastresult = None  # type: Optional[str]
+
+	def makeKey(self, svgxml: str, settingsobj: dict):
+		hasher = hashlib.sha1()
+		hasher.update((svgxml or '').encode('utf-8'))
+		hasher.update(b'\0')
+		hasher.update(json.dumps(settingsobj or {}, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+		hasher.update(b'\0')
+		hasher.update(self.codeversion.encode('utf-8'))
+		return hasher.hexdigest()
+
+	def _entryPath(self, key: str):
+		return os.path.join(self.cachedir, key + '.json')
+
+	def load(self, key: str) -> Optional[PatternData]:
+		filepath = self._entryPath(key)
+		try:
+			with open(filepath, mode='r') as infile:
+				obj = json.load(infile)
+		except (OSError, ValueError):
+			self.misses += 1
+			self.lastresult = 'miss'
+			return None
+		# mark the entry as recently used
+		try:
+			os.utime(filepath)
+		except OSError:
+			pass
+		self.hits += 1
+		self.lastresult = 'hit'
+		if 'settings' in obj:
+			del obj['settings']
+		return PatternData.FromJsonDict(obj)
+
+	def store(self, key: str, patterndata: PatternData):
+		obj = patterndata.ToJsonDict()
+		if 'settings' in obj:
+			del obj['settings']
+		filepath = self._entryPath(key)
+		try:
+			os.makedirs(self.cachedir, exist_ok=True)
+			tempfilepath = filepath + '.tmp'
+			with open(tempfilepath, mode='w') as outfile:
+				json.dump(obj, outfile, separators=(',', ':'), sort_keys=True)
+			os.replace(tempfilepath, filepath)
+		except OSError as e:
+			self._LogEvent('Unable to write cache entry {}: {}'.format(filepath, e))
+			return
+		self._evict()
+
+	def _evict(self):
+		entries = []
+		totalbytes = 0
+		with os.scandir(self.cachedir) as scanner:
+			for entry in scanner:
+				if not entry.is_file() or not entry.name.endswith('.json'):
+					continue
+				stat = entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+				totalbytes += stat.st_size
+		if totalbytes <= self.maxbytes:
+			return
+		entries.sort()
+		for _, size, filepath in entries:
+			if totalbytes <= self.maxbytes:
+				break
+			try:
+				os.remove(filepath)
+			except OSError:
+				continue
+			totalbytes -= size
+			self.evictions += 1
+			self._LogEvent('Evicted cache entry {}'.format(filepath))
+
+# below this many paths with curves (which take around 40-80ms each to parse), starting
+# worker processes (around 0.1-0.5s) costs about as much as it saves
+_MinPathsForWorkers = 20
+
+_DefaultParseWorkers = min(4, os.cpu_count() or 1)
+
+class _ParsedSvg:
+	def __init__(self, shapetable: ShapeTable, paths: List[PathInfo], svgwidth, svgheight, scale):
+		self.shapetable = shapetable
+		self.paths = paths
+		self.svgwidth = svgwidth
+		self.svgheight = svgheight
+		self.scale = scale
+
+	@classmethod
+	def FromParser(cls, parser: '_SvgParser'):
+		return cls(parser.shapetable, parser.paths, parser.svgwidth, parser.svgheight, parser.scale)
+
+	def copy(self):
+		return _ParsedSvg(
+			self.shapetable.copy(), copy.deepcopy(self.paths), self.svgwidth, self.svgheight, self.scale)
+
+class _IncrementalBuildState(LoggableSubComponent):
+	"""
+	In-memory state kept between builds, so that when only the pattern settings change, the
+	SVG isn't parsed again, and only the group generators whose specs (or inputs) changed are
+	run again.
+	"""
+	def __init__(self, hostobj):
+		super().__init__(hostobj, logprefix='Incremental')
+		self.parsekey = None  # type: Optional[str]
+		self.parsed = None  # type: Optional[_ParsedSvg]
+		self.groupoutputs = GroupGenOutputCache()
+
+	@staticmethod
+	def _makeParseKey(svgxml: str, settings: PatternSettings):
+		hasher = hashlib.sha1()
+		hasher.update((svgxml or '').encode('utf-8'))
+		hasher.update(b'\0')
+		hasher.update(json.dumps({
+			'recenter': settings.recenter,
+			'rescale': settings.rescale,
+			'fixtrianglecenters': settings.fixtrianglecenters,
+		}, sort_keys=True).encode('utf-8'))
+		return hasher.hexdigest()
+
+	def loadParsedSvg(self, svgxml: str, settings: PatternSettings) -> Optional[_ParsedSvg]:
+		parsekey = self._makeParseKey(svgxml, settings)
+		# inferred groups only depend on the shapes, so they're part of the input for every generator
+		self.groupoutputs.inputkey = '{}:{}'.format(parsekey, settings.autogroup in (None, True))
+		if parsekey != self.parsekey or self.parsed is None:
+			self.parsekey = parsekey
+			self.parsed = None
+			self.groupoutputs.clear()
+			self._LogEvent('Parsing SVG')
+			return None
+		self._LogEvent('Reusing shapes from previous build')
+		# the shapes are modified during the build, so the stored ones are kept separate
+		return self.parsed.copy()
+
+	def storeParsedSvg(self, parsed: _ParsedSvg):
+		self.parsed = parsed.copy()
+
 class _SvgParser(LoggableSubComponent):
-	def __init__(self, hostobj, settings: PatternSettings):
+	def __init__(self, hostobj, settings: PatternSettings, workers: int=None, workerpython: str=None):
 		super().__init__(hostobj=hostobj, logprefix='SvgParser')
 		self.svgwidth = 0
 		self.svgheight = 0
 		self.scale = 1
 		self.offset = tdu.Vector(0, 0, 0)
+		self.shapetable = ShapeTable()
 		self.shapes = []  # type: List[ShapeInfo]
 		self.paths = []  # type: List[PathInfo]
 		self.minbound = tdu.Vector(0, 0, 0)
 		self.maxbound = tdu.Vector(0, 0, 0)
 		self.settings = settings
+		# when using worker processes, path elements are collected during the pass through
+		# the document and then parsed together
+		self.workers = workers or 0
+		self.workerpython = workerpython
+		self.pendingpaths = [] if self.workers > 1 else None  # type: List[_SvgPathElem]
 
 	def parse(self, svgxml):
 		if not svgxml:
 			return
-		root = ET.fromstring(svgxml)
-		self.svgwidth = float(root.get('width', 1))
-		self.svgheight = float(root.get('height', 1))
-		self.scale = 1 / max(self.svgwidth, self.svgheight)
-		self.offset = tdu.Vector(-self.svgwidth / 2, -self.svgheight / 2, 0)
-		self._handleElem(root, 0, namestack=[])
+		self._parseElements(svgxml)
+		self._handlePendingPaths()
 		if not self.shapes:
 			return
-		minbounds = [shape.minbound for shape in self.shapes]
-		self.minbound = tdu.Vector(
-			min(b.x for b in minbounds),
-			min(b.y for b in minbounds),
-			min(b.z for b in minbounds))
-		maxbounds = [shape.maxbound for shape in self.shapes]
-		self.maxbound = tdu.Vector(
-			max(b.x for b in maxbounds),
-			max(b.y for b in maxbounds),
-			max(b.z for b in maxbounds))
+		minbound, maxbound = self.shapetable.bounds()
+		self.minbound = tdu.Vector(minbound)
+		self.maxbound = tdu.Vector(maxbound)
 		if self.settings.recenter:
 			self._recenterCoords()
 		if self.settings.rescale:
@@ -562,42 +957,42 @@ class _SvgParser(LoggableSubComponent):
 		else:
 			center = tdu.Vector(averagePoints([self.minbound, self.maxbound]))
 		offset = -center
-		for shape in self.shapes:
-			shape.offsetPoints(offset)
+		self.shapetable.offsetPoints([offset.x, offset.y, offset.z])
 		for path in self.paths:
 			path.offsetPoints(offset)
 
 	def _rescaleCoords(self):
 		size = self.maxbound - self.minbound
 		self.scale = 1 / max(size.x, size.y, size.z)
-		for shape in self.shapes:
-			shape.scalePoints(self.scale)
+		self.shapetable.scalePoints(self.scale)
 		for path in self.paths:
 			path.scalePoints(self.scale)
 
 	def _calculateShapeCenter(self, shape: ShapeInfo):
-		if shape.istriangle and self.settings.fixtrianglecenters:
-			self._LogEvent('Shape has is triangle, attempting to fix triangle center')
-			try:
-				shape.calculateTriangleCenter()
-				self._LogEvent('Successfully calculated triangle center for shape: {}'.format(shape))
-			except Exception as e:
-				self._LogEvent('WARNING: unable to calculate triangle center for shape {} {}'.format(e, shape))
-				shape.calculateCenter()
-		else:
-			# if self.settings.fixtrianglecenters:
-			# 	self._LogEvent('Shape is not a triangle, NOT attempting to fix triangle center')
-			shape.calculateCenter()
+		shape.calculateCenter()
+		self._fixTriangleCenter(shape)
+
+	def _fixTriangleCenter(self, shape: ShapeInfo):
+		if not shape.istriangle or not self.settings.fixtrianglecenters:
+			return
+		self._LogEvent('Shape has is triangle, attempting to fix triangle center')
+		try:
+			shape.calculateTriangleCenter()
+			self._LogEvent('Successfully calculated triangle center for shape: {}'.format(shape))
+		except Exception as e:
+			# the shape keeps the average center
+			self._LogEvent('WARNING: unable to calculate triangle center for shape {} {}'.format(e, shape))
 
 	@loggedmethod
 	def _calculateShapeCenters(self):
-		for shape in self.shapes:
-			self._calculateShapeCenter(shape)
+		self.shapetable.calculateCenters()
+		if self.settings.fixtrianglecenters:
+			for shape in self.shapes:
+				self._fixTriangleCenter(shape)
 
 	@loggedmethod
 	def _calculateShapeRadiuses(self):
-		for shape in self.shapes:
-			shape.calculateRadius()
+		self.shapetable.calculateRadiuses()
 
 	@staticmethod
 	def _elemName(elem: ET.Element, indexinparent: int):
@@ -611,79 +1006,209 @@ class _SvgParser(LoggableSubComponent):
 			suffix = '[{}]'.format(indexinparent)
 		return tagname + suffix
 
-	def _handleElem(self, elem: ET.Element, indexinparent: int, namestack: List[str]):
-		elemname = self._elemName(elem, indexinparent)
+	def _loadRootElem(self, root: ET.Element):
+		self.svgwidth = float(root.get('width', 1))
+		self.svgheight = float(root.get('height', 1))
+		self.scale = 1 / max(self.svgwidth, self.svgheight)
+		self.offset = tdu.Vector(-self.svgwidth / 2, -self.svgheight / 2, 0)
+
+	def _shouldSkipElem(self, elem: ET.Element, elemname: str):
 		elemid = elem.get('id', '')
-		if elemid == 'Background' or elemid.startswith('-'):
-			self._LogEvent('Skipping element: {}...'.format(ET.tostring(elem)[:30]))
+		if elemid == 'Background' or elemid.startswith('-') or elem.get('display') == 'none':
+			self._LogEvent('Skipping element: {}...'.format(elemname))
+			return True
+		return False
+
+	def _parseElements(self, svgxml: str):
+		"""
+		Streams through the document, handling each path element as soon as it closes
+		and then discarding it, so that the full element tree is never held in memory.
+		Shapes are produced in document order, matching a depth-first walk of the tree.
+		"""
+		frames = []  # type: List[_SvgElemFrame]
+		namestack = []  # type: List[str]
+		for event, elem in ET.iterparse(io.StringIO(svgxml), events=('start', 'end')):
+			if event == 'start':
+				if not frames:
+					self._loadRootElem(elem)
+					indexinparent = 0
+					skipped = False
+				else:
+					parentframe = frames[-1]
+					indexinparent = parentframe.childcount
+					parentframe.childcount += 1
+					skipped = parentframe.skipchildren
+				elemname = self._elemName(elem, indexinparent)
+				if not skipped and self._shouldSkipElem(elem, elemname):
+					skipped = True
+				ispath = not skipped and _localName(elem.tag) == 'path'
+				frame = _SvgElemFrame(
+					elem,
+					elemname,
+					ispath=ispath,
+					skipchildren=skipped or ispath,
+					innamestack=not skipped and not ispath)
+				frames.append(frame)
+				if frame.innamestack:
+					namestack.append(elemname)
+			else:
+				frame = frames.pop()
+				if frame.ispath:
+					try:
+						self._handlePathElem(elem, elemname=frame.elemname, namestack=namestack)
+					except Exception as e:
+						self._LogEvent('Skipping element with invalid svg path (namestack: {}, error: {})'.format(namestack, e))
+				elif frame.innamestack:
+					namestack.pop()
+				# the element (and everything before it in its parent) is done,
+				# so release it rather than letting the tree accumulate
+				elem.clear()
+				if frames:
+					del frames[-1].elem[:]
+
+	def _handlePathElem(self, pathelem, elemname: str, namestack: List[str]):
+		pathelemdata = _SvgPathElem(pathelem, elemname=elemname, namestack=namestack)
+		if self.pendingpaths is not None:
+			self.pendingpaths.append(pathelemdata)
 			return
-		if elem.get('display') == 'none':
-			self._LogEvent('Skipping element: {}...'.format(ET.tostring(elem)[:30]))
+		self._addParsedPathShape(pathelemdata)
+
+	def _addParsedPathShape(self, pathelemdata: '_SvgPathElem'):
+		try:
+			parsed = pattern_svg_paths.parsePathData(pathelemdata.rawpath, self._offsetXY, self.scale)
+			self._addPathShape(pathelemdata, parsed)
+		except Exception as e:
+			self._LogEvent('Skipping element with invalid svg path (path: {}, error: {})'.format(
+				pathelemdata.shapepath, e))
+
+	@property
+	def _offsetXY(self):
+		return self.offset.x, self.offset.y
+
+	def _handlePendingPaths(self):
+		pendingpaths = self.pendingpaths
+		self.pendingpaths = None
+		if not pendingpaths:
 			return
-		tagname = _localName(elem.tag)
-		if tagname == 'path':
+		# paths with only straight lines are quick to parse here, so only the ones that need
+		# curve lengths calculated are sent to the workers
+		results = [None] * len(pendingpaths)  # type: List[Tuple[Optional[pattern_svg_paths.ParsedPath], Optional[str]]]
+		curveindices = []
+		for i, pathelemdata in enumerate(pendingpaths):
 			try:
-				self._handlePathElem(elem, elemname=elemname, namestack=namestack)
+				parsed = pattern_svg_paths.parsePolylinePathData(pathelemdata.rawpath, self._offsetXY, self.scale)
 			except Exception as e:
-				self._LogEvent('Skipping element with invalid svg path (namestack: {}, error: {})'.format(namestack, e))
-		else:
-			childnamestack = namestack + [elemname]
-			for childindex, childelem in enumerate(list(elem)):
-				self._handleElem(childelem, childindex, namestack=childnamestack)
-
-	def _handlePathElem(self, pathelem, elemname: str, namestack: List[str]):
-		rawpath = pathelem.get('d')
-		path = svgpath.parse_path(rawpath)
-		if len(path) < 2:
-			raise Exception('Unsupported path (too short) {}'.format(rawpath))
-		firstsegment = path[0]
-		if not isinstance(firstsegment, svgpath.Move):
-			raise Exception('Unsupported path (must start with Move) {}'.format(rawpath))
-		pointpositions = [_pathPoint(firstsegment.start)]
-		for segment in path[1:]:
-			if isinstance(segment, (svgpath.CubicBezier, svgpath.QuadraticBezier)):
-				self._LogEvent('WARNING: treating bezier as line {}...'.format(rawpath[0:20]))
-			elif not isinstance(segment, svgpath.Line):
-				raise Exception('Unsupported path (can only contain Line after first segment) {} {}'.format(
-					type(segment), rawpath))
-			pathpt = _pathPoint(segment.end)
-			pointpositions.append(pathpt)
-		# if pointpositions[-1] == pointpositions[0]:
-		# 	pointpositions.pop()
-		totaldist = path.length()
-		distances = _segmentDistances(path, self.scale)
-		totaldist *= self.scale
+				results[i] = None, str(e)
+				continue
+			if parsed is None:
+				curveindices.append(i)
+			else:
+				results[i] = parsed, None
+		curveresults = self._parseCurvePaths([pendingpaths[i].rawpath for i in curveindices])
+		for i, result in zip(curveindices, curveresults):
+			results[i] = result
+		for pathelemdata, (parsed, error) in zip(pendingpaths, results):
+			if error is not None:
+				self._LogEvent('Skipping element with invalid svg path (path: {}, error: {})'.format(
+					pathelemdata.shapepath, error))
+				continue
+			try:
+				self._addPathShape(pathelemdata, parsed)
+			except Exception as e:
+				self._LogEvent('Skipping element with invalid svg path (path: {}, error: {})'.format(
+					pathelemdata.shapepath, e))
+
+	def _parseCurvePaths(self, rawpaths: List[str]):
+		if len(rawpaths) < _MinPathsForWorkers:
+			return self._parsePathsInProcess(rawpaths)
+		executable = pattern_svg_paths.findWorkerPython(self.workerpython)
+		if executable is None:
+			self._LogEvent('No Python interpreter for parse workers, parsing {} paths in-process'.format(
+				len(rawpaths)))
+			return self._parsePathsInProcess(rawpaths)
+		self._LogEvent('Parsing {} paths with {} workers'.format(len(rawpaths), self.workers))
+		try:
+			return pattern_svg_paths.parsePathDataInPool(
+				rawpaths,
+				offset=self._offsetXY,
+				scale=self.scale,
+				workers=self.workers,
+				executable=executable)
+		except Exception as e:
+			self._LogEvent('Unable to parse paths with workers ({}), parsing in-process'.format(e))
+			return self._parsePathsInProcess(rawpaths)
+
+	def _parsePathsInProcess(self, rawpaths: List[str]):
+		results = []
+		for rawpath in rawpaths:
+			try:
+				results.append((pattern_svg_paths.parsePathData(rawpath, self._offsetXY, self.scale), None))
+			except Exception as e:
+				results.append((None, str(e)))
+		return results
+
+	def _addPathShape(self, pathelemdata: '_SvgPathElem', parsed: pattern_svg_paths.ParsedPath):
+		coords, distances, closed, warnings = parsed
+		for warning in warnings:
+			self._LogEvent(warning)
+		totaldist = distances[-1]
 		points = [
 			PointData(
-				pos=list((pos + self.offset) * self.scale),
-				absdist=distances[i],
-				reldist=distances[i] / totaldist
+				pos=[coords[i * 2], coords[i * 2 + 1], 0.0],
+				absdist=dist,
+				reldist=dist / totaldist
 			)
-			for i, pos in enumerate(pointpositions)
+			for i, dist in enumerate(distances)
 		]
-		shapename = pathelem.get('id', None)
-		shapepath = '/'.join(namestack + [elemname])
-		parentpath = '/'.join(namestack)
-		if path.closed:
+		if closed:
 			shapeindex = len(self.shapes)
 			self.shapes.append(ShapeInfo(
 				shapeindex=shapeindex,
-				shapename=shapename,
-				shapepath=shapepath,
-				parentpath=parentpath,
-				color=_getPathElementColor(pathelem),
+				shapename=pathelemdata.shapename,
+				shapepath=pathelemdata.shapepath,
+				parentpath=pathelemdata.parentpath,
+				color=pathelemdata.color,
 				shapelength=totaldist,
 				points=points,
+				table=self.shapetable,
 			))
 		else:
 			self.paths.append(PathInfo(
-				shapename=shapename,
-				shapepath=shapepath,
-				parentpath=parentpath,
+				shapename=pathelemdata.shapename,
+				shapepath=pathelemdata.shapepath,
+				parentpath=pathelemdata.parentpath,
 				shapelength=totaldist,
 				points=points,
 			))
 
+class _SvgPathElem:
+	"""
+	The parts of a path element that are needed to produce a shape, captured so that
+	the element itself can be released before the path data is parsed.
+	"""
+	__slots__ = ['rawpath', 'shapename', 'shapepath', 'parentpath', 'color']
+
+	def __init__(self, pathelem: ET.Element, elemname: str, namestack: List[str]):
+		self.rawpath = pathelem.get('d')
+		self.shapename = pathelem.get('id', None)
+		self.shapepath = '/'.join(namestack + [elemname])
+		self.parentpath = '/'.join(namestack)
+		self.color = _getPathElementColor(pathelem)
+
+class _SvgElemFrame:
+	__slots__ = ['elem', 'elemname', 'ispath', 'skipchildren', 'innamestack', 'childcount']
+
+	def __init__(self, elem: ET.Element, elemname: str, ispath: bool, skipchildren: bool, innamestack: bool):
+		self.elem = elem
+		self.elemname = elemname
+		self.ispath = ispath
+		self.skipchildren = skipchildren
+		self.innamestack = innamestack
+		self.childcount = 0
+
+def _withZ(pos, z: float):
+	return [pos[0], pos[1], z]
+
 def _localName(fullname: str):
 	if '}' in fullname:
 		return fullname.rsplit('}', maxsplit=1)[1]
@@ -728,17 +1253,6 @@ def _getPathElementColor(pathelem):
 	else:
 		return None
 
-def _segmentDistances(path: svgpath.Path, scale):
-	distsofar = 0
-	distances = [0]
-	for segment in path[1:]:
-		distsofar += segment.length() * scale
-		distances.append(distsofar)
-	return distances
-
-def _pathPoint(pathpt: complex):
-	return tdu.Position(pathpt.real, pathpt.imag, 0)
-
 def _parseTolerance(value: Union[bool, float, int]):
 	if value is None:
 		return None
@@ -832,11 +1346,13 @@ class _ShapeDeduplicator(LoggableSubComponent):
 
 	def _LoadDuplicateRemapperForShapes(self, shapes: List[ShapeInfo]):
 		dupremapper = _ShapeIndexRemapper(self, 'DeDup')
+		grid = _ShapeCenterGrid(shapes, self.tolerance)
 		for i, shape1 in enumerate(shapes):
 			if shape1.shapeindex in dupremapper:
 				continue
 			dupsforshape = []
-			for shape2 in shapes[i + 1:]:
+			for j in grid.nearbyPositions(shape1.center, after=i):
+				shape2 = shapes[j]
 				if shape2.isEquivalentTo(shape1, self.tolerance):
 					dupremapper[shape2.shapeindex] = shape1.shapeindex
 					dupsforshape.append(shape2.shapeindex)
@@ -869,6 +1385,44 @@ class _ShapeDeduplicator(LoggableSubComponent):
 		self.patterndata.shapes = remainingshapes
 		resequencer.RemapShapesInGroups(self.patterndata)
 
+class _ShapeCenterGrid:
+	"""
+	Spatial hash of shapes by center, using cells the size of the merge tolerance, so that
+	any shape within the tolerance of a point is in that point's cell or a neighboring one.
+	"""
+	def __init__(self, shapes: List[ShapeInfo], tolerance: float):
+		self.cellsize = tolerance
+		self.cells = defaultdict(list)  # type: Dict[Tuple, List[int]]
+		for i, shape in enumerate(shapes):
+			self.cells[self._cellKey(shape.center)].append(i)
+
+	def _cellKey(self, pos):
+		if not self.cellsize:
+			return tuple(pos)
+		return (
+			math.floor(pos[0] / self.cellsize),
+			math.floor(pos[1] / self.cellsize),
+			math.floor(pos[2] / self.cellsize))
+
+	def nearbyPositions(self, pos, after: int) -> List[int]:
+		"""
+		Gets the positions (in the original list), in order, of shapes with centers that may
+		be within the tolerance of `pos`, limited to those later than `after`.
+		"""
+		key = self._cellKey(pos)
+		if not self.cellsize:
+			return [i for i in self.cells.get(key, []) if i > after]
+		x, y, z = key
+		results = []
+		for dx in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				for dz in (-1, 0, 1):
+					cell = self.cells.get((x + dx, y + dy, z + dz))
+					if cell:
+						results += [i for i in cell if i > after]
+		results.sort()
+		return results
+
 def _ReplaceIndices(indexlist: List[int], replacements: Dict[int, int]):
 	if not indexlist:
 		return False
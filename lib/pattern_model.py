@@ -1,11 +1,20 @@
 from abc import ABC
+import re
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence, Set as AbstractSet
 from enum import Enum
+import json
+import math
 from dataclasses import dataclass
+from itertools import accumulate
 from colorsys import rgb_to_hsv
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, TextIO, Tuple, Union
 
 from .common import cleandict, excludekeys, mergedicts, BaseDataObject, transformkeys, setattrs, BaseDataObject2
-from .common import parseValueList, formatValue, formatValueList, averagePoints, triangleCenter
+from .common import parseValueList, formatValue, formatValueList, averagePoints, triangleCenter, cartesiantopolar
+from .common import parseIndexList, formatIndexList
+from .records import ObjectSchema, AttrSchema, ListTypeHandler, customHandler, jsonHandler
 
 print('pattern_model.py loading...')
 
@@ -63,9 +72,18 @@ class ShapeInfoBase(BaseDataObject2):
 
 	@classmethod
 	def FromJsonDict(cls, obj):
+		if 'pointdeltas' not in obj:
+			return cls(
+				points=PointData.FromJsonDicts(obj.get('points')),
+				**excludekeys(obj, ['points']))
+		coords, absdists, reldists = _decodePointDeltas(
+			obj['pointdeltas'], obj['pointprecision'], obj.get('shapelength'))
 		return cls(
-			points=PointData.FromJsonDicts(obj.get('points')),
-			**excludekeys(obj, ['points']))
+			points=[
+				PointData(pos=list(coords[i * 3:i * 3 + 3]), absdist=absdists[i], reldist=reldists[i])
+				for i in range(len(absdists))
+			],
+			**_leanJsonDictToFull(obj))
 
 	def offsetPoints(self, offset: 'tdu.Vector'):
 		for point in self.points:
@@ -75,21 +93,743 @@ class ShapeInfoBase(BaseDataObject2):
 		for point in self.points:
 			point.pos = list(tdu.Vector(point.pos) * scale)
 
-@dataclass
-class ShapeInfo(ShapeInfoBase):
-	shapeindex: int = 0
-	color: _RGBAColor = None
-	center: _XYZ = None
-	depthlayer: int = None
-	dupcount: int = None
-	radius: float = None
-	rotateaxis: float = None
+_NaN = float('nan')
+
+class ShapeTable:
+	"""
+	Columnar storage for the shapes of a pattern.
+
+	The points of all the shapes are kept in flat arrays, with each shape referring to a
+	contiguous range of them, and each shape attribute is a column with an entry per shape.
+	ShapeInfo objects are lightweight views of rows in a table.
+	Values are stored as float64, so positions match those calculated with (float32)
+	tdu.Vector objects within float32 precision, rather than exactly.
+	"""
+	def __init__(self):
+		# x, y, z for each point
+		self.coords = array('d')
+		self.absdists = array('d')
+		self.reldists = array('d')
+		self.pointstarts = array('l')
+		self.pointcounts = array('l')
+		self.shapeindices = array('l')
+		self.shapenames = []  # type: List[Optional[str]]
+		self.shapepaths = []  # type: List[Optional[str]]
+		self.parentpaths = []  # type: List[Optional[str]]
+		# NaN for missing values
+		self.shapelengths = array('d')
+		self.colors = []  # type: List[Optional[List[int]]]
+		# x, y, z for each shape, with NaN for shapes that don't have a center
+		self.centers = array('d')
+		self.depthlayers = []  # type: List[Union[int, str, None]]
+		self.dupcounts = array('l')
+		# NaN for missing values
+		self.radiuses = array('d')
+		self.rotateaxes = []  # type: List[Optional[float]]
+		# shapepaths split into segments, filled in when first needed
+		self.shapepathparts = []  # type: List[Optional[Tuple[str, ...]]]
+		# the view for each row
+		self.views = []  # type: List[ShapeInfo]
+
+	def __len__(self):
+		return len(self.views)
 
-	def __post_init__(self):
-		super().__post_init__()
-		self.color = list(self.color) if self.color else None
-		self.center = list(self.center) if self.center else None
-		self.dupcount = self.dupcount or 0
+	@property
+	def pointcount(self):
+		return len(self.absdists)
+
+	def _appendRow(self, view: 'ShapeInfo'):
+		view._table = self
+		view._row = len(self.views)
+		self.views.append(view)
+		self.pointstarts.append(len(self.absdists))
+		self.pointcounts.append(0)
+		self.shapeindices.append(0)
+		self.shapenames.append(None)
+		self.shapepaths.append(None)
+		self.parentpaths.append(None)
+		self.shapelengths.append(_NaN)
+		self.colors.append(None)
+		self.centers.extend((_NaN, _NaN, _NaN))
+		self.depthlayers.append(None)
+		self.dupcounts.append(0)
+		self.radiuses.append(_NaN)
+		self.rotateaxes.append(None)
+		self.shapepathparts.append(None)
+		return view._row
+
+	def _appendRowFrom(self, othertable: 'ShapeTable', otherrow: int, view: 'ShapeInfo'):
+		row = self._appendRow(view)
+		start = othertable.pointstarts[otherrow]
+		end = start + othertable.pointcounts[otherrow]
+		self.coords.extend(othertable.coords[start * 3:end * 3])
+		self.absdists.extend(othertable.absdists[start:end])
+		self.reldists.extend(othertable.reldists[start:end])
+		self.pointcounts[row] = end - start
+		self.shapeindices[row] = othertable.shapeindices[otherrow]
+		self.shapenames[row] = othertable.shapenames[otherrow]
+		self.shapepaths[row] = othertable.shapepaths[otherrow]
+		self.parentpaths[row] = othertable.parentpaths[otherrow]
+		self.shapelengths[row] = othertable.shapelengths[otherrow]
+		self.colors[row] = othertable.colors[otherrow]
+		self.centers[row * 3:row * 3 + 3] = othertable.centers[otherrow * 3:otherrow * 3 + 3]
+		self.depthlayers[row] = othertable.depthlayers[otherrow]
+		self.dupcounts[row] = othertable.dupcounts[otherrow]
+		self.radiuses[row] = othertable.radiuses[otherrow]
+		self.rotateaxes[row] = othertable.rotateaxes[otherrow]
+		self.shapepathparts[row] = othertable.shapepathparts[otherrow]
+		return row
+
+	def addShapes(self, shapes: Iterable['ShapeInfo']):
+		"""
+		Moves shapes into this table, and rebinds their views to it.
+		"""
+		for shape in shapes:
+			if shape._table is not self:
+				self._appendRowFrom(shape._table, shape._row, shape)
+
+	def selectRows(self, rows: Iterable[int]) -> 'ShapeTable':
+		"""
+		Creates a table with only the specified rows (in that order), and rebinds their
+		views to it.
+		"""
+		table = ShapeTable()
+		for row in rows:
+			table._appendRowFrom(self, row, self.views[row])
+		return table
+
+	def createViews(self):
+		"""
+		Creates a view for each row, for a table whose columns were filled in directly.
+		"""
+		self.views = []
+		for row in range(len(self.pointcounts)):
+			view = ShapeInfo.__new__(ShapeInfo)
+			view._table = self
+			view._row = row
+			self.views.append(view)
+
+	def copy(self) -> 'ShapeTable':
+		"""
+		Creates a separate copy of this table, with new views for all of its rows.
+		"""
+		table = ShapeTable()
+		for row in range(len(self.views)):
+			table._appendRowFrom(self, row, ShapeInfo.__new__(ShapeInfo))
+		table.colors = [list(color) if color is not None else None for color in table.colors]
+		return table
+
+	def _setPoints(self, row: int, points: Iterable[Union['PointData', '_ShapePointView']]):
+		coords = array('d')
+		absdists = array('d')
+		reldists = array('d')
+		for point in points:
+			pos = point.pos
+			coords.extend((pos[0], pos[1], pos[2] if len(pos) > 2 else 0.0))
+			absdists.append(point.absdist)
+			reldists.append(point.reldist)
+		self._replacePoints(row, coords, absdists, reldists)
+
+	def _setPointDeltas(self, row: int, pointdeltas: str, precision: float):
+		shapelength = self.shapelengths[row]
+		coords, absdists, reldists = _decodePointDeltas(
+			pointdeltas, precision, None if shapelength != shapelength else shapelength)
+		self._replacePoints(row, coords, absdists, reldists)
+
+	def _replacePoints(self, row: int, coords: array, absdists: array, reldists: array):
+		start = self.pointstarts[row]
+		oldcount = self.pointcounts[row]
+		self.coords[start * 3:(start + oldcount) * 3] = coords
+		self.absdists[start:start + oldcount] = absdists
+		self.reldists[start:start + oldcount] = reldists
+		newcount = len(absdists)
+		self.pointcounts[row] = newcount
+		if newcount != oldcount:
+			shift = newcount - oldcount
+			for laterrow in range(row + 1, len(self.views)):
+				self.pointstarts[laterrow] += shift
+
+	def getPointPos(self, pointindex: int):
+		return list(self.coords[pointindex * 3:pointindex * 3 + 3])
+
+	def setPointPos(self, pointindex: int, pos: _XYZ):
+		self.coords[pointindex * 3] = pos[0]
+		self.coords[pointindex * 3 + 1] = pos[1]
+		self.coords[pointindex * 3 + 2] = pos[2] if len(pos) > 2 else 0.0
+
+	def getCenter(self, row: int):
+		center = self.centers[row * 3:row * 3 + 3]
+		if center[0] != center[0]:
+			return None
+		return list(center)
+
+	def setCenter(self, row: int, center: Optional[_XYZ]):
+		if not center:
+			center = _NaN, _NaN, _NaN
+		self.centers[row * 3] = center[0]
+		self.centers[row * 3 + 1] = center[1]
+		self.centers[row * 3 + 2] = center[2] if len(center) > 2 else 0.0
+
+	def offsetPoints(self, offset: _XYZ, rows: Iterable[int] = None):
+		"""
+		Offsets the points of the specified rows (or all rows) in bulk.
+		"""
+		for start, end in self._pointRanges(rows):
+			for axis in range(3):
+				delta = offset[axis]
+				if delta:
+					axisvals = self.coords[start * 3 + axis:end * 3:3]
+					self.coords[start * 3 + axis:end * 3:3] = array('d', [val + delta for val in axisvals])
+
+	def scalePoints(self, scale: float, rows: Iterable[int] = None):
+		"""
+		Scales the positions of the points of the specified rows (or all rows) in bulk.
+		"""
+		for start, end in self._pointRanges(rows):
+			self.coords[start * 3:end * 3] = array('d', [val * scale for val in self.coords[start * 3:end * 3]])
+
+	def isOpenLoop(self, row: int):
+		count = self.pointcounts[row]
+		if count < 4:
+			return False
+		start = self.pointstarts[row]
+		end = start + count - 1
+		return self.coords[start * 3:start * 3 + 3] == self.coords[end * 3:end * 3 + 3]
+
+	def calculateCenters(self, rows: Iterable[int] = None):
+		"""
+		Sets the center of each of the specified rows (or all rows) to the average of its
+		points, ignoring the repeated last point of open loops.
+		"""
+		coords = self.coords
+		centers = self.centers
+		for row in (range(len(self.views)) if rows is None else rows):
+			start = self.pointstarts[row]
+			count = self.pointcounts[row]
+			if self.isOpenLoop(row):
+				count -= 1
+			end = start + count
+			if not count:
+				centers[row * 3:row * 3 + 3] = array('d', [0.0, 0.0, 0.0])
+				continue
+			centers[row * 3] = sum(coords[start * 3:end * 3:3]) / count
+			centers[row * 3 + 1] = sum(coords[start * 3 + 1:end * 3:3]) / count
+			centers[row * 3 + 2] = sum(coords[start * 3 + 2:end * 3:3]) / count
+
+	def calculateRadiuses(self, rows: Iterable[int] = None):
+		"""
+		Sets the radius of each of the specified rows (or all rows) to the distance from its
+		center to its farthest point.
+		"""
+		coords = self.coords
+		centers = self.centers
+		sqrt = math.sqrt
+		for row in (range(len(self.views)) if rows is None else rows):
+			cx, cy, cz = centers[row * 3:row * 3 + 3]
+			start = self.pointstarts[row]
+			end = start + self.pointcounts[row]
+			radius = 0.0
+			for i in range(start * 3, end * 3, 3):
+				dx = coords[i] - cx
+				dy = coords[i + 1] - cy
+				dz = coords[i + 2] - cz
+				dist = sqrt(dx * dx + dy * dy + dz * dz)
+				if dist > radius:
+					radius = dist
+			self.radiuses[row] = radius
+
+	def hsvColors(self, rows: Iterable[int] = None) -> array:
+		"""
+		Converts the colors of the specified rows (or all rows) to HSV in one pass, returning
+		hue, saturation, value for each row, with NaN for rows that don't have a color.
+		"""
+		colors = self.colors
+		hsvs = array('d')
+		# patterns tend to reuse a small number of colors, so each one is only converted once
+		converted = {}  # type: Dict[Tuple[float, float, float], Tuple[float, float, float]]
+		nohsv = _NaN, _NaN, _NaN
+		for row in (range(len(self.views)) if rows is None else rows):
+			color = colors[row]
+			if not color:
+				hsvs.extend(nohsv)
+				continue
+			rgb = color[0], color[1], color[2]
+			hsv = converted.get(rgb)
+			if hsv is None:
+				hsv = converted[rgb] = rgb_to_hsv(*rgb)
+			hsvs.extend(hsv)
+		return hsvs
+
+	def attributeValues(self, part: str) -> List[Any]:
+		"""
+		Gets the values of one of the SequenceByTypes attributes for every row, with None for
+		rows that don't have a value.
+		"""
+		rowcount = len(self.views)
+		if part in SequenceByTypes.rgb:
+			index = SequenceByTypes.rgb.index(part)
+			return [color[index] if color else None for color in self.colors]
+		if part in SequenceByTypes.hsv:
+			index = SequenceByTypes.hsv.index(part)
+			hsvs = self.hsvColors()
+			return [
+				hsvs[row * 3 + index] if hsvs[row * 3] == hsvs[row * 3] else None
+				for row in range(rowcount)
+			]
+		centers = self.centers
+		if part in SequenceByTypes.xy:
+			index = SequenceByTypes.xy.index(part)
+			return [
+				centers[row * 3 + index] if centers[row * 3] == centers[row * 3] else None
+				for row in range(rowcount)
+			]
+		if part == SequenceByTypes.distance:
+			return [
+				cartesiantopolar(centers[row * 3], centers[row * 3 + 1])[0]
+				if centers[row * 3] == centers[row * 3] else None
+				for row in range(rowcount)
+			]
+		raise Exception('Unsupported attribute: {!r}'.format(part))
+
+	def containsPoint(self, row: int, x: float, y: float):
+		"""
+		Tests whether a shape contains a point using the even-odd rule, ignoring the repeated
+		last point of open loops.
+		"""
+		count = self.pointcounts[row]
+		if self.isOpenLoop(row):
+			count -= 1
+		if not count:
+			return False
+		coords = self.coords
+		start = self.pointstarts[row] * 3
+		# the edges are walked from each point to the next, ending with the edge from the last
+		# point back to the first, which keeps the rounding of the intersections consistent
+		inside = False
+		p1x = coords[start]
+		p1y = coords[start + 1]
+		for i in range(1, count + 1):
+			j = start + (i % count) * 3
+			p2x = coords[j]
+			p2y = coords[j + 1]
+			if p1y < p2y:
+				ylow, yhigh = p1y, p2y
+			else:
+				ylow, yhigh = p2y, p1y
+			if ylow < y <= yhigh and (x <= p1x or x <= p2x):
+				if p1x == p2x:
+					inside = not inside
+				else:
+					# ylow < yhigh here, so the edge isn't horizontal
+					xints = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+					if x <= xints:
+						inside = not inside
+			p1x = p2x
+			p1y = p2y
+		return inside
+
+	def findContainingRows(
+			self,
+			positions: Iterable[_XYZ],
+			rows: Iterable[int] = None) -> Dict[int, List[int]]:
+		"""
+		Tests many points against many shapes (the specified rows, or all rows) at once.
+		Shapes are first narrowed down by their bounds, and the result is sparse: it has an
+		entry for each position index that is inside at least one shape, listing those rows in
+		the order they were given.
+		"""
+		rows = list(range(len(self.views)) if rows is None else rows)
+		grid = ShapeBoundsGrid([self.views[row] for row in rows])
+		hits = {}  # type: Dict[int, List[int]]
+		for posindex, pos in enumerate(positions):
+			x, y = pos[0], pos[1]
+			posrows = [
+				rows[i]
+				for i in grid.candidatePositions(x, y)
+				if self.containsPoint(rows[i], x, y)
+			]
+			if posrows:
+				hits[posindex] = posrows
+		return hits
+
+	def setPointDepths(self, row: int, z: float):
+		start = self.pointstarts[row]
+		count = self.pointcounts[row]
+		self.coords[start * 3 + 2:(start + count) * 3:3] = array('d', [z] * count)
+
+	def bounds(self, rows: Iterable[int] = None):
+		"""
+		Gets the minimum and maximum x, y, z values of the points of the specified rows
+		(or all rows).
+		"""
+		minbound = [None, None, None]
+		maxbound = [None, None, None]
+		for start, end in self._pointRanges(rows):
+			if start == end:
+				continue
+			for axis in range(3):
+				axisvals = self.coords[start * 3 + axis:end * 3:3]
+				low = min(axisvals)
+				high = max(axisvals)
+				if minbound[axis] is None or low < minbound[axis]:
+					minbound[axis] = low
+				if maxbound[axis] is None or high > maxbound[axis]:
+					maxbound[axis] = high
+		if minbound[0] is None:
+			return None, None
+		return minbound, maxbound
+
+	def _pointRanges(self, rows: Optional[Iterable[int]]):
+		if rows is None:
+			return [(0, len(self.absdists))]
+		return [
+			(self.pointstarts[row], self.pointstarts[row] + self.pointcounts[row])
+			for row in rows
+		]
+
+	def pointsToJsonDicts(self, row: int):
+		start = self.pointstarts[row]
+		coords = self.coords
+		absdists = self.absdists
+		reldists = self.reldists
+		return [
+			{
+				'pos': list(coords[i * 3:i * 3 + 3]),
+				'absdist': absdists[i],
+				'reldist': reldists[i],
+			}
+			for i in range(start, start + self.pointcounts[row])
+		]
+
+	def pointsToDeltas(self, row: int, precision: float):
+		start = self.pointstarts[row]
+		return _encodePointDeltas(self.coords[start * 3:(start + self.pointcounts[row]) * 3], precision)
+
+	def rowToJsonDict(self, row: int, pointprecision: float = None):
+		"""
+		Converts a row to a JSON dict. When `pointprecision` is provided, the points are
+		written in the lean form (see _encodePointDeltas()) instead of as full point dicts,
+		and the center, length and radius are rounded to the same precision. The parent path
+		is also left out when it can be derived from the shape path.
+		"""
+		radius = self.radiuses[row]
+		radius = None if radius != radius else radius
+		shapelength = self.shapelengths[row]
+		shapelength = None if shapelength != shapelength else shapelength
+		center = self.getCenter(row)
+		parentpath = self.parentpaths[row]
+		pointdeltas = None
+		if pointprecision:
+			pointdeltas = self.pointsToDeltas(row, pointprecision)
+			# only lean dicts (with points) get the parent path filled back in
+			if pointdeltas and parentpath == _parentPathOf(self.shapepaths[row]):
+				parentpath = None
+			radius = _roundToPrecision(radius, pointprecision)
+			shapelength = _roundToPrecision(shapelength, pointprecision)
+			if center is not None:
+				center = [_roundToPrecision(val, pointprecision) for val in center]
+		return cleandict(
+			{
+				'shapeindex': self.shapeindices[row],
+				'shapename': self.shapenames[row],
+				'shapepath': self.shapepaths[row],
+				'parentpath': parentpath,
+				'color': self.colors[row],
+				'center': center,
+				'shapelength': shapelength,
+				'depthlayer': self.depthlayers[row] or None,
+				'dupcount': self.dupcounts[row] or None,
+				'radius': radius or None,
+				'rotateaxis': self.rotateaxes[row] or None,
+				'points': None if pointprecision else self.pointsToJsonDicts(row),
+				'pointdeltas': pointdeltas,
+				'pointprecision': pointprecision if pointdeltas else None,
+			})
+
+def _parentPathOf(shapepath: Optional[str]):
+	if not shapepath or '/' not in shapepath:
+		return None
+	return shapepath.rsplit('/', 1)[0]
+
+def _leanJsonDictToFull(obj: Dict[str, Any]):
+	"""
+	Gets the attributes of a shape or path JSON dict in the lean form, other than the
+	points, filling in the parent path if it was left out.
+	"""
+	attrs = excludekeys(obj, ['points', 'pointdeltas', 'pointprecision'])
+	if 'parentpath' not in attrs:
+		attrs['parentpath'] = _parentPathOf(attrs.get('shapepath'))
+	return attrs
+
+def _roundToPrecision(val: Optional[float], precision: float):
+	if val is None:
+		return None
+	return round(val, max(0, math.ceil(-math.log10(precision))))
+
+def _encodePointDeltas(coords: Iterable[float], precision: float):
+	"""
+	Encodes the lean form of a list of points, which is used to keep pattern files small.
+	The x, y, z coordinates are quantized to multiples of `precision`, and each point
+	after the first is written as the difference from the previous one. The distances
+	along the shape aren't included, since they can be recalculated from the positions.
+	"""
+	quantized = [round(val / precision) for val in coords]
+	deltas = quantized[:3] + [quantized[i] - quantized[i - 3] for i in range(3, len(quantized))]
+	return ' '.join(map(str, deltas))
+
+def _decodePointDeltas(pointdeltas: str, precision: float, shapelength: Optional[float]):
+	"""
+	Decodes the lean form of a list of points into flat coordinates and the absolute and
+	relative distances along the shape, which are recalculated as the accumulated lengths
+	of the segments between the points. The absolute distances are scaled to `shapelength`,
+	if there is one, so that they stay consistent with it.
+	"""
+	if not pointdeltas:
+		return array('d'), array('d'), array('d')
+	deltas = list(map(int, pointdeltas.split(' ')))
+	xs = accumulate(deltas[0::3])
+	ys = accumulate(deltas[1::3])
+	zs = accumulate(deltas[2::3])
+	coords = array('d', [val * precision for pos in zip(xs, ys, zs) for val in pos])
+	# TouchDesigner's Python 3.7 doesn't have 3-argument math.hypot() or accumulate(initial=)
+	segmentlengths = (
+		math.sqrt(dx * dx + dy * dy + dz * dz)
+		for dx, dy, dz in zip(deltas[3::3], deltas[4::3], deltas[5::3])
+	)
+	dists = array('d', [0.0]) + array('d', accumulate(segmentlengths))
+	totaldist = dists[-1]
+	if not totaldist:
+		return coords, array('d', [0.0] * len(dists)), array('d', [0.0] * len(dists))
+	reldists = array('d', [dist / totaldist for dist in dists])
+	if shapelength is None:
+		absdists = array('d', [dist * precision for dist in dists])
+	else:
+		absdists = array('d', [reldist * shapelength for reldist in reldists])
+	return coords, absdists, reldists
+
+class _ShapeColumn:
+	"""
+	Descriptor for a ShapeInfo attribute that is stored in a ShapeTable column.
+	"""
+	def __init__(self, column: str, nullable=False, default=None):
+		self.column = column
+		self.nullable = nullable
+		self.default = default
+
+	def __get__(self, shape: 'ShapeInfo', owner):
+		if shape is None:
+			return self
+		val = getattr(shape._table, self.column)[shape._row]
+		if self.nullable and val != val:
+			return None
+		return val
+
+	def __set__(self, shape: 'ShapeInfo', val):
+		if val is None:
+			val = _NaN if self.nullable else self.default
+		getattr(shape._table, self.column)[shape._row] = val
+
+class _ShapePointView:
+	"""
+	View of a point within a shape. Position values are copies, so changing them requires
+	assigning to `pos`.
+	"""
+	__slots__ = ['shape', 'index']
+
+	def __init__(self, shape: 'ShapeInfo', index: int):
+		self.shape = shape
+		self.index = index
+
+	@property
+	def _pointindex(self):
+		return self.shape._table.pointstarts[self.shape._row] + self.index
+
+	@property
+	def pos(self):
+		return self.shape._table.getPointPos(self._pointindex)
+
+	@pos.setter
+	def pos(self, pos: _XYZ):
+		self.shape._table.setPointPos(self._pointindex, pos)
+
+	@property
+	def absdist(self):
+		return self.shape._table.absdists[self._pointindex]
+
+	@absdist.setter
+	def absdist(self, val: float):
+		self.shape._table.absdists[self._pointindex] = val
+
+	@property
+	def reldist(self):
+		return self.shape._table.reldists[self._pointindex]
+
+	@reldist.setter
+	def reldist(self, val: float):
+		self.shape._table.reldists[self._pointindex] = val
+
+	def isEquivalentTo(self, other: 'PointData', tolerance=0.0):
+		return other is not None and _arePositionsInRange(self.pos, other.pos, tolerance)
+
+	def ToJsonDict(self):
+		return {'pos': self.pos, 'absdist': self.absdist, 'reldist': self.reldist}
+
+	def __repr__(self):
+		return 'PointData(pos={!r}, absdist={!r}, reldist={!r})'.format(self.pos, self.absdist, self.reldist)
+
+class _ShapePoints(Sequence):
+	"""
+	Sequence view of the points in a shape.
+	"""
+	__slots__ = ['shape']
+
+	def __init__(self, shape: 'ShapeInfo'):
+		self.shape = shape
+
+	def __len__(self):
+		return self.shape._table.pointcounts[self.shape._row]
+
+	def __getitem__(self, index):
+		n = len(self)
+		if isinstance(index, slice):
+			return [_ShapePointView(self.shape, i) for i in range(*index.indices(n))]
+		if index < 0:
+			index += n
+		if not 0 <= index < n:
+			raise IndexError('point index out of range')
+		return _ShapePointView(self.shape, index)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield _ShapePointView(self.shape, i)
+
+	def __repr__(self):
+		return repr(list(self))
+
+class ShapeInfo(BaseDataObject2):
+	"""
+	A closed shape within a pattern, which is a view of a row in a ShapeTable.
+
+	When a table isn't provided, the shape gets its own table, and is then moved into the
+	pattern's table when it is added to a PatternData.
+	Values like `center` and the positions of points are copies, so changes to them need to
+	be assigned back to the shape.
+	"""
+	__slots__ = ['_table', '_row']
+
+	def __init__(
+			self,
+			shapename: str = None,
+			shapepath: str = None,
+			parentpath: str = None,
+			shapelength: float = None,
+			points: List['PointData'] = None,
+			center: _XYZ = None,
+			shapeindex: int = 0,
+			color: _RGBAColor = None,
+			depthlayer: int = None,
+			dupcount: int = None,
+			radius: float = None,
+			rotateaxis: float = None,
+			table: ShapeTable = None):
+		self._table = None  # type: ShapeTable
+		self._row = 0
+		(table if table is not None else ShapeTable())._appendRow(self)
+		self.shapeindex = shapeindex
+		self.shapename = shapename
+		self.shapepath = shapepath
+		self.parentpath = parentpath
+		self.shapelength = shapelength
+		if points:
+			self.points = points
+		self.center = center
+		self.color = color
+		self.depthlayer = depthlayer
+		self.dupcount = dupcount or 0
+		self.radius = radius
+		self.rotateaxis = rotateaxis
+
+	shapeindex = _ShapeColumn('shapeindices', default=0)
+	shapename = _ShapeColumn('shapenames')
+	@property
+	def shapepath(self) -> Optional[str]:
+		return self._table.shapepaths[self._row]
+
+	@shapepath.setter
+	def shapepath(self, shapepath: Optional[str]):
+		self._table.shapepaths[self._row] = shapepath
+		self._table.shapepathparts[self._row] = None
+
+	@property
+	def shapepathparts(self) -> Tuple[str, ...]:
+		parts = self._table.shapepathparts[self._row]
+		if parts is None:
+			shapepath = self.shapepath
+			parts = tuple(shapepath.split('/')) if shapepath else ()
+			self._table.shapepathparts[self._row] = parts
+		return parts
+	parentpath = _ShapeColumn('parentpaths')
+	shapelength = _ShapeColumn('shapelengths', nullable=True)
+	depthlayer = _ShapeColumn('depthlayers')
+	dupcount = _ShapeColumn('dupcounts', default=0)
+	radius = _ShapeColumn('radiuses', nullable=True)
+	rotateaxis = _ShapeColumn('rotateaxes')
+
+	# views are compared by identity, not by their (shared) dataclass fields
+	__eq__ = object.__eq__
+	__hash__ = object.__hash__
+
+	@property
+	def table(self):
+		return self._table
+
+	@property
+	def points(self) -> _ShapePoints:
+		return _ShapePoints(self)
+
+	@points.setter
+	def points(self, points: Iterable['PointData']):
+		self._table._setPoints(self._row, list(points or []))
+
+	@property
+	def center(self) -> Optional[List[float]]:
+		return self._table.getCenter(self._row)
+
+	@center.setter
+	def center(self, center: Optional[_XYZ]):
+		self._table.setCenter(self._row, center)
+
+	@property
+	def color(self):
+		return self._table.colors[self._row]
+
+	@color.setter
+	def color(self, color: Optional[_RGBAColor]):
+		self._table.colors[self._row] = list(color) if color else None
+
+	@classmethod
+	def FromJsonDict(cls, obj, table: ShapeTable = None):
+		if 'pointdeltas' not in obj:
+			return shapeInfoSchema.fromJsonValue(obj, table=table)
+		shape = shapeInfoSchema.fromJsonValue(_leanJsonDictToFull(obj), table=table)
+		shape._table._setPointDeltas(shape._row, obj['pointdeltas'], obj['pointprecision'])
+		return shape
+
+	@classmethod
+	def FromJsonDicts(cls, objs: List[Dict]):
+		if not objs:
+			return []
+		table = ShapeTable()
+		return [cls.FromJsonDict(obj, table=table) for obj in objs]
+
+	def offsetPoints(self, offset: _XYZ):
+		self._table.offsetPoints(offset, rows=[self._row])
+
+	def scalePoints(self, scale: float):
+		self._table.scalePoints(scale, rows=[self._row])
+
+	def setPointDepths(self, z: float):
+		self._table.setPointDepths(self._row, z)
 
 	@property
 	def isduplicate(self):
@@ -97,70 +837,58 @@ class ShapeInfo(ShapeInfoBase):
 
 	@property
 	def hsvcolor(self):
-		if not self.color:
+		color = self.color
+		if not color:
 			return None
-		return rgb_to_hsv(self.color[0], self.color[1], self.color[2])
+		return rgb_to_hsv(color[0], color[1], color[2])
 
 	@property
 	def minbound(self):
-		if not self.points:
-			return None
-		return tdu.Vector(
-			min(p.pos[0] for p in self.points),
-			min(p.pos[1] for p in self.points),
-			min(p.pos[2] for p in self.points),
-		)
+		minbound, _ = self._table.bounds(rows=[self._row])
+		return tdu.Vector(minbound) if minbound else None
 
 	@property
 	def maxbound(self):
-		if not self.points:
-			return None
-		return tdu.Vector(
-			max(p.pos[0] for p in self.points),
-			max(p.pos[1] for p in self.points),
-			max(p.pos[2] for p in self.points),
-		)
+		_, maxbound = self._table.bounds(rows=[self._row])
+		return tdu.Vector(maxbound) if maxbound else None
 
 	@property
-	def _pointsWithoutOpenLoop(self) -> List['PointData']:
+	def _pointPositions(self) -> List[List[float]]:
+		table = self._table
+		start = table.pointstarts[self._row]
+		count = table.pointcounts[self._row]
+		coords = table.coords
+		return [list(coords[i * 3:i * 3 + 3]) for i in range(start, start + count)]
+
+	@property
+	def _pointPositionsWithoutOpenLoop(self) -> List[List[float]]:
+		positions = self._pointPositions
+		if _isOpenLoop(positions):
+			return positions[:-1]
+		return positions
+
+	@property
+	def _pointsWithoutOpenLoop(self) -> List['_ShapePointView']:
 		if self.isopenloop:
 			return self.points[:-1]
 		else:
-			return self.points
+			return self.points[:]
 
 	def calculateCenter(self):
-		self.center = averagePoints([p.pos for p in self._pointsWithoutOpenLoop])
+		self._table.calculateCenters(rows=[self._row])
 
 	def calculateTriangleCenter(self):
-		self.center = triangleCenter([p.pos for p in self._pointsWithoutOpenLoop])
+		self.center = triangleCenter(self._pointPositionsWithoutOpenLoop)
 
 	def calculateRadius(self):
-		center = tdu.Vector(self.center)
-		self.radius = max([
-			tdu.Vector(p.pos).distance(center)
-			for p in self.points
-		])
+		self._table.calculateRadiuses(rows=[self._row])
 
 	def isEquivalentTo(self, other: 'ShapeInfo', tolerance=0.0):
 		if other is None:
 			return False
-		ownpts = self._pointsWithoutOpenLoop
-		otherpts = other._pointsWithoutOpenLoop
-		n = len(ownpts)
-		if n != len(otherpts):
+		if self.pointcountWithoutOpenLoop != other.pointcountWithoutOpenLoop:
 			return False
-
-		# firstindex = _firstIndexWhere(otherpts, lambda p: p.isEquivalentTo(ownpts[0]))
-		# if firstindex == -1:
-		# 	return False
-		# otherpts = deque(otherpts)
-		# otherpts.rotate(firstindex)
-		# for i, ownpt in enumerate(ownpts):
-		# 	otherpt = otherpts[i]
-		# 	if not otherpt.isEquivalentTo(ownpts[0], tolerance):
-		# 		return False
-		# return True
-		centerdist = tdu.Vector(self.center).distance(tdu.Vector(other.center))
+		centerdist = _distance(self.center, other.center)
 		if centerdist > tolerance:
 			return False
 		raddiff = abs(self.radius - other.radius)
@@ -168,72 +896,258 @@ class ShapeInfo(ShapeInfoBase):
 			return False
 		return True
 
+	@property
+	def pointcountWithoutOpenLoop(self):
+		n = len(self.points)
+		return n - 1 if self.isopenloop else n
+
 	def containsPoint(self, testpoint: 'PointData'):
-		return _shapeContainsPoint(self._pointsWithoutOpenLoop, testpoint)
+		pos = testpoint.pos
+		return self._table.containsPoint(self._row, pos[0], pos[1])
 
 	@property
 	def isopenloop(self):
-		if len(self.points) < 4:
-			return False
-		return self.points[0].pos == self.points[-1].pos
+		return self._table.isOpenLoop(self._row)
 
 	@property
 	def istriangle(self):
-		if len(self.points) == 3 and not self.isopenloop:
+		n = len(self.points)
+		if n == 3 and not self.isopenloop:
 			return True
-		if len(self.points) == 4 and self.isopenloop:
+		if n == 4 and self.isopenloop:
 			return True
 		return False
 
-	def ToJsonDict(self):
-		return cleandict(
-			{
-				'shapeindex': self.shapeindex,
-				'shapename': self.shapename,
-				'shapepath': self.shapepath,
-				'parentpath': self.parentpath,
-				'color': self.color,
-				'center': self.center,
-				'shapelength': self.shapelength,
-				'depthlayer': self.depthlayer or None,
-				'dupcount': self.dupcount or None,
-				'radius': self.radius or None,
-				'rotateaxis': self.rotateaxis or None,
-				'points': PointData.ToJsonDicts(self.points),
-			})
+	def ToJsonDict(self, pointprecision: float = None):
+		return self._table.rowToJsonDict(self._row, pointprecision=pointprecision)
 
-def _shapeContainsPoint(shapepoints: List['PointData'], testpoint: 'PointData'):
-	testx, testy = testpoint.pos[0], testpoint.pos[1]
-	nshapepoints = len(shapepoints)
-	inside = False
-	p1x, p1y = shapepoints[0].pos[0], shapepoints[0].pos[1]
-	for i in range(nshapepoints + 1):
-		shapepoint = shapepoints[i % nshapepoints]
-		p2x, p2y = shapepoint.pos[0], shapepoint.pos[1]
-		if testy > min(p1y, p2y):
-			if testy <= max(p1y, p2y):
-				if testx <= max(p1x, p2x):
-					if p1y != p2y:
-						xints = (testy - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+	def __repr__(self):
+		return 'ShapeInfo(shapeindex={!r}, shapename={!r}, shapepath={!r}, center={!r}, points={})'.format(
+			self.shapeindex, self.shapename, self.shapepath, self.center, len(self.points))
+
+class ShapeBoundsGrid:
+	"""
+	Grid of shapes by their 2D bounding boxes, used to find the shapes that might contain a
+	point without testing every shape.
+	"""
+	# shapes covering more cells than this are checked for every point instead
+	_MaxCellsPerShape = 256
+
+	def __init__(self, shapes: List['ShapeInfo']):
+		self.shapes = shapes
+		# minx, miny, maxx, maxy for each shape
+		self.bounds = []  # type: List[Tuple[float, float, float, float]]
+		for shape in shapes:
+			table = shape.table
+			start = table.pointstarts[shape._row] * 3
+			end = start + table.pointcounts[shape._row] * 3
+			if start == end:
+				self.bounds.append(None)
+				continue
+			xs = table.coords[start:end:3]
+			ys = table.coords[start + 1:end:3]
+			minx, miny, maxx, maxy = min(xs), min(ys), max(xs), max(ys)
+			# points just to the left of a shape can still be counted as inside due to
+			# rounding in the edge intersections, so those are kept as candidates
+			minx -= 1e-9 * (abs(minx) + abs(maxx) + 1)
+			self.bounds.append((minx, miny, maxx, maxy))
+		sizes = [
+			max(b[2] - b[0], b[3] - b[1])
+			for b in self.bounds
+			if b is not None
+		]
+		self.cellsize = (sum(sizes) / len(sizes)) if sizes else 0.0
+		if not self.cellsize:
+			self.cellsize = 1.0
+		self.cells = {}  # type: Dict[Tuple[int, int], List[int]]
+		self.oversized = []  # type: List[int]
+		for i, b in enumerate(self.bounds):
+			if b is None:
+				continue
+			x1, y1 = self._cellCoords(b[0], b[1])
+			x2, y2 = self._cellCoords(b[2], b[3])
+			if (x2 - x1 + 1) * (y2 - y1 + 1) > self._MaxCellsPerShape:
+				self.oversized.append(i)
+				continue
+			for cx in range(x1, x2 + 1):
+				for cy in range(y1, y2 + 1):
+					cell = self.cells.get((cx, cy))
+					if cell is None:
+						self.cells[(cx, cy)] = [i]
 					else:
-						xints = -99999999
-					if p1x == p2x or testx <= xints:
-						inside = not inside
-		p1x, p1y = p2x, p2y
-	return inside
+						cell.append(i)
+
+	def _cellCoords(self, x: float, y: float):
+		return math.floor(x / self.cellsize), math.floor(y / self.cellsize)
+
+	def candidatePositions(self, x: float, y: float) -> List[int]:
+		"""
+		Gets the positions (in the original list), in order, of the shapes whose bounds allow
+		them to contain the point. Points on the bottom edge of a shape's bounds are never
+		inside it, matching the even-odd test.
+		"""
+		cell = self.cells.get(self._cellCoords(x, y), [])
+		if self.oversized:
+			cell = sorted(cell + self.oversized)
+		results = []
+		for i in cell:
+			minx, miny, maxx, maxy = self.bounds[i]
+			if minx <= x <= maxx and miny < y <= maxy:
+				results.append(i)
+		return results
+
+class _PathTrieNode:
+	__slots__ = ['path', 'children', 'shapepositions']
+
+	def __init__(self, path: str):
+		self.path = path
+		self.children = {}  # type: Dict[str, _PathTrieNode]
+		# positions of the shapes whose path ends at this node
+		self.shapepositions = []  # type: List[int]
+
+	def allShapePositions(self, results: List[int]):
+		results += self.shapepositions
+		for child in self.children.values():
+			child.allShapePositions(results)
+
+class ShapePathTrie:
+	"""
+	Trie of shapes by the segments of their paths, used to find the shapes with paths that
+	match a regex pattern (using re.match) without testing every shape.
+
+	Patterns are tested against the path of each node. When a pattern can't depend on what
+	follows the part of the path that it matched, a match for a node covers all the shapes
+	below it. Literal prefixes of patterns are used to skip branches that can't match.
+	"""
+	def __init__(self, shapes: List['ShapeInfo']):
+		self.root = _PathTrieNode('')
+		for i, shape in enumerate(shapes):
+			node = self.root
+			for part in shape.shapepathparts:
+				child = node.children.get(part)
+				if child is None:
+					child = node.children[part] = _PathTrieNode(
+						node.path + '/' + part if node is not self.root else part)
+				node = child
+			node.shapepositions.append(i)
+
+	def findMatches(self, pattern: str) -> List[int]:
+		"""
+		Gets the positions (in the list the trie was built from), in order, of the shapes
+		with paths that `re.match` the pattern.
+		"""
+		matcher = _PathPatternMatcher.Get(pattern)
+		results = []
+		if matcher.regex.match(''):
+			# an empty match matches everything, including shapes without paths
+			self.root.allShapePositions(results)
+		else:
+			for child in self.root.children.values():
+				self._findMatches(child, matcher, results)
+		results.sort()
+		return results
+
+	def _findMatches(self, node: _PathTrieNode, matcher: '_PathPatternMatcher', results: List[int]):
+		prefix = matcher.literalprefix
+		if prefix:
+			if node.path.startswith(prefix):
+				if matcher.isliteral:
+					node.allShapePositions(results)
+					return
+			elif not prefix.startswith(node.path):
+				return
+		if matcher.regex.match(node.path):
+			if matcher.prefixsafe:
+				node.allShapePositions(results)
+				return
+			results += node.shapepositions
+		for child in node.children.values():
+			self._findMatches(child, matcher, results)
+
+class _PathPatternMatcher:
+	_cache = {}  # type: Dict[str, _PathPatternMatcher]
+
+	# constructs whose result can depend on what follows the matched text
+	_lookaheadPattern = re.compile(r'\\[ZbB]|\(\?[=!]|\$')
+
+	def __init__(self, pattern: str):
+		self.regex = re.compile(pattern)
+		self.literalprefix, self.isliteral = _literalPatternPrefix(pattern)
+		self.prefixsafe = not self._lookaheadPattern.search(pattern)
+
+	@classmethod
+	def Get(cls, pattern: str) -> '_PathPatternMatcher':
+		matcher = cls._cache.get(pattern)
+		if matcher is None:
+			matcher = cls._cache[pattern] = cls(pattern)
+		return matcher
+
+def _literalPatternPrefix(pattern: str) -> Tuple[str, bool]:
+	"""
+	Gets the literal text that every match of a pattern has to start with, and whether the
+	pattern is nothing but that literal text.
+	"""
+	if '|' in pattern:
+		return '', False
+	i = 1 if pattern.startswith('^') else 0
+	chars = []
+	while i < len(pattern):
+		char = pattern[i]
+		if char == '\\':
+			if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+				break
+			literal = pattern[i + 1]
+			nexti = i + 2
+		elif char in '.^$*+?{}[]()':
+			break
+		else:
+			literal = char
+			nexti = i + 1
+		if nexti < len(pattern) and pattern[nexti] in '*?{':
+			# the character is optional or repeated
+			break
+		chars.append(literal)
+		i = nexti
+	return ''.join(chars), i == len(pattern)
+
+def _isOpenLoop(positions: List[List[float]]):
+	return len(positions) >= 4 and positions[0] == positions[-1]
+
+def _distance(pos1: _XYZ, pos2: _XYZ):
+	return math.sqrt(
+		(pos1[0] - pos2[0]) ** 2 +
+		(pos1[1] - pos2[1]) ** 2 +
+		(pos1[2] - pos2[2]) ** 2)
 
 @dataclass
 class PathInfo(ShapeInfoBase):
 
-	def ToJsonDict(self):
+	def ToJsonDict(self, pointprecision: float = None):
+		parentpath = self.parentpath
+		shapelength = self.shapelength
+		center = self.center
+		pointdeltas = None
+		if pointprecision:
+			pointdeltas = _encodePointDeltas([
+				val
+				for point in self.points
+				for val in (point.pos[0], point.pos[1], point.pos[2] if len(point.pos) > 2 else 0.0)
+			], pointprecision)
+			if pointdeltas and parentpath == _parentPathOf(self.shapepath):
+				parentpath = None
+			shapelength = _roundToPrecision(shapelength, pointprecision)
+			if center is not None:
+				center = [_roundToPrecision(val, pointprecision) for val in center]
 		return cleandict(
 			{
 				'shapename': self.shapename,
 				'shapepath': self.shapepath,
-				'parentpath': self.parentpath,
-				'shapelength': self.shapelength,
-				'center': self.center,
-				'points': PointData.ToJsonDicts(self.points),
+				'parentpath': parentpath,
+				'shapelength': shapelength,
+				'center': center,
+				'points': None if pointprecision else PointData.ToJsonDicts(self.points),
+				'pointdeltas': pointdeltas,
+				'pointprecision': pointprecision if pointdeltas else None,
 			})
 
 @dataclass
@@ -242,9 +1156,39 @@ class PointData(BaseDataObject2):
 	absdist: float = 0
 	reldist: float = 0
 
+	def ToJsonDict(self):
+		return pointDataSchema.toJsonValue(self)
+
+	@classmethod
+	def FromJsonDict(cls, obj):
+		return pointDataSchema.fromJsonValue(obj)
+
 	def isEquivalentTo(self, other: 'PointData', tolerance=0.0):
 		return other is not None and _arePositionsInRange(self.pos, other.pos, tolerance)
 
+pointDataSchema = ObjectSchema(
+	PointData,
+	AttrSchema('pos', customHandler(list, name='Pos', toJson=list)),
+	AttrSchema('absdist', jsonHandler),
+	AttrSchema('reldist', jsonHandler),
+).compile()
+
+shapeInfoSchema = ObjectSchema(
+	ShapeInfo,
+	AttrSchema('shapeindex', jsonHandler),
+	AttrSchema('shapename', jsonHandler),
+	AttrSchema('shapepath', jsonHandler),
+	AttrSchema('parentpath', jsonHandler),
+	AttrSchema('color', jsonHandler),
+	AttrSchema('center', jsonHandler),
+	AttrSchema('shapelength', jsonHandler),
+	AttrSchema('depthlayer', jsonHandler, omitfalsy=True),
+	AttrSchema('dupcount', jsonHandler, omitfalsy=True),
+	AttrSchema('radius', jsonHandler, omitfalsy=True),
+	AttrSchema('rotateaxis', jsonHandler, omitfalsy=True),
+	AttrSchema('points', ListTypeHandler(pointDataSchema)),
+).compile()
+
 def _arePositionsInRange(pos1, pos2, tolerance=0.0):
 	if pos1 is None or pos2 is None:
 		return False
@@ -256,6 +1200,115 @@ def _firstIndexWhere(items, test):
 			return i
 	return -1
 
+class ShapeIndexSet(AbstractSet):
+	"""
+	Immutable set of shape indices stored as a bitset, with fast boolean combination.
+	"""
+	__slots__ = ['bits']
+
+	def __init__(self, shapeindices: Iterable[int] = None):
+		if shapeindices is None:
+			self.bits = 0
+		elif isinstance(shapeindices, ShapeIndexSet):
+			self.bits = shapeindices.bits
+		else:
+			self.bits = _indicesToBits(shapeindices)
+
+	@classmethod
+	def FromBits(cls, bits: int):
+		indexset = cls()
+		indexset.bits = bits
+		return indexset
+
+	@classmethod
+	def Combine(cls, indexsets: List['ShapeIndexSet'], boolop: str):
+		"""
+		Combines sets using a BoolOpNames operator, producing an empty set for unsupported
+		operators.
+		"""
+		if not indexsets:
+			return cls()
+		bits = indexsets[0].bits
+		if boolop == BoolOpNames.AND:
+			for indexset in indexsets[1:]:
+				bits &= indexset.bits
+		elif boolop == BoolOpNames.OR:
+			for indexset in indexsets[1:]:
+				bits |= indexset.bits
+		else:
+			return cls()
+		return cls.FromBits(bits)
+
+	def __contains__(self, shapeindex):
+		return isinstance(shapeindex, int) and shapeindex >= 0 and bool((self.bits >> shapeindex) & 1)
+
+	def __iter__(self):
+		# the binary string is reversed so that string positions are shape indices
+		binstr = bin(self.bits)[:1:-1]
+		i = binstr.find('1')
+		while i != -1:
+			yield i
+			i = binstr.find('1', i + 1)
+
+	def __len__(self):
+		return bin(self.bits).count('1')
+
+	def __bool__(self):
+		return self.bits != 0
+
+	def __eq__(self, other):
+		if isinstance(other, ShapeIndexSet):
+			return self.bits == other.bits
+		return AbstractSet.__eq__(self, other)
+
+	def __hash__(self):
+		return hash(self.bits)
+
+	def __and__(self, other):
+		if isinstance(other, ShapeIndexSet):
+			return ShapeIndexSet.FromBits(self.bits & other.bits)
+		return AbstractSet.__and__(self, other)
+
+	def __or__(self, other):
+		if isinstance(other, ShapeIndexSet):
+			return ShapeIndexSet.FromBits(self.bits | other.bits)
+		return AbstractSet.__or__(self, other)
+
+	def __sub__(self, other):
+		if isinstance(other, ShapeIndexSet):
+			return ShapeIndexSet.FromBits(self.bits & ~other.bits)
+		return AbstractSet.__sub__(self, other)
+
+	def __xor__(self, other):
+		if isinstance(other, ShapeIndexSet):
+			return ShapeIndexSet.FromBits(self.bits ^ other.bits)
+		return AbstractSet.__xor__(self, other)
+
+	def complement(self, shapecount: int):
+		"""
+		Gets the indices from 0 to `shapecount` that aren't in this set.
+		"""
+		return ShapeIndexSet.FromBits(((1 << shapecount) - 1) & ~self.bits)
+
+	def toList(self) -> List[int]:
+		return list(self)
+
+	def __repr__(self):
+		return 'ShapeIndexSet({})'.format(formatIndexList(self.toList()))
+
+def _indicesToBits(shapeindices: Iterable[int]):
+	shapeindices = list(shapeindices)
+	if not shapeindices:
+		return 0
+	buf = bytearray((max(shapeindices) >> 3) + 1)
+	for shapeindex in shapeindices:
+		buf[shapeindex >> 3] |= 1 << (shapeindex & 7)
+	return int.from_bytes(buf, 'little')
+
+def _sortedContains(sortedvals: List[int], val: int):
+	i = bisect_left(sortedvals, val)
+	return i < len(sortedvals) and sortedvals[i] == val
+
 @dataclass
 class SequenceStep(BaseDataObject2):
 	sequenceindex: int = 0
@@ -267,19 +1320,29 @@ class SequenceStep(BaseDataObject2):
 		self.shapeindices = list(self.shapeindices or [])
 		self.shapeindices.sort()
 
+	@property
+	def shapeIndexSet(self):
+		return ShapeIndexSet(self.shapeindices)
+
 	def ToJsonDict(self):
-		return cleandict({
-			'sequenceindex': self.sequenceindex,
-			'shapeindices': formatValueList(self.shapeindices),
-			'isdefault': self.isdefault or None,
-			'inferredfromvalue': formatValue(self.inferredfromvalue, nonevalue=None),
-		})
+		return sequenceStepSchema.toJsonValue(self)
 
 	@classmethod
 	def FromJsonDict(cls, obj):
-		return cls(
-			shapeindices=parseValueList(obj.get('shapeindices')),
-			**excludekeys(obj, ['shapeindices']))
+		return sequenceStepSchema.fromJsonValue(obj)
+
+_shapeIndicesHandler = customHandler(
+	list, name='ShapeIndices', fromJson=parseIndexList, toJson=formatIndexList)
+_inferredValueHandler = customHandler(
+	object, name='InferredValue', toJson=lambda val: formatValue(val, nonevalue=None))
+
+sequenceStepSchema = ObjectSchema(
+	SequenceStep,
+	AttrSchema('sequenceindex', jsonHandler),
+	AttrSchema('shapeindices', _shapeIndicesHandler),
+	AttrSchema('isdefault', jsonHandler, omitfalsy=True),
+	AttrSchema('inferredfromvalue', _inferredValueHandler),
+).compile()
 
 @dataclass
 class GroupInfo(BaseDataObject2):
@@ -300,25 +1363,11 @@ class GroupInfo(BaseDataObject2):
 		self.sequencesteps = list(self.sequencesteps or [])
 
 	def ToJsonDict(self):
-		return cleandict({
-			'groupname': self.groupname,
-			'grouppath': self.grouppath,
-			'inferencetype': self.inferencetype or None,
-			'inferredfromvalue': formatValue(self.inferredfromvalue, nonevalue=None),
-			'depthlayer': self.depthlayer or None,
-			'depth': self.depth or None,
-			'shapeindices': formatValueList(self.shapeindices),
-			'sequencesteps': SequenceStep.ToJsonDicts(self.sequencesteps),
-			'temporary': self.temporary or None,
-			'rotateaxis': self.rotateaxis or None,
-		})
+		return groupInfoSchema.toJsonValue(self)
 
 	@classmethod
 	def FromJsonDict(cls, obj):
-		return cls(
-			sequencesteps=SequenceStep.FromJsonDicts(obj.get('sequencesteps')),
-			shapeindices=parseValueList(obj.get('shapeindices')),
-			**excludekeys(obj, ['sequencesteps', 'shapeindices']))
+		return groupInfoSchema.fromJsonValue(obj)
 
 	@property
 	def issequenced(self):
@@ -328,28 +1377,48 @@ class GroupInfo(BaseDataObject2):
 			return True
 		return not self.sequencesteps[0].isdefault
 
+	# shape index lists are kept sorted, so membership checks can use binary search
+
 	def shapeSequenceIndex(self, shapeindex: int):
 		for step in self.sequencesteps:
-			if shapeindex in step.shapeindices:
+			if _sortedContains(step.shapeindices, shapeindex):
 				return step.sequenceindex
-		if shapeindex in self.shapeindices:
+		if _sortedContains(self.shapeindices, shapeindex):
 			return 0
 		return -1
 
 	def containsShape(self, shapeindex: int):
-		if shapeindex in self.shapeindices:
+		if _sortedContains(self.shapeindices, shapeindex):
 			return True
 		for step in self.sequencesteps:
-			if shapeindex in step.shapeindices:
+			if _sortedContains(step.shapeindices, shapeindex):
 				return True
 		return False
 
 	@property
-	def allShapeIndices(self) -> Set[int]:
-		allindices = set(self.shapeindices)
+	def shapeIndexSet(self):
+		return ShapeIndexSet(self.shapeindices)
+
+	@property
+	def allShapeIndices(self) -> ShapeIndexSet:
+		bits = _indicesToBits(self.shapeindices)
 		for step in self.sequencesteps:
-			allindices.update(step.shapeindices)
-		return allindices
+			bits |= _indicesToBits(step.shapeindices)
+		return ShapeIndexSet.FromBits(bits)
+
+groupInfoSchema = ObjectSchema(
+	GroupInfo,
+	AttrSchema('groupname', jsonHandler),
+	AttrSchema('grouppath', jsonHandler),
+	AttrSchema('inferencetype', jsonHandler, omitfalsy=True),
+	AttrSchema('inferredfromvalue', _inferredValueHandler),
+	AttrSchema('depthlayer', jsonHandler, omitfalsy=True),
+	AttrSchema('depth', jsonHandler, omitfalsy=True),
+	AttrSchema('shapeindices', _shapeIndicesHandler),
+	AttrSchema('sequencesteps', ListTypeHandler(sequenceStepSchema)),
+	AttrSchema('temporary', jsonHandler, omitfalsy=True),
+	AttrSchema('rotateaxis', jsonHandler, omitfalsy=True),
+).compile()
 
 class BoolOpNames:
 	OR = 'or'
@@ -1319,10 +2388,22 @@ class PatternData(BaseDataObject):
 			scale: float=None,
 			**attrs):
 		super().__init__(**attrs)
-		self.shapes = list(shapes or [])  # type: List[ShapeInfo]
+		self.shapetable = ShapeTable()
+		self._shapepathtrie = None  # type: Optional[ShapePathTrie]
+		self.shapesbyindex = {}  # type: Dict[int, ShapeInfo]
+		self.shapesbyname = {}  # type: Dict[str, ShapeInfo]
+		self.shapesbypath = {}  # type: Dict[str, ShapeInfo]
+		# attribute values by table row, keyed by (attribute, rounddigits)
+		self._shapeattributekeys = {}  # type: Dict[Tuple[str, Optional[int]], List[Any]]
+		if shapes:
+			self.addShapes(shapes)
 		self.paths = list(paths or [])  # type: List[PathInfo]
 		self.groups = []  # type: List[GroupInfo]
 		self.groupsbyname = {}  # type: Dict[str, GroupInfo]
+		# incremented whenever the set of group names changes
+		self.groupgeneration = 0
+		self._groupnamematches = {}  # type: Dict[str, List[str]]
+		self._groupnamematchesgeneration = 0
 		if groups:
 			for group in groups:
 				self.addGroup(group)
@@ -1332,8 +2413,73 @@ class PatternData(BaseDataObject):
 		self.svgheight = svgheight
 		self.scale = scale
 
+	@property
+	def shapes(self) -> List[ShapeInfo]:
+		return self.shapetable.views
+
+	@shapes.setter
+	def shapes(self, shapes: Iterable[ShapeInfo]):
+		shapes = list(shapes or [])
+		if all(shape.table is self.shapetable for shape in shapes):
+			self.shapetable = self.shapetable.selectRows([shape._row for shape in shapes])
+		else:
+			self.shapetable = ShapeTable()
+			self.shapetable.addShapes(shapes)
+		self.reindexShapes()
+
 	def addShapes(self, shapes: Iterable[ShapeInfo]):
-		self.shapes += shapes
+		shapes = list(shapes)
+		if not shapes:
+			return
+		table = shapes[0].table
+		if not self.shapetable and table is not self.shapetable and table.views == shapes:
+			# the shapes are exactly the rows of their table, so use it as is
+			self.shapetable = table
+		else:
+			self.shapetable.addShapes(shapes)
+		self._indexShapes(shapes)
+
+	def reindexShapes(self):
+		"""
+		Rebuilds the shape lookup indexes. This is needed after changing the indices, names
+		or paths of shapes without assigning `shapes`.
+		"""
+		self.shapesbyindex.clear()
+		self.shapesbyname.clear()
+		self.shapesbypath.clear()
+		self._indexShapes(self.shapes)
+
+	@property
+	def shapePathTrie(self) -> 'ShapePathTrie':
+		if self._shapepathtrie is None:
+			self._shapepathtrie = ShapePathTrie(self.shapes)
+		return self._shapepathtrie
+
+	def _indexShapes(self, shapes: Iterable[ShapeInfo]):
+		self._shapepathtrie = None
+		self._shapeattributekeys.clear()
+		# the first shape wins for any duplicate keys, like the earlier linear lookups
+		for shape in shapes:
+			self.shapesbyindex.setdefault(shape.shapeindex, shape)
+			if shape.shapename:
+				self.shapesbyname.setdefault(shape.shapename, shape)
+			if shape.shapepath:
+				self.shapesbypath.setdefault(shape.shapepath, shape)
+
+	def getShapeAttributeKeys(self, part: str, rounddigits: int=None) -> List[Any]:
+		"""
+		Gets the (optionally rounded) values of one of the SequenceByTypes attributes for each
+		row of the shape table, with None for shapes that don't have a value.
+		These are computed once, and kept until the shapes are changed.
+		"""
+		cachekey = part, rounddigits
+		keys = self._shapeattributekeys.get(cachekey)
+		if keys is None:
+			keys = self.shapetable.attributeValues(part)
+			if rounddigits is not None:
+				keys = [None if val is None else round(val, rounddigits) for val in keys]
+			self._shapeattributekeys[cachekey] = keys
+		return keys
 
 	def addPaths(self, paths: Iterable[PathInfo]):
 		self.paths += paths
@@ -1342,6 +2488,7 @@ class PatternData(BaseDataObject):
 		self.groups.append(group)
 		if group.groupname not in self.groupsbyname:
 			self.groupsbyname[group.groupname] = group
+			self.groupgeneration += 1
 
 	def addGroups(self, groups: List[GroupInfo]):
 		for group in groups:
@@ -1351,47 +2498,55 @@ class PatternData(BaseDataObject):
 		return self.groupsbyname.get(groupname)
 
 	def getGroupNamesByPatterns(self, groupnamepatterns: Iterable[str]) -> List[str]:
-		matchingnames = []
-		allgroupnames = list(self.groupsbyname.keys())
+		# dicts keep insertion order, so this works as an ordered set
+		matchingnames = {}
 		for pattern in groupnamepatterns:
-			for name in mod.tdu.match(pattern, allgroupnames):
-				if name not in matchingnames:
-					matchingnames.append(name)
-		return matchingnames
+			matchingnames.update(dict.fromkeys(self._getGroupNamesByPattern(pattern)))
+		return list(matchingnames)
+
+	def _getGroupNamesByPattern(self, pattern: str) -> List[str]:
+		if self._groupnamematchesgeneration != self.groupgeneration:
+			self._groupnamematches.clear()
+			self._groupnamematchesgeneration = self.groupgeneration
+		names = self._groupnamematches.get(pattern)
+		if names is None:
+			names = self._groupnamematches[pattern] = mod.tdu.match(pattern, list(self.groupsbyname.keys()))
+		return names
 
 	def getGroupsByPatterns(self, groupnamepatterns: Iterable[str]) -> List[GroupInfo]:
 		names = self.getGroupNamesByPatterns(groupnamepatterns)
 		return [self.groupsbyname[name] for name in names]
 
-	def getShapeIndicesByGroupPattern(self, groupnamepatterns: Iterable[str]) -> Set[int]:
-		shapeindices = set()
+	def getShapeIndicesByGroupPattern(self, groupnamepatterns: Iterable[str]) -> ShapeIndexSet:
+		bits = 0
 		groups = self.getGroupsByPatterns(groupnamepatterns)
 		for group in groups:
-			shapeindices.update(group.allShapeIndices)
-		return shapeindices
+			bits |= group.allShapeIndices.bits
+		return ShapeIndexSet.FromBits(bits)
 
 	def getShapesByIndices(self, shapeindices: Iterable[int]) -> List[ShapeInfo]:
 		if not shapeindices:
 			return []
-		shapeindices = set(shapeindices)
-		return [
-			shape
-			for shape in self.shapes
-			if shape.shapeindex in shapeindices
-		]
+		shapes = []
+		for shapeindex in set(shapeindices):
+			shape = self.shapesbyindex.get(shapeindex)
+			if shape is not None:
+				shapes.append(shape)
+		shapes.sort(key=lambda s: s._row)
+		return shapes
 
 	def getShapeByIndex(self, shapeindex: int):
-		for shape in self.shapes:
-			if shape.shapeindex == shapeindex:
-				return shape
+		return self.shapesbyindex.get(shapeindex)
 
 	def getShapeByName(self, shapename: str):
 		if not shapename:
 			return None
-		for shape in self.shapes:
-			if shape.shapename == shapename:
-				return shape
-		return None
+		return self.shapesbyname.get(shapename)
+
+	def getShapeByPath(self, shapepath: str):
+		if not shapepath:
+			return None
+		return self.shapesbypath.get(shapepath)
 
 	def removeTemporaryGroups(self):
 		toremove = [group for group in self.groups if group.temporary]
@@ -1399,16 +2554,30 @@ class PatternData(BaseDataObject):
 			self.groups.remove(group)
 			if group.groupname and group.groupname in self.groupsbyname:
 				del self.groupsbyname[group.groupname]
+				self.groupgeneration += 1
 
 	def __repr__(self):
 		return 'PatternData({} shapes, {} groups)'.format(len(self.shapes), len(self.groups))
 
-	def ToJsonDict(self):
+	def Clone(self):
+		# the shapes are views bound to the shape table and its indexes, so they can't be
+		# copied attribute by attribute
+		return PatternData.FromJsonDict(self.ToJsonDict())
+
+	def ToJsonDict(self, pointprecision: float = None):
+		"""
+		Converts the pattern to a JSON dict. When `pointprecision` is provided, the points of
+		shapes and paths are written in the lean form, quantized to that precision.
+		"""
 		return cleandict(mergedicts(self.attrs, {
-			'shapes': ShapeInfo.ToJsonDicts(
-				sorted(self.shapes, key=lambda s: s.shapeindex)),
-			'paths': PathInfo.ToJsonDicts(
-				sorted(self.paths, key=lambda p: p.shapepath)),
+			'shapes': [
+				shape.ToJsonDict(pointprecision=pointprecision)
+				for shape in sorted(self.shapes, key=lambda s: s.shapeindex)
+			],
+			'paths': [
+				path.ToJsonDict(pointprecision=pointprecision)
+				for path in sorted(self.paths, key=lambda p: p.shapepath)
+			],
 			'groups': GroupInfo.ToJsonDicts(
 				sorted(self.groups, key=lambda g: g.groupname)),
 			'title': self.title,
@@ -1418,6 +2587,62 @@ class PatternData(BaseDataObject):
 			'scale': formatValue(self.scale, nonevalue=None),
 		}))
 
+	def writeJson(self, outfile: TextIO, indent: str=None, pointprecision: float = None):
+		"""
+		Writes the same JSON as
+		`json.dumps(self.ToJsonDict(pointprecision=pointprecision), indent=indent, sort_keys=True)`,
+		but converts and writes the shapes, paths and groups one at a time instead of building
+		the whole tree first.
+		"""
+		obj = PatternData(
+			settings=self.settings,
+			title=self.title,
+			svgwidth=self.svgwidth,
+			svgheight=self.svgheight,
+			scale=self.scale,
+			**self.attrs).ToJsonDict() or {}
+		itemlists = {
+			'shapes': sorted(self.shapes, key=lambda s: s.shapeindex),
+			'paths': sorted(self.paths, key=lambda p: p.shapepath),
+			'groups': sorted(self.groups, key=lambda g: g.groupname),
+		}
+		for key, items in itemlists.items():
+			if items:
+				obj[key] = items
+		if not obj:
+			outfile.write('{}')
+			return
+		itemseparator = ', ' if indent is None else ','
+		encoder = json.JSONEncoder(indent=indent, sort_keys=True)
+
+		def newline(depth):
+			return '' if indent is None else '\n' + indent * depth
+
+		def dump(val, depth):
+			# strings in the output can't contain raw newlines, so this only indents lines
+			text = encoder.encode(val)
+			return text if indent is None else text.replace('\n', newline(depth))
+
+		outfile.write('{')
+		for i, key in enumerate(sorted(obj.keys())):
+			if i:
+				outfile.write(itemseparator)
+			outfile.write(newline(1) + encoder.encode(key) + ': ')
+			if key not in itemlists:
+				outfile.write(dump(obj[key], 1))
+				continue
+			outfile.write('[')
+			for j, item in enumerate(obj[key]):
+				if j:
+					outfile.write(itemseparator)
+				if key == 'groups':
+					itemobj = item.ToJsonDict()
+				else:
+					itemobj = item.ToJsonDict(pointprecision=pointprecision)
+				outfile.write(newline(2) + dump(itemobj, 2))
+			outfile.write(newline(1) + ']')
+		outfile.write(newline(0) + '}')
+
 	@classmethod
 	def FromJsonDict(cls, obj):
 		return cls(
@@ -1,5 +1,5 @@
 import inspect
-from typing import Union, Dict, TypeVar, Callable, List, Iterable
+from typing import Any, Union, Dict, TypeVar, Callable, List, Iterable
 
 _JsonValue = Union[str, float, int, bool, None, Dict[str, '_JsonValue'], List['_JsonValue']]
 _ValT = TypeVar('_ValT')
@@ -74,6 +74,8 @@ class _CustomTypeHandler(TypeHandler):
 			toJson: Callable[[_ValT], _JsonValue] = _identity,
 			toJsonStr: Callable[[_ValT], str]=str):
 		super().__init__(t, name)
+		self.fromJsonFunc = fromJson
+		self.toJsonFunc = toJson
 		self._fromJson = _optionalKwArgs(fromJson)
 		self._toJson = _optionalKwArgs(toJson)
 		self._toJsonStr = toJsonStr
@@ -88,6 +90,20 @@ class _CustomTypeHandler(TypeHandler):
 		return self._toJsonStr(obj)
 
 
+def customHandler(
+		t: type,
+		name: str = None,
+		fromJson: Callable[[_JsonValue], _ValT] = _identity,
+		toJson: Callable[[_ValT], _JsonValue] = _identity) -> TypeHandler:
+	return _CustomTypeHandler(t, name=name, fromJson=fromJson, toJson=toJson)
+
+class _PassthroughTypeHandler(TypeHandler):
+	"""
+	Handler for values that are stored in JSON as they are, without any conversion.
+	"""
+	def fromJsonValue(self, val: _JsonValue, opts: JsonOpts=None) -> _ValT:
+		return val
+
 class ListTypeHandler(TypeHandler):
 	def __init__(self, handler: TypeHandler):
 		super().__init__(handler.type, name='List({})'.format(handler.name))
@@ -102,9 +118,9 @@ class ListTypeHandler(TypeHandler):
 		]
 
 	def toJsonValue(self, obj: _ValT, opts: JsonOpts=None):
-		if opts.condense:
+		if opts and opts.condense:
 			raise NotImplementedError()
-		if opts.flat:
+		if opts and opts.flat:
 			raise NotImplementedError()
 		return [
 			self.elementHandler.toJsonValue(o, opts=opts)
@@ -170,7 +186,7 @@ class _Registry:
 
 	def add(self, handler: Union[TypeHandler, type], withlist=False):
 		if isinstance(handler, type):
-			handler = TypeHandler(type),
+			handler = TypeHandler(handler)
 		self._handlers.append(handler)
 		if isinstance(handler, ListTypeHandler):
 			if withlist:
@@ -198,6 +214,7 @@ intHandler = Registry.add(
 		int,
 		fromJson=lambda v: v if isinstance(v, int) else int(float(v))),
 	withlist=True)
+jsonHandler = Registry.add(_PassthroughTypeHandler(object, name='Json'))
 xyzHandler = Registry.add(TupleTypeHandler(floatHandler, suffixes='xyz'))
 uvwHandler = Registry.add(TupleTypeHandler(floatHandler, suffixes='uvw'))
 rgbaHandler = Registry.add(TupleTypeHandler(floatHandler, suffixes='rgba'))
@@ -211,7 +228,8 @@ class AttrSchema:
 			jsonname: str = None,
 			default: _ValT = None,
 			flatprefix: str = None,
-			page: str = None):
+			page: str = None,
+			omitfalsy=False):
 		self.name = name
 		if isinstance(typehandler, TypeHandler):
 			self.typehandler = typehandler
@@ -221,9 +239,25 @@ class AttrSchema:
 		self.default = default
 		self.flatprefix = flatprefix
 		self.page = page
+		# when set, falsy values (like 0 or False) are left out of the JSON, not just None
+		# and empty values
+		self.omitfalsy = omitfalsy
+
 
+def _isOmittedJsonValue(val: _JsonValue):
+	return val is None or (isinstance(val, (str, list, dict, tuple)) and len(val) == 0)
 
 class ObjectSchema(TypeHandler):
+	"""
+	Describes how the attributes of a type are converted to and from JSON dicts.
+
+	Attributes that are None, or convert to None or an empty string/list/dict, are left out
+	of the JSON. When decoding, attributes that are missing from the JSON get the default
+	value from the type's constructor (unless the AttrSchema has its own default).
+
+	`compile()` generates an encoder and decoder specialized for the attributes, which are
+	then used by toJsonValue() and fromJsonValue().
+	"""
 	def __init__(
 			self,
 			t: type,
@@ -233,12 +267,127 @@ class ObjectSchema(TypeHandler):
 		self.attrs = list(attrs or [])
 		self.attrsbyname = {attr.name: attr for attr in self.attrs}
 		self.defaultpage = defaultpage
+		self._encode = None  # type: Callable[[Any], Dict[str, _JsonValue]]
+		self._decode = None  # type: Callable[..., Any]
+		self._paramdefaults = None  # type: Dict[str, Any]
 
 	def toJsonString(self, obj: _ValT):
 		raise Exception('{} does not support toJsonString()'.format(type(self)))
 
 	def toJsonValue(self, obj: _ValT, opts: JsonOpts=None):
-		raise NotImplementedError()
-
-	def fromJsonValue(self, val: _JsonValue, opts: JsonOpts=None):
-		raise NotImplementedError()
+		if obj is None:
+			return None
+		if self._encode is not None:
+			return self._encode(obj)
+		result = {}
+		for attr in self.attrs:
+			val = getattr(obj, attr.name)
+			if attr.omitfalsy and not val:
+				continue
+			if val is not None:
+				val = attr.typehandler.toJsonValue(val, opts=opts)
+			if not _isOmittedJsonValue(val):
+				result[attr.jsonname] = val
+		return result
+
+	def fromJsonValue(self, val: _JsonValue, opts: JsonOpts=None, **kwargs):
+		if val is None:
+			return None
+		if self._decode is not None:
+			return self._decode(val, **kwargs)
+		return self._decodeGeneric(val, kwargs)
+
+	def _decodeGeneric(self, val: Dict[str, _JsonValue], kwargs: Dict[str, Any]):
+		args = dict(kwargs)
+		jsonnames = set()
+		for attr in self.attrs:
+			jsonnames.add(attr.jsonname)
+			attrval = val.get(attr.jsonname)
+			if attrval is None:
+				args[attr.name] = self._defaultFor(attr)
+			else:
+				args[attr.name] = attr.typehandler.fromJsonValue(attrval)
+		for key, attrval in val.items():
+			if key not in jsonnames:
+				args[key] = attrval
+		return self.type(**args)
+
+	def _defaultFor(self, attr: AttrSchema):
+		if attr.default is not None:
+			return attr.default
+		if self._paramdefaults is None:
+			try:
+				params = inspect.signature(self.type).parameters
+			except (TypeError, ValueError):
+				params = {}
+			self._paramdefaults = {
+				name: param.default
+				for name, param in params.items()
+				if param.default is not inspect.Parameter.empty
+			}
+		return self._paramdefaults.get(attr.name)
+
+	def compile(self):
+		"""
+		Generates the specialized encoder and decoder for the type.
+		"""
+		namespace = {
+			'_type': self.type,
+			'_isinstance': isinstance,
+			'_droppable': (str, list, dict, tuple),
+			'_fallback': self._decodeGeneric,
+		}
+		encodelines = ['def encode(obj):', '\tresult = {}']
+		decodeargs = []
+		for i, attr in enumerate(self.attrs):
+			handler = attr.typehandler
+			conv = _conversionExpr(handler, 'toJsonValue', 'enc{}'.format(i), namespace)
+			encodelines.append('\tval = obj.{}{}'.format(attr.name, ' or None' if attr.omitfalsy else ''))
+			if conv:
+				encodelines.append('\tif val is not None:')
+				encodelines.append('\t\tval = {}'.format(conv.format('val')))
+			encodelines.append('\tif val is not None and (val or not _isinstance(val, _droppable)):')
+			encodelines.append('\t\tresult[{!r}] = val'.format(attr.jsonname))
+			namespace['default{}'.format(i)] = self._defaultFor(attr)
+			conv = _conversionExpr(handler, 'fromJsonValue', 'dec{}'.format(i), namespace)
+			if conv:
+				decodeargs.append('\t\t{}=default{} if val{} is None else {},'.format(
+					attr.name, i, i, conv.format('val{}'.format(i))))
+			else:
+				decodeargs.append('\t\t{}=default{} if val{} is None else val{},'.format(attr.name, i, i, i))
+		encodelines.append('\treturn result')
+		namespace['_jsonnames'] = frozenset(attr.jsonname for attr in self.attrs)
+		decodelines = [
+			'def decode(obj, **kwargs):',
+			'\tif not _jsonnames.issuperset(obj):',
+			'\t\treturn _fallback(obj, kwargs)',
+		]
+		for i, attr in enumerate(self.attrs):
+			decodelines.append('\tval{} = obj.get({!r})'.format(i, attr.jsonname))
+		decodelines += ['\treturn _type('] + decodeargs + ['\t\t**kwargs)']
+		exec('\n'.join(encodelines) + '\n\n' + '\n'.join(decodelines), namespace)
+		self._encode = namespace['encode']
+		self._decode = namespace['decode']
+		return self
+
+def _conversionExpr(handler: TypeHandler, method: str, name: str, namespace: Dict[str, Any]):
+	"""
+	Gets an expression template (with `{}` for the value) that converts a value with the
+	handler, or None if no conversion is needed.
+	"""
+	if isinstance(handler, _PassthroughTypeHandler):
+		return None
+	if isinstance(handler, _CustomTypeHandler):
+		func = handler.fromJsonFunc if method == 'fromJsonValue' else handler.toJsonFunc
+		if func is _identity:
+			return None
+		namespace[name] = func
+		return name + '({})'
+	if isinstance(handler, ObjectSchema):
+		namespace[name] = getattr(handler, method)
+		return name + '({})'
+	if type(handler) is ListTypeHandler and isinstance(handler.elementHandler, ObjectSchema):
+		namespace[name] = getattr(handler.elementHandler, method)
+		return '[' + name + '(v) for v in {}]'
+	namespace[name] = getattr(handler, method)
+	return name + '({})'
@@ -0,0 +1,128 @@
+"""
+Conversion of SVG path data into pattern point lists.
+
+This doesn't depend on anything from TouchDesigner, so that it can be run in worker
+processes when parsing large SVG files.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+import svg.path as svgpath
+
+# x, y pairs for each point (with offset and scale applied), the absolute distance
+# along the path at each point, whether the path is closed, and any warnings
+ParsedPath = Tuple[List[float], List[float], bool, List[str]]
+
+def parsePathData(rawpath: str, offset: Tuple[float, float], scale: float) -> ParsedPath:
+	parsed = parsePolylinePathData(rawpath, offset, scale)
+	if parsed is not None:
+		return parsed
+	coords, distances, closed, warnings = _parseGeneralPathData(rawpath)
+	return _transformPath(rawpath, coords, distances, closed, warnings, offset, scale)
+
+def parsePolylinePathData(rawpath: str, offset: Tuple[float, float], scale: float) -> Optional[ParsedPath]:
+	"""
+	Parses path data that only has straight lines, which is fast enough that it isn't worth
+	sending to a worker process. Returns None for other paths.
+	"""
+	polyline = svgpath.parse_polyline(rawpath)
+	if polyline is None:
+		return None
+	coords, distances, closed = polyline
+	return _transformPath(rawpath, coords, distances, closed, [], offset, scale)
+
+def _transformPath(
+		rawpath: str,
+		coords: List[float],
+		distances: List[float],
+		closed: bool,
+		warnings: List[str],
+		offset: Tuple[float, float],
+		scale: float) -> ParsedPath:
+	if len(coords) < 4:
+		raise Exception('Unsupported path (too short) {}'.format(rawpath))
+	offsetx, offsety = offset
+	coords = [
+		(val + (offsetx if i % 2 == 0 else offsety)) * scale
+		for i, val in enumerate(coords)
+	]
+	distances = [dist * scale for dist in distances]
+	return coords, distances, closed, warnings
+
+def _parseGeneralPathData(rawpath: str):
+	path = svgpath.parse_path(rawpath)
+	if len(path) < 2:
+		raise Exception('Unsupported path (too short) {}'.format(rawpath))
+	firstsegment = path[0]
+	if not isinstance(firstsegment, svgpath.Move):
+		raise Exception('Unsupported path (must start with Move) {}'.format(rawpath))
+	warnings = []
+	coords = [firstsegment.start.real, firstsegment.start.imag]
+	distances = [0]
+	distsofar = 0
+	for segment in path[1:]:
+		if isinstance(segment, (svgpath.CubicBezier, svgpath.QuadraticBezier)):
+			warnings.append('WARNING: treating bezier as line {}...'.format(rawpath[0:20]))
+		elif not isinstance(segment, svgpath.Line):
+			raise Exception('Unsupported path (can only contain Line after first segment) {} {}'.format(
+				type(segment), rawpath))
+		coords.append(segment.end.real)
+		coords.append(segment.end.imag)
+		distsofar += segment.length()
+		distances.append(distsofar)
+	return coords, distances, path.closed, warnings
+
+def _parsePathDataJob(job) -> Tuple[Optional[ParsedPath], Optional[str]]:
+	rawpath, offset, scale = job
+	try:
+		return parsePathData(rawpath, offset, scale), None
+	except Exception as e:
+		return None, str(e)
+
+def _isPythonExecutable(filepath: str):
+	return bool(filepath) and os.path.basename(filepath).lower().startswith('python') and os.path.isfile(filepath)
+
+def findWorkerPython(executable: str = None) -> Optional[str]:
+	"""
+	Gets the Python interpreter to start worker processes with, or None if there isn't one.
+	Inside a host application like TouchDesigner, sys.executable is the application itself,
+	which can't run the workers, so this looks for the interpreter of the same Python
+	installation next to it instead.
+	"""
+	if executable:
+		return executable if os.path.isfile(executable) else None
+	if _isPythonExecutable(sys.executable):
+		return sys.executable
+	dirpaths = [os.path.dirname(sys.executable or ''), sys.exec_prefix, os.path.join(sys.exec_prefix, 'bin')]
+	names = ['python.exe', 'python{}.{}'.format(*sys.version_info[:2]), 'python3', 'python']
+	for dirpath in dirpaths:
+		for name in names:
+			filepath = os.path.join(dirpath, name)
+			if dirpath and _isPythonExecutable(filepath):
+				return filepath
+	return None
+
+def parsePathDataInPool(
+		rawpaths: Sequence[str],
+		offset: Tuple[float, float],
+		scale: float,
+		workers: int,
+		executable: str) -> List[Tuple[Optional[ParsedPath], Optional[str]]]:
+	"""
+	Parses a batch of path data strings across a pool of worker processes, which are
+	started with the `executable` Python interpreter (see findWorkerPython()).
+	Results are returned in the same order as the inputs, with either the parsed path
+	or an error message for each one. Raises an exception if the workers fail.
+	"""
+	if not rawpaths:
+		return []
+	jobs = [(rawpath, offset, scale) for rawpath in rawpaths]
+	chunksize = max(1, len(jobs) // (workers * 4))
+	context = multiprocessing.get_context('spawn')
+	context.set_executable(executable)
+	with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+		return list(executor.map(_parsePathDataJob, jobs, chunksize=chunksize))
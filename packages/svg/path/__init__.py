@@ -1,2 +1,2 @@
 from .path import Path, Move, Line, Arc, CubicBezier, QuadraticBezier
-from .parser import parse_path
+from .parser import parse_path, parse_polyline
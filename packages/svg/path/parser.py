@@ -1,6 +1,7 @@
 # SVG Path specification parser
 
 import re
+from math import hypot
 from . import path
 
 COMMANDS = set('MmZzLlHhVvCcSsQqTtAa')
@@ -9,6 +10,9 @@ UPPERCASE = set('MZLHVCSQTA')
 COMMAND_RE = re.compile("([MmZzLlHhVvCcSsQqTtAa])")
 FLOAT_RE = re.compile("[-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?")
 
+CURVE_COMMAND_RE = re.compile("[CcSsQqTtAa]")
+POLYLINE_TOKEN_RE = re.compile("([MmZzLlHhVv])|(" + FLOAT_RE.pattern + ")")
+
 
 def _tokenize_path(pathdef):
     for x in COMMAND_RE.split(pathdef):
@@ -187,3 +191,99 @@ def parse_path(pathdef, current_pos=0j):
             current_pos = end
 
     return segments
+
+
+def parse_polyline(pathdef):
+    """Fast path for path data that only contains straight lines.
+
+    Handles a single subpath made of M/L/H/V/Z commands (absolute or
+    relative) without building segment objects. Returns a tuple of
+    (coords, distances, closed), where coords is a flat list of x, y
+    pairs for the start point followed by the end point of each segment,
+    and distances is the cumulative length along the path at each of
+    those points.
+
+    Returns None for anything else (curves, arcs, multiple subpaths,
+    malformed data), in which case parse_path() should be used.
+    """
+    if CURVE_COMMAND_RE.search(pathdef):
+        return None
+    tokens = POLYLINE_TOKEN_RE.findall(pathdef)
+    ntokens = len(tokens)
+    coords = []
+    distances = []
+    closed = False
+    command = None
+    x = y = startx = starty = 0.0
+    dist = 0.0
+    i = 0
+
+    while i < ntokens:
+        token, number = tokens[i]
+
+        if token:
+            # New command. Nothing is allowed after closing the path, and
+            # a second moveto would start another subpath.
+            if closed or (token in 'Mm' and coords):
+                return None
+            command = token
+            i += 1
+            if command in 'Zz':
+                if not coords:
+                    return None
+                if x != startx or y != starty:
+                    dist += hypot(startx - x, starty - y)
+                    x, y = startx, starty
+                    coords.append(x)
+                    coords.append(y)
+                    distances.append(dist)
+                closed = True
+            continue
+
+        # Implicit command, with the same rules as parse_path().
+        if command is None or command in 'Zz':
+            return None
+
+        if command in 'Hh':
+            newx = float(number)
+            if command == 'h':
+                newx += x
+            newy = y
+            i += 1
+        elif command in 'Vv':
+            newx = x
+            newy = float(number)
+            if command == 'v':
+                newy += y
+            i += 1
+        else:
+            if i + 1 >= ntokens or tokens[i + 1][0]:
+                return None
+            newx = float(number)
+            newy = float(tokens[i + 1][1])
+            if command in 'ml':
+                newx += x
+                newy += y
+            i += 2
+
+        if command in 'Mm':
+            x = startx = newx
+            y = starty = newy
+            coords.append(x)
+            coords.append(y)
+            distances.append(0.0)
+            # Implicit moveto commands are treated as lineto commands.
+            command = 'L' if command == 'M' else 'l'
+        elif not coords:
+            # Has to start with a moveto.
+            return None
+        else:
+            dist += hypot(newx - x, newy - y)
+            x, y = newx, newy
+            coords.append(x)
+            coords.append(y)
+            distances.append(dist)
+
+    if not coords:
+        return None
+    return coords, distances, closed
@@ -0,0 +1,109 @@
+"""
+Minimal stand-ins for the TouchDesigner environment, so that the pattern model modules in
+lib/ can be imported and tested with a regular Python interpreter.
+
+Import this before any of the lib modules.
+"""
+
+import builtins
+import fnmatch
+import importlib
+import math
+import os
+import struct
+import sys
+import types
+
+_rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def float32(val: float) -> float:
+	"""Rounds a value the way TouchDesigner's float32 vectors store it."""
+	return struct.unpack('f', struct.pack('f', val))[0]
+
+class Vector:
+	"""Stand-in for tdu.Vector, which stores its components as float32."""
+	def __init__(self, *args):
+		if len(args) == 1:
+			args = tuple(args[0])
+		args = list(args) + [0.0] * (3 - len(args))
+		self.x, self.y, self.z = float32(args[0]), float32(args[1]), float32(args[2])
+
+	def __iter__(self):
+		return iter((self.x, self.y, self.z))
+
+	def __getitem__(self, i):
+		return (self.x, self.y, self.z)[i]
+
+	def __len__(self):
+		return 3
+
+	def __add__(self, other):
+		other = Vector(other)
+		return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+	def __sub__(self, other):
+		other = Vector(other)
+		return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+	def __mul__(self, scale):
+		return type(self)(self.x * scale, self.y * scale, self.z * scale)
+
+	def distance(self, other):
+		other = Vector(other)
+		return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+class Position(Vector):
+	pass
+
+class Matrix:
+	pass
+
+def _match(pattern, names):
+	return [name for name in names if fnmatch.fnmatchcase(name, pattern)]
+
+tdu = types.SimpleNamespace(
+	Vector=Vector, Position=Position, Matrix=Matrix, match=_match, legalName=lambda name: name,
+	remap=lambda val, inlow, inhigh, outlow, outhigh: outlow + (val - inlow) * (outhigh - outlow) / (inhigh - inlow))
+
+def _install():
+	if 'lib' in sys.modules and getattr(sys.modules['lib'], '_tdstubs', False):
+		return
+	builtins.tdu = tdu
+	builtins.mod = types.SimpleNamespace(tdu=tdu)
+	builtins.project = types.SimpleNamespace(folder=_rootdir, name='tests')
+	# operator types used in annotations
+	for name in ('OP', 'COMP', 'DAT', 'CHOP', 'SOP', 'TOP'):
+		setattr(builtins, name, type(name, (), {}))
+	for path in (os.path.join(_rootdir, 'lib'), os.path.join(_rootdir, 'packages')):
+		if path not in sys.path:
+			sys.path.insert(0, path)
+	storetools = types.ModuleType('TDStoreTools')
+	storetools.DependDict = dict
+	storetools.DependList = list
+	storetools.StorageManager = object
+	sys.modules.setdefault('TDStoreTools', storetools)
+	# lib modules use relative imports for common, but import the other modules by name,
+	# the way TouchDesigner resolves DAT modules
+	package = types.ModuleType('lib')
+	package.__path__ = [os.path.join(_rootdir, 'lib')]
+	package._tdstubs = True
+	sys.modules['lib'] = package
+
+_install()
+
+# lib modules that others import by name, which need to be loaded first
+_moduleDependencies = {
+	'pattern_binary': ['pattern_model'],
+	'pattern_groups': ['pattern_model'],
+	'pattern_state': ['pattern_model'],
+	'pattern_loader': ['pattern_model', 'pattern_binary', 'pattern_groups', 'pattern_state'],
+}
+
+def loadModule(name: str):
+	if name in sys.modules:
+		return sys.modules[name]
+	for dependency in _moduleDependencies.get(name, []):
+		loadModule(dependency)
+	module = importlib.import_module('lib.' + name)
+	sys.modules[name] = module
+	return module
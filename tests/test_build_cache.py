@@ -0,0 +1,54 @@
+import inspect
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import tdstubs
+
+pattern_loader = tdstubs.loadModule('pattern_loader')
+records = tdstubs.loadModule('records')
+
+def _sourceUnavailable(module):
+	raise OSError('could not get source code')
+
+class _Host:
+	def __init__(self, cachedir: str):
+		self.par = types.SimpleNamespace(Buildcachedir=types.SimpleNamespace(eval=lambda: cachedir))
+		self.buildcache = None
+		self.events = []
+
+	def _LogEvent(self, event, indentafter=False, unindentbefore=False):
+		self.events.append(event)
+
+	_GetBuildCache = pattern_loader.PatternBuilder._GetBuildCache
+
+class BuilderCodeVersionTest(unittest.TestCase):
+	def test_usesCompiledCodeWithoutSource(self):
+		with mock.patch.object(inspect, 'getsource', _sourceUnavailable):
+			version = pattern_loader._getBuilderCodeVersion()
+			self.assertIsNotNone(version)
+			self.assertEqual(version, pattern_loader._getBuilderCodeVersion())
+
+	def test_includesRecordSchemas(self):
+		def compile(self):
+			return self
+		compile.__module__ = records.__name__
+		with mock.patch.object(inspect, 'getsource', _sourceUnavailable):
+			version = pattern_loader._getBuilderCodeVersion()
+			with mock.patch.object(records.ObjectSchema, 'compile', compile):
+				self.assertNotEqual(version, pattern_loader._getBuilderCodeVersion())
+
+	def test_cacheFollowsCodeChanges(self):
+		with tempfile.TemporaryDirectory() as cachedir:
+			host = _Host(cachedir)
+			cache = host._GetBuildCache()
+			with mock.patch.object(pattern_loader, '_getBuilderCodeVersion', return_value='changed'):
+				self.assertIs(cache, host._GetBuildCache())
+				self.assertEqual('changed', cache.codeversion)
+			with mock.patch.object(pattern_loader, '_getBuilderCodeVersion', return_value=None):
+				self.assertIsNone(host._GetBuildCache())
+			self.assertTrue(any('Build cache disabled' in event for event in host.events))
+
+if __name__ == '__main__':
+	unittest.main()
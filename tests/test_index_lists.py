@@ -0,0 +1,27 @@
+import unittest
+
+import tdstubs
+
+common = tdstubs.loadModule('common')
+from common import formatIndexList, parseIndexList, parseValueList
+
+class IndexListTest(unittest.TestCase):
+	def test_formatsRunsAsRanges(self):
+		self.assertEqual('0-4 7 9 10 12-14', formatIndexList([0, 1, 2, 3, 4, 7, 9, 10, 12, 13, 14]))
+
+	def test_roundTrip(self):
+		indices = [0, 1, 2, 5, 6, 8, 9, 10, 11, 40]
+		self.assertEqual(indices, parseIndexList(formatIndexList(indices)))
+
+	def test_parsesOldFormat(self):
+		self.assertEqual([3, 4, 5, 9], parseIndexList('3 4 5 9'))
+
+	def test_parsesNonIndexValues(self):
+		self.assertEqual([1.5, 2, 3, 4, -1], parseIndexList('1.5 2-4 -1'))
+		self.assertEqual([], parseIndexList(''))
+
+	def test_valueListsDontExpandRanges(self):
+		self.assertEqual(['2-4', 5], parseValueList('2-4 5'))
+
+if __name__ == '__main__':
+	unittest.main()
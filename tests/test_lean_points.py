@@ -0,0 +1,49 @@
+import json
+import math
+import unittest
+
+import tdstubs
+
+pattern_model = tdstubs.loadModule('pattern_model')
+from pattern_model import PathInfo, PatternData, PointData, ShapeInfo
+
+def _makePattern():
+	positions = [[0.0, 0.0, 0.0], [3.0, 0.0, 0.0], [3.0, 4.0, 0.0], [0.0, 0.0, 0.0]]
+	shape = ShapeInfo(
+		shapeindex=0, shapename='tri', shapepath='/g/tri', parentpath='/g',
+		points=[PointData(pos=pos) for pos in positions],
+		center=[2.0, 4 / 3, 0.0], shapelength=12.0)
+	path = PathInfo(
+		shapename='line', shapepath='/line',
+		points=[PointData(pos=[0.125, 0.5, 0.0]), PointData(pos=[1.125, 0.5, 0.25])])
+	return PatternData(shapes=[shape], paths=[path], title='lean')
+
+class LeanPointsTest(unittest.TestCase):
+	def test_decodesLeanFile(self):
+		# the same path a lean file takes, written to JSON text and loaded back
+		text = json.dumps(_makePattern().ToJsonDict(pointprecision=0.001))
+		obj = json.loads(text)
+		self.assertIn('pointdeltas', obj['shapes'][0])
+		self.assertNotIn('points', obj['shapes'][0])
+		loaded = PatternData.FromJsonDict(obj)
+		shape = loaded.shapes[0]
+		self.assertEqual(
+			[[0.0, 0.0, 0.0], [3.0, 0.0, 0.0], [3.0, 4.0, 0.0], [0.0, 0.0, 0.0]],
+			[[round(val, 6) for val in point.pos] for point in shape.points])
+		self.assertEqual([0.0, 3.0, 7.0, 12.0], [round(point.absdist, 6) for point in shape.points])
+		self.assertEqual([0.0, 0.25, round(7 / 12, 6), 1.0], [round(point.reldist, 6) for point in shape.points])
+		self.assertEqual('/g', shape.parentpath)
+		path = loaded.paths[0]
+		self.assertEqual([1.125, 0.5, 0.25], [round(val, 6) for val in path.points[1].pos])
+		self.assertTrue(math.isclose(path.points[1].absdist, math.sqrt(1.0625)))
+
+	def test_matchesFullPointsWithinPrecision(self):
+		patterndata = _makePattern()
+		full = PatternData.FromJsonDict(json.loads(json.dumps(patterndata.ToJsonDict())))
+		lean = PatternData.FromJsonDict(json.loads(json.dumps(patterndata.ToJsonDict(pointprecision=0.01))))
+		for fullpoint, leanpoint in zip(full.shapes[0].points, lean.shapes[0].points):
+			for fullval, leanval in zip(fullpoint.pos, leanpoint.pos):
+				self.assertAlmostEqual(fullval, leanval, delta=0.005)
+
+if __name__ == '__main__':
+	unittest.main()
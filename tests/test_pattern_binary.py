@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import unittest
+
+import tdstubs
+
+pattern_model = tdstubs.loadModule('pattern_model')
+pattern_binary = tdstubs.loadModule('pattern_binary')
+from pattern_model import GroupInfo, PathInfo, PatternData, PointData, SequenceStep, ShapeInfo
+from pattern_binary import PatternFormatError, patternFromBytes, patternToBytes, readPatternFile, writePatternFile
+
+def _makePoints(x: float, y: float, closed=True):
+	positions = [[x, y, 0.0], [x + 1.5, y, 0.0], [x + 1.5, y + 2.25, 0.0]]
+	if closed:
+		positions.append(list(positions[0]))
+	return [
+		PointData(pos=pos, absdist=i * 1.25, reldist=i / (len(positions) - 1))
+		for i, pos in enumerate(positions)
+	]
+
+def _makePattern():
+	shapes = [
+		ShapeInfo(
+			shapeindex=0, shapename='a', shapepath='/g1/a', parentpath='/g1',
+			points=_makePoints(0, 0), center=[0.5, 0.75, 0.0], shapelength=6.0,
+			color=[255, 0, 128, 255], depthlayer=2, dupcount=1, radius=1.25, rotateaxis=45.0),
+		# missing attributes are stored as NaN or sentinels in the binary arrays
+		ShapeInfo(
+			shapeindex=1, shapename=None, shapepath='/g1/b', parentpath='/g1',
+			points=_makePoints(3, 1, closed=False)),
+		ShapeInfo(
+			shapeindex=2, shapename='c', shapepath='/g2/c', parentpath='/g2',
+			points=_makePoints(-2, 4), color=[10, 20, 30], depthlayer='top'),
+	]
+	groups = [
+		GroupInfo(
+			groupname='g1', grouppath='/g1', shapeindices=[1, 0],
+			sequencesteps=[
+				SequenceStep(sequenceindex=0, shapeindices=[0]),
+				SequenceStep(sequenceindex=1, shapeindices=[1], isdefault=True),
+			]),
+		GroupInfo(
+			groupname='all', inferencetype='color', inferredfromvalue='#ff0000',
+			depthlayer=1, shapeindices=[0, 1, 2], rotateaxis=90.0),
+		GroupInfo(groupname='empty'),
+	]
+	return PatternData(
+		shapes=shapes,
+		paths=[PathInfo(shapename='p', shapepath='/p', points=_makePoints(5, 5, closed=False))],
+		groups=groups,
+		title='test pattern', svgwidth=100.0, svgheight=50.0, scale=0.5)
+
+def _comparableJson(patterndata: PatternData):
+	# compares the serialized output, which is what the binary format needs to preserve
+	return json.loads(json.dumps(patterndata.ToJsonDict()))
+
+class PatternBinaryRoundTripTest(unittest.TestCase):
+	def test_bytesRoundTrip(self):
+		patterndata = _makePattern()
+		loaded = patternFromBytes(patternToBytes(patterndata))
+		self.assertEqual(_comparableJson(patterndata), _comparableJson(loaded))
+
+	def test_preservesShapesGroupsAndSteps(self):
+		loaded = patternFromBytes(patternToBytes(_makePattern()))
+		self.assertEqual([0, 1, 2], [shape.shapeindex for shape in loaded.shapes])
+		self.assertEqual(['a', None, 'c'], [shape.shapename for shape in loaded.shapes])
+		self.assertEqual(['all', 'empty', 'g1'], [group.groupname for group in loaded.groups])
+		group = loaded.getGroup('g1')
+		self.assertEqual([0, 1], group.shapeindices)
+		self.assertEqual([[0], [1]], [step.shapeindices for step in group.sequencesteps])
+		self.assertEqual([None, True], [step.isdefault for step in group.sequencesteps])
+		self.assertEqual('#ff0000', loaded.getGroup('all').inferredfromvalue)
+		self.assertEqual([], loaded.getGroup('empty').shapeindices)
+
+	def test_preservesMissingAttributes(self):
+		loaded = patternFromBytes(patternToBytes(_makePattern()))
+		shape = loaded.shapes[1]
+		self.assertIsNone(shape.center)
+		self.assertIsNone(shape.shapelength)
+		self.assertIsNone(shape.color)
+		self.assertIsNone(shape.radius)
+		self.assertIsNone(shape.rotateaxis)
+		self.assertIsNone(shape.depthlayer)
+		self.assertEqual(0, shape.dupcount)
+		self.assertEqual([10, 20, 30], loaded.shapes[2].color)
+		self.assertEqual('top', loaded.shapes[2].depthlayer)
+
+	def test_clampsColorsToInt16(self):
+		patterndata = _makePattern()
+		patterndata.shapes[0].color = [40000, -5, 255.0, 1]
+		loaded = patternFromBytes(patternToBytes(patterndata))
+		self.assertEqual([32767, 0, 255, 1], loaded.shapes[0].color)
+
+	def test_rejectsOtherData(self):
+		with self.assertRaises(PatternFormatError):
+			patternFromBytes(b'{"shapes": []}')
+
+class PatternBinaryFileTest(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.filepath = os.path.join(self.tempdir.name, 'pattern.patb')
+		self.patterndata = _makePattern()
+		writePatternFile(self.filepath, self.patterndata)
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_eagerAndLazyLoadsMatch(self):
+		eager = readPatternFile(self.filepath)
+		lazy = readPatternFile(self.filepath, lazypoints=True)
+		self.assertFalse(lazy.shapetable.pointsloaded)
+		self.assertEqual(_comparableJson(self.patterndata), _comparableJson(eager))
+		self.assertEqual(_comparableJson(eager), _comparableJson(lazy))
+		self.assertTrue(lazy.shapetable.pointsloaded)
+
+	def test_lazyLoadDefersPoints(self):
+		lazy = readPatternFile(self.filepath, lazypoints=True)
+		table = lazy.shapetable
+		self.assertEqual(11, table.pointcount)
+		self.assertEqual(['a', None, 'c'], [shape.shapename for shape in lazy.shapes])
+		self.assertEqual([0.5, 0.75, 0.0], lazy.shapes[0].center)
+		self.assertFalse(table.pointsloaded)
+		self.assertEqual([3.0, 1.0, 0.0], lazy.shapes[1].points[0].pos)
+		self.assertEqual([[-2.0, 4.0, 0.0]] * 2, [lazy.shapes[2].points[i].pos for i in (0, 3)])
+
+	def test_lazyLoadShapeAttributesDontReadPoints(self):
+		eager = readPatternFile(self.filepath)
+		lazy = readPatternFile(self.filepath, lazypoints=True)
+		self.assertEqual(
+			[(shape.isopenloop, shape.istriangle) for shape in eager.shapes],
+			[(shape.isopenloop, shape.istriangle) for shape in lazy.shapes])
+		self.assertEqual([True, True, True], [shape.istriangle for shape in lazy.shapes])
+		self.assertFalse(lazy.shapetable.pointsloaded)
+
+	def test_lazyLoadReadsAllPointColumnsAtOnce(self):
+		lazy = readPatternFile(self.filepath, lazypoints=True)
+		self.assertEqual([0.0, 0.0, 0.0], lazy.shapes[0].points[0].pos)
+		self.assertTrue(lazy.shapetable.pointsloaded)
+		self.assertEqual([0.0, 1.25, 2.5, 3.75], [point.absdist for point in lazy.shapes[0].points])
+
+	def test_lazyLoadDoesntHoldFile(self):
+		lazy = readPatternFile(self.filepath, lazypoints=True)
+		# replacing the file works while the points are unread, but they can't be loaded after
+		writePatternFile(self.filepath, _makePattern())
+		os.utime(self.filepath, ns=(0, 0))
+		with self.assertRaises(PatternFormatError):
+			lazy.shapes[0].points[0].pos
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,193 @@
+import json
+import os
+import tempfile
+import types
+import unittest
+
+import tdstubs
+
+pattern_loader = tdstubs.loadModule('pattern_loader')
+pattern_binary = tdstubs.loadModule('pattern_binary')
+from pattern_model import GroupInfo, PatternData, PointData, ShapeInfo
+
+class _FakeOp:
+	"""Accepts whatever the loader does to the table DATs and CHOPs, without keeping it."""
+	def __init__(self, par=None):
+		self.par = par or types.SimpleNamespace()
+		self.numRows = 0
+		self.text = ''
+
+	def appendRow(self, *args, **kwargs):
+		self.numRows += 1
+
+	def __setitem__(self, key, value):
+		pass
+
+	def __getitem__(self, key):
+		return _FakeOp()
+
+	def __len__(self):
+		return 0
+
+	def __iter__(self):
+		return iter([])
+
+	def __getattr__(self, name):
+		return lambda *args, **kwargs: _FakeOp()
+
+class _FakeVertex:
+	def __init__(self, index: int):
+		self.index = index
+		self.point = types.SimpleNamespace(x=0.0, y=0.0, z=0.0)
+		self.absRelDist = [0.0, 0.0]
+		self.uv = [0.0, 0.0, 0.0]
+		self.centerPos = [0.0, 0.0, 0.0]
+
+class _FakePoly:
+	def __init__(self, count: int):
+		self.vertices = [_FakeVertex(i) for i in range(count)]
+		self.shapeIndex = [0]
+		self.rotateAxis = [0.0, 0.0, 0.0]
+		self.Cd = [0.0, 0.0, 0.0, 0.0]
+
+	def __getitem__(self, index):
+		return self.vertices[index]
+
+	def __len__(self):
+		return len(self.vertices)
+
+	def __iter__(self):
+		return iter(self.vertices)
+
+class _FakeGroup:
+	def __init__(self, groups: dict, name: str):
+		self.groups = groups
+		self.name = name
+		self.prims = []
+
+	def add(self, prim):
+		self.prims.append(prim)
+
+	def destroy(self):
+		del self.groups[self.name]
+
+class _FakeSop:
+	def __init__(self):
+		self.prims = []
+		self.points = []
+		self.primGroups = {}
+		self.primAttribs = _FakeOp()
+		self.vertexAttribs = _FakeOp()
+
+	def clear(self):
+		self.prims = []
+
+	def copy(self, othersop):
+		pass
+
+	def appendPoly(self, count, addPoints=True, closed=True):
+		poly = _FakePoly(count)
+		self.prims.append(poly)
+		return poly
+
+	def createPrimGroup(self, name):
+		self.primGroups[name] = _FakeGroup(self.primGroups, name)
+
+	def snapshot(self):
+		return {
+			'prims': [
+				(
+					poly.shapeIndex[0], list(poly.rotateAxis), list(poly.Cd),
+					[(v.point.x, v.point.y, v.point.z, v.absRelDist[0], v.absRelDist[1]) for v in poly.vertices],
+				)
+				for poly in self.prims
+			],
+			'groups': {
+				name: [self.prims.index(prim) for prim in group.prims]
+				for name, group in self.primGroups.items()
+			},
+		}
+
+class _FakeComp:
+	def __init__(self, jsonfilepath: str, lazy: bool):
+		self.par = types.SimpleNamespace(
+			Lazyloadpoints=types.SimpleNamespace(eval=lambda: lazy),
+			Autoexport=False)
+		self.path = '/loader'
+		self.valid = True
+		self.buildgeometry = _FakeSop()
+		self.shapepanels = _FakeSop()
+		self.ops = {
+			'pattern_json': _FakeOp(types.SimpleNamespace(file=types.SimpleNamespace(eval=lambda: jsonfilepath))),
+			'build_geometry': self.buildgeometry,
+			'shape_panels': _FakeOp(),
+		}
+		self.ops['shape_panels'].cook = self._cookShapePanels
+		self.loader = None
+
+	def _cookShapePanels(self, force=False):
+		# the shape_panels script SOP converts the build_geometry SOP when it cooks
+		self.shapepanels = _FakeSop()
+		self.loader.ConvertShapePathsToPanels(self.shapepanels, self.buildgeometry)
+
+	def op(self, name):
+		return self.ops[name] if name in self.ops else _FakeOp()
+
+def _makePattern():
+	shapes = []
+	for i in range(4):
+		x = float(i * 2)
+		shapes.append(ShapeInfo(
+			shapeindex=i, shapename='s{}'.format(i), shapepath='/s{}'.format(i),
+			points=[PointData(pos=pos, absdist=j, reldist=j / 3) for j, pos in enumerate([
+				[x, 0.0, 0.0], [x + 1, 0.0, 0.0], [x + 1, 1.0, 0.0], [x, 0.0, 0.0]])],
+			color=[i * 50, 0, 255, 255] if i % 2 else None, rotateaxis=i * 10.0 or None))
+	groups = [
+		GroupInfo(groupname='even', shapeindices=[0, 2]),
+		GroupInfo(groupname='odd', shapeindices=[1, 3]),
+	]
+	return PatternData(shapes=shapes, groups=groups, title='loadertest')
+
+class PatternLoaderGeometryTest(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.jsonfilepath = os.path.join(self.tempdir.name, 'loadertest.json')
+		with open(self.jsonfilepath, 'w') as outfile:
+			json.dump(_makePattern().ToJsonDict(), outfile)
+		pattern_binary.convertJsonFile(self.jsonfilepath)
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def _load(self, lazy: bool):
+		comp = _FakeComp(self.jsonfilepath, lazy=lazy)
+		comp.loader = pattern_loader.PatternLoader(comp)
+		comp.loader.enablelogging = False
+		comp.loader.LoadPattern()
+		return comp
+
+	def test_lazyLoadBuildsSameGeometryOnFirstUse(self):
+		eager = self._load(lazy=False)
+		self.assertTrue(eager.loader.geometrybuilt)
+		lazy = self._load(lazy=True)
+		self.assertFalse(lazy.loader.geometrybuilt)
+		self.assertFalse(lazy.loader.patterndata.shapetable.pointsloaded)
+		self.assertEqual([], lazy.buildgeometry.prims)
+		# cooking shape_panels is what uses the geometry
+		lazy.ops['shape_panels'].cook(force=True)
+		self.assertTrue(lazy.loader.geometrybuilt)
+		self.assertEqual(eager.buildgeometry.snapshot(), lazy.buildgeometry.snapshot())
+		self.assertEqual(4, len(lazy.buildgeometry.prims))
+		self.assertEqual(eager.shapepanels.snapshot(), lazy.shapepanels.snapshot())
+		self.assertEqual(4, len(lazy.shapepanels.prims))
+
+	def test_lazyLoadClearsPreviousGeometry(self):
+		comp = self._load(lazy=False)
+		self.assertEqual(4, len(comp.buildgeometry.prims))
+		comp.par.Lazyloadpoints = types.SimpleNamespace(eval=lambda: True)
+		comp.loader.LoadPattern()
+		self.assertEqual([], comp.buildgeometry.prims)
+		self.assertEqual({}, comp.buildgeometry.primGroups)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,52 @@
+import math
+import unittest
+
+import tdstubs
+
+pattern_model = tdstubs.loadModule('pattern_model')
+from pattern_model import PathInfo, PointData, ShapeInfo
+
+# relative precision of float32, which TouchDesigner vectors (and so the point positions
+# before the shape table) are stored as
+_Float32Tolerance = 2 ** -23
+
+def _makePoints():
+	return [
+		PointData(pos=[x * 0.1, y * 0.37, 0.0])
+		for x, y in [(1, 2), (3.3, 4.7), (5.9, 1.1), (1, 2)]
+	]
+
+class ShapeTablePrecisionTest(unittest.TestCase):
+	def assertPositionsClose(self, expected, actual):
+		self.assertEqual(len(expected), len(actual))
+		for expectedpos, actualpos in zip(expected, actual):
+			for expectedval, actualval in zip(expectedpos, actualpos):
+				self.assertTrue(
+					math.isclose(expectedval, actualval, rel_tol=_Float32Tolerance * 4, abs_tol=1e-6),
+					'{} != {}'.format(expectedpos, actualpos))
+
+	def test_storesPositionsAtFullPrecision(self):
+		points = _makePoints()
+		shape = ShapeInfo(points=points)
+		self.assertEqual([point.pos for point in points], [point.pos for point in shape.points])
+
+	def test_transformsMatchVectorsWithinFloat32Tolerance(self):
+		# the table keeps float64 values, so results match the earlier tdu.Vector based
+		# transforms within float32 tolerance rather than exactly
+		shape = ShapeInfo(points=_makePoints())
+		path = PathInfo(points=_makePoints())
+		for item in (shape, path):
+			item.offsetPoints(tdstubs.Vector(0.123, -4.56, 0))
+			item.scalePoints(1.7)
+		self.assertPositionsClose(
+			[point.pos for point in path.points],
+			[point.pos for point in shape.points])
+
+	def test_detectsOpenLoops(self):
+		shape = ShapeInfo(points=_makePoints())
+		self.assertTrue(shape.table.isOpenLoop(shape._row))
+		shape.points = _makePoints()[:3]
+		self.assertFalse(shape.table.isOpenLoop(shape._row))
+
+if __name__ == '__main__':
+	unittest.main()
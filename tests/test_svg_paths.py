@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import tdstubs
+
+from pattern_svg_paths import findWorkerPython, parsePathData, parsePathDataInPool
+
+class FindWorkerPythonTest(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.appfilepath = os.path.join(self.tempdir.name, 'TouchDesigner.exe')
+		open(self.appfilepath, 'w').close()
+
+	def tearDown(self):
+		self.tempdir.cleanup()
+
+	def test_usesConfiguredExecutable(self):
+		self.assertEqual(self.appfilepath, findWorkerPython(self.appfilepath))
+		self.assertIsNone(findWorkerPython(os.path.join(self.tempdir.name, 'missing')))
+
+	def test_findsPythonNextToHostApplication(self):
+		pythonfilepath = os.path.join(self.tempdir.name, 'python.exe')
+		with mock.patch.object(sys, 'executable', self.appfilepath), \
+				mock.patch.object(sys, 'exec_prefix', self.tempdir.name):
+			self.assertIsNone(findWorkerPython())
+			open(pythonfilepath, 'w').close()
+			self.assertEqual(pythonfilepath, findWorkerPython())
+
+class ParsePathDataInPoolTest(unittest.TestCase):
+	def test_matchesInProcessParsing(self):
+		rawpaths = ['M0,0 C1,0 1,1 0,1 Z', 'M0,0 L2,0 L2,2 Z', 'M0,0']
+		expected = []
+		for rawpath in rawpaths:
+			try:
+				expected.append((parsePathData(rawpath, (1, 2), 0.5), None))
+			except Exception as e:
+				expected.append((None, str(e)))
+		results = parsePathDataInPool(rawpaths, (1, 2), 0.5, workers=2, executable=findWorkerPython())
+		self.assertEqual(expected, [(parsed and tuple(parsed), error) for parsed, error in results])
+
+if __name__ == '__main__':
+	unittest.main()